@@ -0,0 +1,873 @@
+#!/usr/bin/env python3
+"""
+Fan Control asyncio mode
+
+An asyncio-native control core and an ASGI application serving the same
+routes as web_app.py. Idle SSE streams and long-polls are coroutines waiting
+on a shared asyncio.Event, timers are loop.call_at handles and the button input loop
+is a task, so thousands of clients share one event loop instead of one OS
+thread each. Relay writes still run on the hardware owner thread; the loop
+awaits their futures without blocking.
+
+Run with:  python async_app.py   (or: uvicorn async_app:app --port 5002)
+"""
+
+import asyncio
+import json
+import os
+import re
+import threading
+import time
+from urllib.parse import parse_qs
+
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+from werkzeug.http import http_date
+
+import fan_control
+import metrics
+import tracing
+from control_daemon import ControlServer
+from event_log import get_logger, ring_buffer
+from hardware_owner import HardwareTimeout, hardware_owner
+from schedules import ScheduleBook
+from sensors import SensorHub
+from speed_history import SpeedHistory
+from state_events import StateBroadcaster
+from state_journal import StateJournal
+from usage import UsageStore
+
+log = get_logger('web')
+
+# Seconds between keep-alive comments on idle event streams
+EVENT_STREAM_KEEPALIVE = 15
+
+# Longest a ?wait= long-poll on /api/status may block
+MAX_LONG_POLL_WAIT = 60
+
+# Daily buckets in a /api/usage response unless ?days= says otherwise
+USAGE_DEFAULT_DAYS = 7
+
+
+# === ASYNCIO TIMERS ===
+
+class AsyncScheduledCall:
+    """Handle for a callback scheduled on an AsyncioScheduler."""
+
+    def __init__(self, scheduler, deadline, callback, args):
+        self._scheduler = scheduler
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+        self._timer = None
+
+    def cancel(self):
+        """Cancel the call. Safe from any thread, and after it fired."""
+        if not self._scheduler._finish(self):
+            return
+        if self._timer is not None:
+            self._scheduler._in_loop(self._timer.cancel)
+
+    def remaining(self):
+        """Seconds until the deadline (never negative)."""
+        return max(0.0, self.deadline - self._scheduler.clock())
+
+    def _arm(self):
+        if self.cancelled:
+            return
+        loop = self._scheduler.loop
+        self._timer = loop.call_at(loop.time() + self.remaining(), self._fire)
+
+    def _fire(self):
+        if not self._scheduler._finish(self):
+            return
+        # Timer callbacks change fan state, so they run on the hardware owner;
+        # handing them off keeps the loop from ever blocking on GPIO.
+        future = hardware_owner.submit(self.callback, *self.args, expires=False)
+        future.add_done_callback(_report_failure)
+
+
+class AsyncioScheduler:
+    """DeadlineScheduler-compatible scheduler backed by loop.call_at."""
+
+    def __init__(self, loop, clock=time.monotonic):
+        self.loop = loop
+        self.clock = clock
+        self._pending = 0
+        self._calls = set()  # calls that have not fired or been cancelled
+        # Calls are scheduled and cancelled on the hardware owner thread and
+        # fire on the loop thread
+        self._lock = threading.Lock()
+
+    def call_at(self, deadline, callback, *args):
+        """Schedule callback(*args) at an absolute clock() deadline."""
+        call = AsyncScheduledCall(self, deadline, callback, args)
+        with self._lock:
+            self._pending += 1
+            self._calls.add(call)
+        self._in_loop(call._arm)
+        return call
+
+    def call_later(self, delay, callback, *args):
+        """Schedule callback(*args) to run after delay seconds."""
+        return self.call_at(self.clock() + delay, callback, *args)
+
+    def pending(self):
+        return self._pending
+
+    def stop(self):
+        """Cancel every pending call."""
+        with self._lock:
+            calls = list(self._calls)
+        for call in calls:
+            call.cancel()
+
+    def _finish(self, call):
+        # Mark call fired or cancelled; False if it already was
+        with self._lock:
+            if call.cancelled:
+                return False
+            call.cancelled = True
+            self._pending -= 1
+            self._calls.discard(call)
+            return True
+
+    def _in_loop(self, func):
+        # Fan methods run on the hardware owner thread, not the loop thread
+        if self._on_loop_thread():
+            func()
+        else:
+            self.loop.call_soon_threadsafe(func)
+
+    def _on_loop_thread(self):
+        try:
+            return asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
+
+
+def _report_failure(future):
+    if not future.cancelled() and future.exception() is not None:
+        log.error("Error in scheduled callback: %s", future.exception())
+
+
+# === ASYNC CONTROL CORE ===
+
+class AsyncFanCore:
+    """Async equivalents of the fan controls, for use inside an event loop."""
+
+    def __init__(self, registry=None):
+        self.registry = registry or fan_control.registry
+        self.default_fan = self.registry.default
+        self.broadcaster = StateBroadcaster(lambda version: dumps(self.build_status(version)))
+        self.history = SpeedHistory()
+        self.schedules = ScheduleBook(self.registry, self.run_schedule)
+        self.sensors = SensorHub(self.registry)
+        self.loop = None
+        self.control_server = None
+        self.journal = None
+        self.usage_store = None
+        self._poll_task = None
+
+    def start(self):
+        """Take over the hardware and attach to the running loop."""
+        if self.loop is not None:
+            return
+        self.loop = asyncio.get_running_loop()
+        self.registry.use_scheduler(AsyncioScheduler(self.loop))
+        self.registry.add_listener(lambda fan: self.broadcaster.publish())
+        self.history.attach(self.registry)
+
+        # The button input loop (edge verification or polling) is a task on the loop
+        fan_control.acquire_gpio_lock()
+        fan_control.init(start_polling=lambda: self.loop.call_soon_threadsafe(self.start_button_polling))
+
+        # Runtime and energy totals carry on from the last run
+        self.usage_store = UsageStore()
+        self.usage_store.attach(self.registry)
+
+        # Bring back each fan's last speed and timers (off if it has none),
+        # then journal every change from here on
+        self.journal = StateJournal()
+        self.journal.restore(self.registry)
+        self.journal.attach(self.registry)
+
+        # Recurring schedules and sensor-driven auto mode run from here on
+        self.schedules.start()
+        self.sensors.start()
+
+        # Serve the CLI and scripts from this process, so they share its state
+        self.control_server = ControlServer(self.registry)
+        self.control_server.start()
+
+    def stop(self):
+        if self.control_server is not None:
+            self.control_server.stop()
+            self.control_server = None
+        if self._poll_task is not None:
+            self._poll_task.cancel()
+            self._poll_task = None
+        self.registry.scheduler.stop()
+        self.schedules.stop()
+        self.sensors.stop()
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+        if self.usage_store is not None:
+            self.usage_store.close()
+            self.usage_store = None
+
+    async def run_owned(self, func, *args, key=None):
+        """Run func on the hardware owner thread and await its result.
+
+        key is the coalescing key that @owned gives func: (group, method name, fan id).
+        """
+        future = hardware_owner.submit(func, *args, key=key)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), hardware_owner.timeout)
+        except asyncio.TimeoutError:
+            raise HardwareTimeout(f"Hardware command {getattr(func, '__name__', func)} timed out after {hardware_owner.timeout}s")
+
+    async def set_speed(self, speed, fan=None, source='web'):
+        """Async change_fan_speed. Returns (success, message)."""
+        fan = fan or self.default_fan
+        return await self.run_owned(fan.change_speed, speed, source, key=('speed', 'change_speed', fan.fan_id))
+
+    async def apply_speeds(self, commands, source='web'):
+        """Async FanRegistry.apply_speeds: one hardware pass for every fan."""
+        return await self.run_owned(self.registry.apply_speeds, commands, source)
+
+    async def cycle_speed(self, fan=None, source='web'):
+        fan = fan or self.default_fan
+        return await self.run_owned(fan.cycle_speed, source)
+
+    def run_schedule(self, schedule):
+        """Schedule action (on the hardware owner): a speed change, safety timer included."""
+        fan = self.registry.get(schedule.fan)
+        if fan is None:
+            return False, f"Unknown fan: {schedule.fan}"
+        return fan.change_speed(schedule.speed, 'schedule')
+
+    async def set_timer(self, hours, fan=None):
+        fan = fan or self.default_fan
+        return await self.run_owned(fan.set_timer, hours, key=('timer', 'set_timer', fan.fan_id))
+
+    async def cancel_timer(self, fan=None):
+        fan = fan or self.default_fan
+        return await self.run_owned(fan.cancel_timer, key=('timer', 'cancel_timer', fan.fan_id))
+
+    async def apply_timer(self, hours, fan=None):
+        fan = fan or self.default_fan
+        return await self.run_owned(fan.apply_timer, hours, key=('timer', 'apply_timer', fan.fan_id))
+
+    async def cycle_timer(self, fan=None):
+        fan = fan or self.default_fan
+        return await self.run_owned(fan.cycle_timer)
+
+    async def start_safety_timer(self, fan=None):
+        fan = fan or self.default_fan
+        return await self.run_owned(fan.start_safety_timer, key=('safety', 'start_safety_timer', fan.fan_id))
+
+    def build_status(self, version=None):
+        status = self.default_fan.status()
+        status['version'] = version
+        return status
+
+    # --- Buttons --------------------------------------------------------
+
+    def start_button_polling(self):
+        """Start the button input task (edge verification or polling)."""
+        if self._poll_task is None:
+            self._poll_task = self.loop.create_task(self.poll_buttons())
+            log.info("✓ Button input started on the event loop (%s mode)", fan_control.button_input.mode)
+
+    async def poll_buttons(self):
+        """Async version of fan_control.poll_buttons."""
+        button_input = fan_control.button_input
+        while True:
+            try:
+                # Button handlers submit to the hardware owner and return at once
+                delay = button_input.step(fan_control.clock.monotonic())
+            except Exception as e:
+                log.error("Error in button polling: %s", e)
+                delay = 1  # Wait longer on error
+            await asyncio.sleep(delay)
+
+
+# === ASGI FRONT END ===
+
+def _json_default(o):
+    # Same date format as Flask's jsonify
+    if hasattr(o, 'timetuple'):
+        return http_date(o)
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+def dumps(obj):
+    return json.dumps(obj, default=_json_default, sort_keys=True)
+
+
+class Request:
+    def __init__(self, scope, receive, params):
+        self.scope = scope
+        self.method = scope['method']
+        self.path = scope['path']
+        self.params = params
+        self.args = {k: v[-1] for k, v in parse_qs(scope.get('query_string', b'').decode()).items()}
+        self.headers = {k.decode().lower(): v.decode() for k, v in scope.get('headers', [])}
+        self._receive = receive
+        self._body = None
+
+    async def body(self):
+        if self._body is None:
+            chunks = []
+            more = True
+            while more:
+                message = await self._receive()
+                chunks.append(message.get('body', b''))
+                more = message.get('more_body', False)
+            self._body = b''.join(chunks)
+        return self._body
+
+    async def json(self):
+        try:
+            return json.loads(await self.body() or b'null')
+        except ValueError:
+            return None
+
+    async def form(self):
+        return {k: v[-1] for k, v in parse_qs((await self.body()).decode()).items()}
+
+    def etag_matches(self, etag):
+        header = self.headers.get('if-none-match', '')
+        return any(tag.strip() in (f'"{etag}"', f'W/"{etag}"', '*') for tag in header.split(','))
+
+    def accepts_gzip(self):
+        """True if Accept-Encoding allows gzip (by name, else by *) with a non-zero q."""
+        quality = {}
+        for item in self.headers.get('accept-encoding', '').split(','):
+            name, _, params = item.partition(';')
+            params = params.strip().lower()
+            try:
+                quality[name.strip().lower()] = float(params[2:]) if params.startswith('q=') else 1.0
+            except ValueError:
+                quality[name.strip().lower()] = 0.0
+        return quality.get('gzip', quality.get('*', 0.0)) > 0
+
+
+class Response:
+    def __init__(self, body=b'', status=200, content_type='application/json', headers=None):
+        self.body = body.encode() if isinstance(body, str) else body
+        self.status = status
+        self.headers = [(b'content-type', content_type.encode())] if content_type else []
+        for name, value in (headers or {}).items():
+            self.headers.append((name.lower().encode(), value.encode()))
+
+    async def __call__(self, send, receive=None):
+        await send({'type': 'http.response.start', 'status': self.status,
+                    'headers': self.headers + [(b'content-length', str(len(self.body)).encode())]})
+        await send({'type': 'http.response.body', 'body': self.body})
+
+
+class StreamingResponse(Response):
+    """Sends chunks from an async generator until it ends or the client disconnects."""
+
+    def __init__(self, chunks, content_type, headers=None):
+        super().__init__(b'', 200, content_type, headers)
+        self.chunks = chunks
+
+    async def __call__(self, send, receive=None):
+        await send({'type': 'http.response.start', 'status': self.status, 'headers': self.headers})
+        # A send() to a closed connection may just return, so the disconnect
+        # has to come from receive(); it cancels the stream
+        streaming = asyncio.ensure_future(self._stream(send))
+        watching = asyncio.ensure_future(self._wait_disconnect(receive)) if receive else None
+        try:
+            await asyncio.wait([task for task in (streaming, watching) if task],
+                               return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in (streaming, watching):
+                if task is not None:
+                    task.cancel()
+            await asyncio.gather(streaming, *([watching] if watching else []), return_exceptions=True)
+            await self.chunks.aclose()
+
+    async def _stream(self, send):
+        async for chunk in self.chunks:
+            await send({'type': 'http.response.body', 'body': chunk.encode(), 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    @staticmethod
+    async def _wait_disconnect(receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+
+def jsonify(obj, status=200):
+    return Response(dumps(obj), status)
+
+
+def redirect(location):
+    return Response(b'', 302, None, {'Location': location})
+
+
+# Endpoint names used by url_for() in the template
+URLS = {
+    'index': '/',
+    'cycle_speed_route': '/cycle_speed',
+    'cycle_timer_route': '/cycle_timer',
+}
+
+templates = Environment(
+    loader=FileSystemLoader(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')),
+    autoescape=select_autoescape(['html']))
+templates.globals['url_for'] = lambda endpoint, **values: URLS[endpoint]
+
+core = AsyncFanCore()
+routes = []
+
+
+def route(pattern, methods=('GET',)):
+    """Register a handler; {name} matches a path segment, {name:int} digits."""
+    regex = re.sub(r'\{(\w+):int\}', r'(?P<\1>\\d+)', pattern)
+    regex = re.sub(r'\{(\w+)\}', r'(?P<\1>[^/]+)', regex)
+
+    def decorator(handler):
+        routes.append((re.compile(f'^{regex}$'), methods, handler))
+        metrics.http_request_seconds.add(handler.__name__, route=pattern)
+        return handler
+    return decorator
+
+
+def fan_or_404(fan_id):
+    fan = core.registry.get(fan_id)
+    if fan is None:
+        return None, jsonify({'error': f"Unknown fan: {fan_id}"}, 404)
+    return fan, None
+
+
+@route('/')
+async def index(request):
+    """Main control interface."""
+    status = core.default_fan.status()
+    html = templates.get_template('index.html').render(
+        current_state=status['current_state'],
+        timer_state=status['timer_state'],
+        safety_timer_state=status['safety_timer_state'],
+        server_time=fan_control.clock.now().timestamp(),
+        mock_mode=fan_control.MOCK_MODE)
+    return Response(html, content_type='text/html; charset=utf-8')
+
+
+@route('/set_speed/{speed}')
+async def set_speed(request):
+    """Set fan speed via URL parameter."""
+    await core.set_speed(request.params['speed'])
+    return redirect('/')
+
+
+@route('/set_speed', methods=('POST',))
+async def set_speed_post(request):
+    """Set fan speed via POST request."""
+    speed = (await request.form()).get('speed')
+    if speed:
+        await core.set_speed(speed)
+    return redirect('/')
+
+
+@route('/api/set_speed', methods=('POST',))
+async def api_set_speed(request):
+    """API endpoint for setting fan speed."""
+    return await set_speed_response(core.default_fan, await request.json())
+
+
+async def set_speed_response(fan, data):
+    speed = data.get('speed') if isinstance(data, dict) else None
+    if not speed:
+        return jsonify({'error': 'Speed parameter required'}, 400)
+
+    success, message = await core.set_speed(speed, fan)
+    if success:
+        return jsonify({'success': True, 'message': message, 'current_state': fan.state})
+    return jsonify({'error': message}, 400)
+
+
+@route('/api/status')
+async def api_status(request):
+    """Current status (cached bytes, gzipped if accepted) with ETag / If-None-Match and ?wait=&since= long-polling.
+
+    remaining_seconds is tick-granular (see web_app.api_status); the deadlines are exact.
+    """
+    try:
+        wait = float(request.args.get('wait', 0))
+    except ValueError:
+        wait = 0
+    since = core.broadcaster.parse_tag(request.args.get('since'))
+    if wait and since is not None:
+        await core.broadcaster.wait_for_change_async(since, min(wait, MAX_LONG_POLL_WAIT))
+
+    gzipped = request.accepts_gzip()
+    version, body = core.broadcaster.body(gzipped)
+    tag = core.broadcaster.tag(version)
+    etag = f'{tag}-gzip' if gzipped else tag
+    headers = {'ETag': f'"{etag}"', 'Cache-Control': 'no-cache', 'Vary': 'Accept-Encoding',
+               'X-State-Version': tag}
+    if request.etag_matches(etag):
+        return Response(b'', 304, None, headers)
+    if gzipped:
+        headers['Content-Encoding'] = 'gzip'
+    return Response(body, headers=headers)
+
+
+@route('/api/events')
+async def api_events(request):
+    """Server-Sent Events stream that pushes the status on every change."""
+    async def stream():
+        sent_version = None
+        while True:
+            version, payload = core.broadcaster.payload()
+            if version != sent_version:
+                sent_version = version
+                yield f"id: {core.broadcaster.tag(version)}\ndata: {payload}\n\n"
+            if not await core.broadcaster.wait_for_change_async(sent_version, EVENT_STREAM_KEEPALIVE):
+                # Comment line keeps proxies from closing an idle stream
+                yield ": keep-alive\n\n"
+
+    return StreamingResponse(stream(), 'text/event-stream', {
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+
+@route('/set_timer/{hours:int}')
+async def set_timer_route(request):
+    """Set timer via URL parameter."""
+    await core.apply_timer(int(request.params['hours']))
+    return redirect('/')
+
+
+@route('/cancel_timer')
+async def cancel_timer_route(request):
+    """Cancel timer via URL."""
+    await core.cancel_timer()
+    return redirect('/')
+
+
+@route('/api/set_timer', methods=('POST',))
+async def api_set_timer(request):
+    """API endpoint for setting timer."""
+    return await set_timer_response(core.default_fan, await request.json())
+
+
+async def set_timer_response(fan, data):
+    hours = data.get('hours') if isinstance(data, dict) else None
+
+    if hours is None:
+        return jsonify({'error': 'Hours parameter required'}, 400)
+
+    success, message = await core.apply_timer(hours, fan)
+    if not success:
+        return jsonify({'error': message}, 400)
+    return jsonify({'success': True, 'message': message, 'timer_state': fan.timer_state})
+
+
+@route('/cycle_speed')
+async def cycle_speed_route(request):
+    """Cycle to the next speed setting."""
+    await core.cycle_speed()
+    return redirect('/')
+
+
+@route('/cycle_timer')
+async def cycle_timer_route(request):
+    """Cycle to the next timer setting."""
+    await core.cycle_timer()
+    return redirect('/')
+
+
+@route('/api/cycle_speed', methods=('POST',))
+async def api_cycle_speed(request):
+    """API endpoint for cycling speed."""
+    return await cycle_speed_response(core.default_fan)
+
+
+async def cycle_speed_response(fan):
+    success, message, new_speed = await core.cycle_speed(fan)
+    if not success:
+        return jsonify({'error': message}, 400)
+    return jsonify({'success': True, 'message': f'Speed cycled to {new_speed}',
+                    'speed': new_speed, 'current_state': fan.state})
+
+
+@route('/api/cycle_timer', methods=('POST',))
+async def api_cycle_timer(request):
+    """API endpoint for cycling timer."""
+    return await cycle_timer_response(core.default_fan)
+
+
+async def cycle_timer_response(fan):
+    success, message, new_timer = await core.cycle_timer(fan)
+    if not success:
+        return jsonify({'error': message}, 400)
+    return jsonify({'success': True, 'message': message, 'timer_state': fan.timer_state})
+
+
+@route('/api/fans')
+async def api_fans_status(request):
+    """Bulk status of every fan, keyed by fan id."""
+    tag = core.broadcaster.tag(core.broadcaster.version)
+    headers = {'ETag': f'"{tag}"'}
+    if request.etag_matches(tag):
+        return Response(b'', 304, None, headers)
+    return Response(dumps({'version': tag, 'fans': core.registry.status()}), headers=headers)
+
+
+@route('/api/fans/set_speed', methods=('POST',))
+async def api_fans_set_speed(request):
+    """Bulk speed command, applied to every affected fan in one hardware pass."""
+    commands, error = core.registry.bulk_commands(await request.json())
+    if error:
+        return jsonify({'error': error}, 400)
+
+    results = await core.apply_speeds(commands)
+    success = all(ok for ok, _ in results.values())
+
+    return jsonify({
+        'success': success,
+        'results': {fan_id: {'success': ok, 'message': message}
+                    for fan_id, (ok, message) in results.items()},
+        'fans': {fan_id: core.registry.get(fan_id).state
+                 for fan_id in results if core.registry.get(fan_id)}
+    }, 200 if success else 400)
+
+
+@route('/api/fans/{fan_id}/status')
+async def api_fan_status(request):
+    """Status of a single fan."""
+    fan, error = fan_or_404(request.params['fan_id'])
+    return error or jsonify(fan.status())
+
+
+@route('/api/fans/{fan_id}/set_speed', methods=('POST',))
+async def api_fan_set_speed(request):
+    """Set the speed of a single fan."""
+    fan, error = fan_or_404(request.params['fan_id'])
+    return error or await set_speed_response(fan, await request.json())
+
+
+@route('/api/fans/{fan_id}/set_timer', methods=('POST',))
+async def api_fan_set_timer(request):
+    """Set or cancel the timer of a single fan."""
+    fan, error = fan_or_404(request.params['fan_id'])
+    return error or await set_timer_response(fan, await request.json())
+
+
+@route('/api/fans/{fan_id}/cycle_speed', methods=('POST',))
+async def api_fan_cycle_speed(request):
+    """Cycle the speed of a single fan."""
+    fan, error = fan_or_404(request.params['fan_id'])
+    return error or await cycle_speed_response(fan)
+
+
+@route('/api/fans/{fan_id}/cycle_timer', methods=('POST',))
+async def api_fan_cycle_timer(request):
+    """Cycle the timer of a single fan."""
+    fan, error = fan_or_404(request.params['fan_id'])
+    return error or await cycle_timer_response(fan)
+
+
+@route('/api/history')
+async def api_history(request):
+    """A fan's speed over time in buckets; query from, to (Unix times), step (seconds), fan."""
+    fan = core.default_fan
+    if 'fan' in request.args:
+        fan, error = fan_or_404(request.args['fan'])
+        if error:
+            return error
+    try:
+        timeline = core.history.timeline(fan.fan_id,
+                                         start=request.args.get('from'),
+                                         end=request.args.get('to'),
+                                         step=request.args.get('step'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}, 400)
+    timeline['history'] = core.history.buffer_info()
+    return jsonify(timeline)
+
+
+@route('/api/usage')
+async def api_usage(request):
+    """Hours at each speed and energy used, in total and per day; query days, fan."""
+    fan = core.default_fan
+    if 'fan' in request.args:
+        fan, error = fan_or_404(request.args['fan'])
+        if error:
+            return error
+    try:
+        days = int(request.args.get('days', USAGE_DEFAULT_DAYS))
+    except ValueError:
+        return jsonify({'error': 'days must be an integer'}, 400)
+    return jsonify(fan.usage_report(days))
+
+
+@route('/api/schedules', methods=('GET', 'POST'))
+async def api_schedules(request):
+    """List the recurring schedules, or create one."""
+    if request.method != 'POST':
+        return jsonify({'schedules': core.schedules.list()})
+    try:
+        schedule = core.schedules.create(await request.json())
+    except ValueError as e:
+        return jsonify({'error': str(e)}, 400)
+    return jsonify({'success': True, 'schedule': schedule}, 201)
+
+
+@route('/api/schedules/{schedule_id:int}', methods=('GET', 'PUT', 'PATCH', 'DELETE'))
+async def api_schedule(request):
+    """Read, change (only the fields given) or delete one schedule."""
+    schedule_id = int(request.params['schedule_id'])
+    if request.method == 'DELETE':
+        if not core.schedules.delete(schedule_id):
+            return jsonify({'error': f"Unknown schedule: {schedule_id}"}, 404)
+        return jsonify({'success': True})
+    if request.method in ('GET', 'HEAD'):
+        schedule = core.schedules.get(schedule_id)
+    else:
+        try:
+            schedule = core.schedules.update(schedule_id, await request.json())
+        except ValueError as e:
+            return jsonify({'error': str(e)}, 400)
+    if schedule is None:
+        return jsonify({'error': f"Unknown schedule: {schedule_id}"}, 404)
+    return jsonify({'success': True, 'schedule': schedule})
+
+
+@route('/api/sensors')
+async def api_sensors(request):
+    """Latest reading of every sensor and the state of each auto mode fan."""
+    return jsonify(core.sensors.status())
+
+
+@route('/api/sensors/auto', methods=('POST',))
+async def api_sensors_auto(request):
+    """Switch auto mode on or off: {"enabled": true|false, "fan": id}."""
+    data = await request.json()
+    data = data if isinstance(data, dict) else {}
+    if not isinstance(data.get('enabled'), bool):
+        return jsonify({'error': 'enabled must be true or false'}, 400)
+    fan_id = data.get('fan') or core.default_fan.fan_id
+    if not core.sensors.set_auto(fan_id, data['enabled']):
+        return jsonify({'error': f"No auto mode configured for fan: {fan_id}"}, 404)
+    return jsonify({'success': True, 'auto': core.sensors.status()['auto'][fan_id]})
+
+
+@route('/api/debug/log')
+async def api_debug_log(request):
+    """Recent log records from the in-memory ring buffer."""
+    try:
+        records = ring_buffer.recent(limit=int(request.args['limit']) if 'limit' in request.args else None,
+                                     level=request.args.get('level'),
+                                     logger=request.args.get('logger'),
+                                     since=int(request.args.get('since', 0)))
+    except ValueError as e:
+        return jsonify({'error': str(e)}, 400)
+    return jsonify({'records': records, 'capacity': ring_buffer.records.maxlen})
+
+
+@route('/api/debug/trace', methods=('GET', 'POST'))
+async def api_debug_trace(request):
+    """Recent traces as a span timeline; POST {"enabled": bool, "clear": true} to control."""
+    if request.method == 'POST':
+        data = await request.json() or {}
+        if data.get('enabled') is True:
+            tracing.enable()
+        elif data.get('enabled') is False:
+            tracing.disable()
+        if data.get('clear'):
+            tracing.clear()
+        return jsonify({'enabled': tracing.enabled})
+
+    limit = int(request.args['limit']) if 'limit' in request.args else None
+    name = request.args.get('name')
+    if request.args.get('format') == 'chrome':
+        return jsonify(tracing.chrome_trace(limit, name))
+    return jsonify({'enabled': tracing.enabled, 'capacity': tracing.TRACE_BUFFER_SIZE,
+                    'traces': tracing.timeline(limit, name)})
+
+
+@route('/metrics')
+async def prometheus_metrics(request):
+    """Counters and histograms in the Prometheus text format."""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
+metrics.http_request_seconds.add(None, route='unmatched')
+
+
+async def app(scope, receive, send):
+    """The ASGI application."""
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    core.start()
+                except Exception as e:
+                    log.exception("Startup failed")
+                    await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                core.stop()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    if scope['type'] != 'http':
+        return
+
+    # Servers without lifespan support start the core on the first request
+    core.start()
+
+    started = time.perf_counter()
+    series = metrics.http_request_seconds[None]
+    # Hardware commands awaited by this request join its trace
+    trace_token = tracing.set_current(tracing.new_trace()) if tracing.enabled else None
+    path = scope['path']
+    for regex, methods, handler in routes:
+        match = regex.match(path)
+        if match:
+            series = metrics.http_request_seconds[handler.__name__]
+            if scope['method'] not in methods and not (scope['method'] == 'HEAD' and 'GET' in methods):
+                response = jsonify({'error': 'Method not allowed'}, 405)
+                break
+            try:
+                response = await handler(Request(scope, receive, match.groupdict()))
+            except HardwareTimeout as e:
+                response = jsonify({'error': str(e)}, 503)
+            break
+    else:
+        response = jsonify({'error': 'Not found'}, 404)
+
+    series.observe(time.perf_counter() - started)
+    if trace_token is not None:
+        tracing.record('http.request', started, method=scope['method'], route=path, status=response.status)
+        tracing.reset_current(trace_token)
+    await response(send, receive)
+
+
+def main():
+    try:
+        import uvicorn
+    except ImportError:
+        print("uvicorn is required for asyncio mode: pip install uvicorn")
+        raise SystemExit(1)
+
+    print("Starting Fan Control Web Interface (asyncio mode)...")
+    print(f"Mock Mode: {fan_control.MOCK_MODE}")
+    print("Access the interface at: http://localhost:5002")
+
+    uvicorn.run(app, host='0.0.0.0', port=5002, log_level='warning')
+
+
+if __name__ == '__main__':
+    main()
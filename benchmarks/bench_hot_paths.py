@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Benchmark the actuation, button input and API hot paths
+
+Measures latency distributions (min, mean, p50, p90, p99, max) for:
+- fan_control.set_speed and all_off
+- a speed button edge reaching the relays, through the GPIO edge callback,
+  the button event queue, the hardware owner and web_app.handle_button_speed_change
+- GET /api/status (plain and gzip) and POST /api/set_speed through the
+  Flask test client
+- importing fan_control and web_app, and web_app.start_hardware(), in fresh
+  interpreters
+
+The in-process cases run on the simulation backend (simulation.py), so the
+relay dead time passes on the virtual clock and the numbers are the code's
+own overhead rather than the 50 ms break-before-make sleep.
+
+Results are written as JSON (default: benchmarks/results/<commit>.json) with
+the commit, Python version and platform. --compare prints the p50/p99
+change against an earlier results file, e.g. the one from the last release.
+
+Usage: python benchmarks/bench_hot_paths.py [--iterations 2000] [--runs 10]
+                                            [--output FILE] [--compare OLD.json]
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(REPO_DIR, 'benchmarks', 'results')
+
+# Timed in a fresh interpreter; each prints the milliseconds it took
+STARTUP_CASES = {
+    'import fan_control': """
+import time
+start = time.perf_counter()
+import fan_control
+print((time.perf_counter() - start) * 1000)
+""",
+    'import web_app': """
+import time
+start = time.perf_counter()
+import web_app
+print((time.perf_counter() - start) * 1000)
+""",
+    'web_app.start_hardware': """
+import time
+import web_app
+start = time.perf_counter()
+web_app.start_hardware()
+print((time.perf_counter() - start) * 1000)
+""",
+}
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else 0.0
+
+
+def summarize(times_ms):
+    return {
+        'samples': len(times_ms),
+        'min_ms': min(times_ms),
+        'mean_ms': statistics.fmean(times_ms),
+        'p50_ms': percentile(times_ms, 50),
+        'p90_ms': percentile(times_ms, 90),
+        'p99_ms': percentile(times_ms, 99),
+        'max_ms': max(times_ms),
+    }
+
+
+def timed(func, iterations, setup=None):
+    """Run func iterations times and return the wall times in milliseconds."""
+    times = []
+    for i in range(iterations):
+        if setup:
+            setup(i)
+        start = time.perf_counter()
+        func(i)
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def bench_in_process(iterations):
+    """Actuation, button and API cases on the simulation backend."""
+    sys.path.insert(0, REPO_DIR)
+    import fan_control
+    import web_app
+    from simulation import Simulation
+
+    speeds = ['low', 'med', 'high', 'off']
+    results = {}
+    sim = Simulation()
+    try:
+        fan = fan_control.default_fan
+        client = web_app.app.test_client()
+
+        results['set_speed'] = timed(lambda i: fan_control.set_speed(speeds[i % 4]), iterations)
+        fan_control.set_speed('high')
+        results['all_off'] = timed(lambda i: fan_control.all_off(), iterations,
+                                   setup=lambda i: fan_control.set_speed('high'))
+
+        # A press: edge callback, queue, hardware owner, web app callback,
+        # relays. The clock moves on between presses to clear the debounce.
+        pin = fan.speed_button
+
+        def press(i):
+            sim.gpio.set_input(pin, sim.gpio.LOW)
+            sim.settle()
+
+        def release(i):
+            sim.gpio.set_input(pin, sim.gpio.HIGH)
+            sim.clock.sleep(1.0)
+
+        writes = len(sim.gpio.history)
+        results['button edge to relay'] = timed(press, iterations, setup=release)
+        if len(sim.gpio.history) == writes:
+            raise RuntimeError("Button presses did not reach the relays")
+
+        results['GET /api/status'] = timed(lambda i: client.get('/api/status'), iterations)
+        results['GET /api/status gzip'] = timed(
+            lambda i: client.get('/api/status', headers={'Accept-Encoding': 'gzip'}), iterations)
+        results['POST /api/set_speed'] = timed(
+            lambda i: client.post('/api/set_speed', json={'speed': speeds[i % 4]}), iterations)
+    finally:
+        sim.close()
+    return results
+
+
+def bench_startup(runs):
+    """Startup cases, each in fresh interpreters with their own lock and socket."""
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ,
+                   FAN_GPIO_LOCK=os.path.join(tmp, 'gpio.lock'),
+                   FAN_SOCKET=os.path.join(tmp, 'control.sock'),
+                   FAN_STATE_JOURNAL=os.path.join(tmp, 'state.journal'),
+                   FAN_USAGE_FILE=os.path.join(tmp, 'usage.json'),
+                   FAN_SCHEDULES=os.path.join(tmp, 'schedules.json'),
+                   FAN_SENSORS=os.path.join(tmp, 'sensors.json'),
+                   FAN_LOG_LEVEL='WARNING')
+        for name, code in STARTUP_CASES.items():
+            times = []
+            for _ in range(runs):
+                result = subprocess.run([sys.executable, '-c', code], cwd=REPO_DIR, env=env,
+                                        capture_output=True, text=True, check=True)
+                times.append(float(result.stdout.strip().splitlines()[-1]))
+            results[name] = times
+    return results
+
+
+def git_commit():
+    try:
+        result = subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=REPO_DIR,
+                                capture_output=True, text=True, check=True)
+        return result.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def print_table(cases, baseline=None):
+    print(f"{'case':<24} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}", end='')
+    print(f" {'p50 vs old':>11} {'p99 vs old':>11}" if baseline else '')
+    for name, s in cases.items():
+        print(f"{name:<24} {s['p50_ms']:9.3f} {s['p90_ms']:9.3f} {s['p99_ms']:9.3f} {s['max_ms']:9.3f}",
+              end='')
+        old = (baseline or {}).get(name)
+        if old:
+            print(f" {change(old['p50_ms'], s['p50_ms']):>11} {change(old['p99_ms'], s['p99_ms']):>11}")
+        else:
+            print(' ' * 24 if baseline else '')
+
+
+def change(old, new):
+    return f"{(new - old) / old * 100:+.0f}%" if old else 'n/a'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=2000,
+                        help="Iterations per in-process case (default: 2000)")
+    parser.add_argument('--runs', type=int, default=10,
+                        help="Fresh interpreters per startup case (default: 10)")
+    parser.add_argument('--output', help="Results file (default: benchmarks/results/<commit>.json)")
+    parser.add_argument('--compare', metavar='OLD.json', help="Earlier results file to compare against")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['cases']
+
+    raw = bench_startup(args.runs)
+    raw.update(bench_in_process(args.iterations))
+    cases = {name: summarize(times) for name, times in raw.items()}
+
+    import fan_control
+    commit = git_commit()
+    results = {
+        'commit': commit,
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'mock_mode': fan_control.MOCK_MODE,
+        'iterations': args.iterations,
+        'runs': args.runs,
+        'cases': cases,
+    }
+
+    print_table(cases, baseline)
+
+    output = args.output or os.path.join(RESULTS_DIR, f'{commit}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+        f.write('\n')
+    print(f"\nResults written to {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Benchmark /api/status throughput: Flask dev server vs. the production server
+
+Starts each server in a subprocess (mock GPIO is fine), hits /api/status
+from several client threads over keep-alive connections for a fixed time,
+and prints requests/second and latency percentiles.
+
+Usage: python benchmarks/bench_server.py [--clients 8] [--duration 10]
+"""
+
+import argparse
+import http.client
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVERS = {
+    'dev': [sys.executable, '-c',
+            "import sys, web_app; web_app.start_hardware(); "
+            "web_app.app.run(host='127.0.0.1', port=int(sys.argv[1]), threaded=True, use_reloader=False)"],
+    'waitress': [sys.executable, 'serve.py', '--host', '127.0.0.1', '--port'],
+}
+
+
+def start_server(name, port):
+    # Keep the servers' lock, socket and state files away from a live install
+    tmp = tempfile.mkdtemp(prefix=f'fan-bench-{port}-')
+    env = dict(os.environ,
+               FAN_GPIO_LOCK=os.path.join(tmp, 'gpio.lock'),
+               FAN_SOCKET=os.path.join(tmp, 'control.sock'),
+               FAN_STATE_JOURNAL=os.path.join(tmp, 'state.journal'),
+               FAN_USAGE_FILE=os.path.join(tmp, 'usage.json'),
+               FAN_SCHEDULES=os.path.join(tmp, 'schedules.json'),
+               FAN_SENSORS=os.path.join(tmp, 'sensors.json'))
+    proc = subprocess.Popen(SERVERS[name] + [str(port)], cwd=REPO_DIR, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    # Wait until it answers
+    for _ in range(100):
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/api/status')
+            conn.getresponse().read()
+            return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError(f"{name} server did not start on port {port}")
+
+
+def client(port, deadline, latencies, errors):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            conn.request('GET', '/api/status')
+            response = conn.getresponse()
+            response.read()
+            if response.status != 200:
+                errors.append(response.status)
+        except (OSError, http.client.HTTPException) as e:
+            errors.append(str(e))
+            conn.close()
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+            continue
+        latencies.append(time.perf_counter() - start)
+    conn.close()
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else 0.0
+
+
+def run(name, port, clients, duration):
+    proc = start_server(name, port)
+    try:
+        latencies, errors = [], []
+        deadline = time.perf_counter() + duration
+        threads = [threading.Thread(target=client, args=(port, deadline, latencies, errors))
+                   for _ in range(clients)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        proc.terminate()
+        proc.wait(timeout=5)
+
+    return {
+        'server': name,
+        'requests': len(latencies),
+        'errors': len(errors),
+        'rps': len(latencies) / duration,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--port', type=int, default=5090)
+    parser.add_argument('--server', choices=['dev', 'waitress', 'both'], default='both')
+    args = parser.parse_args()
+
+    names = ['dev', 'waitress'] if args.server == 'both' else [args.server]
+    print(f"{'server':<10} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8}")
+    for i, name in enumerate(names):
+        r = run(name, args.port + i, args.clients, args.duration)
+        print(f"{r['server']:<10} {r['requests']:>9} {r['errors']:>7} {r['rps']:>9.1f} "
+              f"{r['p50_ms']:>8.2f} {r['p99_ms']:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
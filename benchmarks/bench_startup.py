@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Benchmark startup: importing fan_control and one CLI speed command
+
+Measures, in fresh interpreters (mock GPIO is fine):
+- a bare interpreter
+- the standard library modules fan_control needs, as the import baseline
+- `import fan_control`
+- `python fan_control.py high`, the path used by scripts and cron jobs
+
+and checks that importing fan_control makes no GPIO calls, loads neither
+the fan config nor the modules only a running server needs, and that the
+CLI sets up only the relay pins of the fan it drives. Exits non-zero if a
+check fails or a median exceeds its budget, so it can guard against
+import-time side effects creeping back in.
+
+Every case runs with its own GPIO lock, control socket and state files in a
+temporary directory, so the CLI case never reaches a running daemon or the
+real relays' lock.
+
+Usage: python benchmarks/bench_startup.py [--runs 10] [--max-import-ms 20] [--max-cli-ms 300]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CASES = {
+    'interpreter': [sys.executable, '-c', 'pass'],
+    'stdlib': [sys.executable, '-c', 'import concurrent.futures, datetime, json, logging, threading'],
+    'import': [sys.executable, '-c', 'import fan_control'],
+    'cli high': [sys.executable, 'fan_control.py', 'high'],
+}
+
+# Modules a plain import must not load: they belong to the server, the
+# control socket or logging setup
+LAZY_MODULES = ('logging.handlers', 'socket', 'socketserver', 'tempfile', 'control_daemon')
+
+# Prints tagged lines: the GPIO pins configured by importing fan_control,
+# the lazy modules it loaded anyway and whether it read the fan config, then
+# the pins configured by the CLI and the relay pins of the default fan
+SIDE_EFFECT_CHECK = f"""
+import runpy, sys
+import fan_control
+print('import-pins', sorted(fan_control.GPIO._pin_modes))
+print('import-lazy', sorted(name for name in {LAZY_MODULES!r} if name in sys.modules))
+print('import-config', fan_control._registry is not None)
+sys.argv = ['fan_control.py', 'high']
+cli = runpy.run_path('fan_control.py', run_name='__main__')
+print('cli-pins', sorted(cli['GPIO']._pin_modes))
+print('expected-pins', sorted(cli['get_registry']().default.speed_pins.values()))
+"""
+
+
+def isolated_env(tmp):
+    """os.environ with the lock, socket and state files moved into tmp."""
+    return dict(os.environ,
+                FAN_GPIO_LOCK=os.path.join(tmp, 'gpio.lock'),
+                FAN_SOCKET=os.path.join(tmp, 'control.sock'),
+                FAN_STATE_JOURNAL=os.path.join(tmp, 'state.journal'),
+                FAN_USAGE_FILE=os.path.join(tmp, 'usage.json'),
+                FAN_SCHEDULES=os.path.join(tmp, 'schedules.json'),
+                FAN_SENSORS=os.path.join(tmp, 'sensors.json'),
+                FAN_LOG_LEVEL='WARNING')
+
+
+def time_command(cmd, runs, env):
+    """Run cmd runs times and return the wall times in milliseconds."""
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(cmd, cwd=REPO_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        times.append((time.perf_counter() - start) * 1000)
+    return times
+
+
+def check_side_effects(env):
+    """Return a list of problems found (empty if none)."""
+    result = subprocess.run([sys.executable, '-c', SIDE_EFFECT_CHECK], cwd=REPO_DIR, env=env,
+                            capture_output=True, text=True, check=True)
+    tagged = dict(line.split(' ', 1) for line in result.stdout.splitlines()
+                  if line.split(' ', 1)[0] in ('import-pins', 'import-lazy', 'import-config',
+                                               'cli-pins', 'expected-pins'))
+
+    problems = []
+    if tagged['import-pins'] != '[]':
+        problems.append(f"import fan_control configured GPIO pins {tagged['import-pins']}")
+    if tagged['import-lazy'] != '[]':
+        problems.append(f"import fan_control loaded {tagged['import-lazy']}")
+    if tagged['import-config'] != 'False':
+        problems.append("import fan_control loaded the fan config")
+    if tagged['cli-pins'] != tagged['expected-pins']:
+        problems.append(f"CLI configured pins {tagged['cli-pins']}, expected only {tagged['expected-pins']}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10, help="Runs per case (default: 10)")
+    parser.add_argument('--max-import-ms', type=float, default=20,
+                        help="Budget for import fan_control over the stdlib baseline (default: 20)")
+    parser.add_argument('--max-cli-ms', type=float, default=300,
+                        help="Budget for the CLI command over the bare interpreter (default: 300)")
+    args = parser.parse_args()
+
+    medians = {}
+    print(f"{'case':<12} {'median':>9} {'min':>9} {'max':>9}")
+    with tempfile.TemporaryDirectory() as tmp:
+        env = isolated_env(tmp)
+        for name, cmd in CASES.items():
+            times = time_command(cmd, args.runs, env)
+            medians[name] = statistics.median(times)
+            print(f"{name:<12} {medians[name]:8.1f}ms {min(times):8.1f}ms {max(times):8.1f}ms")
+        failures = check_side_effects(env)
+
+    import_cost = medians['import'] - medians['stdlib']
+    cli_cost = medians['cli high'] - medians['interpreter']
+    print(f"\nimport fan_control: +{import_cost:.1f} ms over the stdlib baseline, "
+          f"CLI high: +{cli_cost:.1f} ms over the bare interpreter")
+    if import_cost > args.max_import_ms:
+        failures.append(f"import took {import_cost:.1f} ms (budget {args.max_import_ms} ms)")
+    if cli_cost > args.max_cli_ms:
+        failures.append(f"CLI took {cli_cost:.1f} ms (budget {args.max_cli_ms} ms)")
+
+    if failures:
+        for failure in failures:
+            print(f"✗ {failure}")
+        sys.exit(1)
+    print("✓ No import-time side effects, startup within budget")
+
+
+if __name__ == '__main__':
+    main()
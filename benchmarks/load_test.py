@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+"""
+Concurrent HTTP load test for the REST API
+
+Runs concurrent readers (GET /api/status) and writers (POST /api/set_speed
+and /api/cycle_speed) against the web app, reports throughput, p50/p99
+latency and error rate per route, then checks that the state stayed
+consistent:
+
+- the default fan's state snapshot has a speed that matches its speed index
+  (what fan_control.current_speed_index used to be)
+- the relay driver's shadow levels and the GPIO pin levels both show exactly
+  the relay of that speed energized (none for off)
+- /api/status reports the same speed
+
+By default the app is started in this process (web_app.start_hardware() with
+mock GPIO, served by waitress on a local port) so the relay pins can be read
+afterwards. With --url it loads an already running instance instead, and only
+the /api/status part of the check can be made.
+
+Exits non-zero if the check fails or the error rate is above --max-error-rate.
+
+Usage: python benchmarks/load_test.py [--readers 8] [--writers 2] [--duration 10]
+                                      [--port 5095 | --url http://pi.local:5002]
+"""
+
+import argparse
+import http.client
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlsplit
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SPEEDS = ['off', 'low', 'med', 'high']
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else 0.0
+
+
+class Route:
+    """Latencies and errors of one route, shared by the client threads."""
+
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+        self.errors = []
+        self.lock = threading.Lock()
+
+    def record(self, latency=None, error=None):
+        with self.lock:
+            if error is None:
+                self.latencies.append(latency)
+            else:
+                self.errors.append(error)
+
+
+def request(conn, method, path, body=None):
+    """Send one request on a keep-alive connection. Returns (status, body)."""
+    headers = {'Content-Type': 'application/json'} if body is not None else {}
+    conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+    response = conn.getresponse()
+    return response.status, response.read()
+
+
+def client(host, port, deadline, pick):
+    """Send requests until the deadline; pick() returns (route, method, path, body)."""
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+    while time.perf_counter() < deadline:
+        route, method, path, body = pick()
+        start = time.perf_counter()
+        try:
+            status, _ = request(conn, method, path, body)
+        except (OSError, http.client.HTTPException) as e:
+            route.record(error=type(e).__name__)
+            conn.close()
+            conn = http.client.HTTPConnection(host, port, timeout=30)
+            continue
+        if status == 200:
+            route.record(time.perf_counter() - start)
+        else:
+            route.record(error=status)
+    conn.close()
+
+
+def start_in_process(port):
+    """Start the web app with its hardware in this process and serve it on port."""
+    from waitress import create_server
+
+    # A private lock, control socket and journal, so a running instance is not disturbed
+    tmp = tempfile.mkdtemp(prefix='fan-load-')
+    os.environ.setdefault('FAN_GPIO_LOCK', os.path.join(tmp, 'gpio.lock'))
+    os.environ.setdefault('FAN_SOCKET', os.path.join(tmp, 'control.sock'))
+    os.environ.setdefault('FAN_STATE_JOURNAL', os.path.join(tmp, 'state.journal'))
+    os.environ.setdefault('FAN_USAGE_FILE', os.path.join(tmp, 'usage.json'))
+    os.environ.setdefault('FAN_SCHEDULES', os.path.join(tmp, 'schedules.json'))
+    os.environ.setdefault('FAN_SENSORS', os.path.join(tmp, 'sensors.json'))
+    os.environ.setdefault('FAN_LOG_LEVEL', 'WARNING')
+
+    sys.path.insert(0, REPO_DIR)
+    import web_app
+
+    web_app.start_hardware()
+    server = create_server(web_app.app, host='127.0.0.1', port=port, threads=8)
+    # Queue-depth warnings are expected while the clients saturate the workers
+    logging.getLogger('waitress.queue').setLevel(logging.ERROR)
+    # The server thread ends with the process
+    threading.Thread(target=server.run, name='load-test-server', daemon=True).start()
+    return web_app
+
+
+def run(host, port, readers, writers, duration):
+    status = Route('GET /api/status')
+    set_speed = Route('POST /api/set_speed')
+    cycle_speed = Route('POST /api/cycle_speed')
+
+    def read():
+        return status, 'GET', '/api/status', None
+
+    def write():
+        if random.random() < 0.5:
+            return set_speed, 'POST', '/api/set_speed', {'speed': random.choice(SPEEDS)}
+        return cycle_speed, 'POST', '/api/cycle_speed', {}
+
+    deadline = time.perf_counter() + duration
+    threads = ([threading.Thread(target=client, args=(host, port, deadline, read)) for _ in range(readers)]
+               + [threading.Thread(target=client, args=(host, port, deadline, write)) for _ in range(writers)])
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return [status, set_speed, cycle_speed]
+
+
+def report(routes, duration):
+    """Print the per-route table. Returns the overall error rate."""
+    print(f"{'route':<22} {'requests':>9} {'errors':>7} {'err %':>6} {'req/s':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    total = failed = 0
+    for route in routes:
+        count = len(route.latencies) + len(route.errors)
+        total += count
+        failed += len(route.errors)
+        rate = len(route.errors) / count * 100 if count else 0.0
+        print(f"{route.name:<22} {count:>9} {len(route.errors):>7} {rate:>6.2f} {count / duration:>8.1f} "
+              f"{percentile(route.latencies, 50) * 1000:>8.2f} {percentile(route.latencies, 99) * 1000:>8.2f}")
+        if route.errors:
+            kinds = sorted({str(e) for e in route.errors})
+            print(f"{'':<22} errors: {', '.join(kinds)}")
+    print(f"{'total':<22} {total:>9} {failed:>7} {failed / total * 100 if total else 0:>6.2f} "
+          f"{total / duration:>8.1f}")
+    return failed / total if total else 0.0
+
+
+def reported_speed(host, port):
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+    try:
+        _, body = request(conn, 'GET', '/api/status')
+    finally:
+        conn.close()
+    return json.loads(body)['current_state']['speed']
+
+
+def check_state(web_app, host, port):
+    """Return a list of inconsistencies between state, speed index and relays."""
+    import fan_control
+    from hardware_owner import hardware_owner
+
+    # Let the hardware owner finish anything still queued
+    hardware_owner.call(lambda: None)
+
+    fan = fan_control.default_fan
+    speed = fan.current.speed
+    problems = []
+    if fan_control.speed_states[fan.speed_index] != speed:
+        problems.append(f"speed index {fan.speed_index} ({fan_control.speed_states[fan.speed_index]}) "
+                        f"but current_state says {speed}")
+
+    expected = fan.relay_levels(speed)
+    shadow = {pin: fan_control.relay_driver.level(pin) for pin in expected}
+    pins = {pin: fan_control.GPIO.input(pin) for pin in expected}
+    if shadow != expected:
+        problems.append(f"relay driver levels {shadow} do not match {speed} ({expected})")
+    if pins != expected:
+        problems.append(f"GPIO pin levels {pins} do not match {speed} ({expected})")
+
+    reported = reported_speed(host, port)
+    if reported != speed:
+        problems.append(f"/api/status reports {reported} but current_state says {speed}")
+    return problems, speed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--readers', type=int, default=8, help="Threads polling /api/status (default: 8)")
+    parser.add_argument('--writers', type=int, default=2,
+                        help="Threads setting and cycling the speed (default: 2)")
+    parser.add_argument('--duration', type=float, default=10, help="Seconds to run (default: 10)")
+    parser.add_argument('--port', type=int, default=5095, help="Port for the in-process server (default: 5095)")
+    parser.add_argument('--url', help="Load a running instance instead, e.g. http://localhost:5002")
+    parser.add_argument('--max-error-rate', type=float, default=0.0,
+                        help="Highest acceptable error rate in percent (default: 0)")
+    args = parser.parse_args()
+
+    if args.url:
+        target = urlsplit(args.url)
+        host, port = target.hostname, target.port or 80
+        web_app = None
+    else:
+        host, port = '127.0.0.1', args.port
+        web_app = start_in_process(port)
+
+    print(f"{args.readers} readers, {args.writers} writers for {args.duration:g}s against {host}:{port}\n")
+    routes = run(host, port, args.readers, args.writers, args.duration)
+    error_rate = report(routes, args.duration)
+
+    if web_app is not None:
+        problems, speed = check_state(web_app, host, port)
+    else:
+        problems, speed = [], reported_speed(host, port)
+        print("\n(remote instance: relay pins not checked)")
+
+    failures = problems
+    if error_rate * 100 > args.max_error_rate:
+        failures.append(f"error rate {error_rate * 100:.2f}% (limit {args.max_error_rate}%)")
+    print()
+    if failures:
+        for failure in failures:
+            print(f"✗ {failure}")
+        sys.exit(1)
+    print(f"✓ State consistent after the run (speed: {speed})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+"""
+Fan control daemon and its Unix-socket protocol
+
+One long-running process owns the GPIO hardware (this daemon, or the web app,
+which starts the same control socket) and every other front end talks to it
+over a Unix domain socket. Commands from cron jobs and shell scripts then
+take milliseconds, and the web app sees their changes immediately.
+
+Protocol: one request line, one reply line, UTF-8. A connection may send any
+number of requests.
+
+    speed <off|low|med|high> [fan]    ok <message>   | err <message>
+    timer <1|2|4> [fan]               ok <message>   | err <message>
+    cancel [fan]                      ok <message>   | err <message>
+    status [fan]                      ok <json>      | err <message>
+    ping                              ok pong
+
+The socket and the GPIO lock live in a directory only their owner can
+write (see runtime_dir()), never directly in a world-writable /tmp where
+another local user could plant a symlink or a socket of their own first.
+
+Usage: ./control_daemon.py [--socket /run/fan_control/control.sock]
+"""
+
+import json
+import os
+import socket
+import socketserver
+import stat
+import threading
+
+
+def runtime_dir():
+    """Directory for the control socket and the GPIO lock.
+
+    /run/fan_control for root (or when a root daemon has made it),
+    otherwise fan_control under $XDG_RUNTIME_DIR, or a per-user directory
+    in the temp dir.
+    """
+    if os.geteuid() == 0 or os.path.isdir('/run/fan_control'):
+        return '/run/fan_control'
+    if os.environ.get('XDG_RUNTIME_DIR'):
+        return os.path.join(os.environ['XDG_RUNTIME_DIR'], 'fan_control')
+    import tempfile
+    return os.path.join(tempfile.gettempdir(), f'fan_control-{os.geteuid()}')
+
+
+def make_runtime_dir(path):
+    """Create the directory holding path if needed, and refuse one that others can tamper with.
+
+    Raises RuntimeError if the directory is not a real directory owned by
+    this user (or root), or is writable by others without the sticky bit.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, mode=0o755 if os.geteuid() == 0 else 0o700, exist_ok=True)
+    info = os.lstat(directory)
+    if (not stat.S_ISDIR(info.st_mode) or info.st_uid not in (0, os.geteuid())
+            or (info.st_mode & 0o022 and not info.st_mode & stat.S_ISVTX)):
+        raise RuntimeError(f"{directory} is not a private directory; refusing to use it")
+
+
+# Where the daemon listens
+SOCKET_PATH = os.environ.get('FAN_SOCKET') or os.path.join(runtime_dir(), 'control.sock')
+
+# How long a client waits for the daemon to answer (seconds)
+CLIENT_TIMEOUT = 10.0
+
+# Longest request line accepted
+MAX_REQUEST = 1024
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            line = self.rfile.readline(MAX_REQUEST)
+            if not line:
+                return
+            ok, text = self.server.control.execute(line.decode('utf-8', 'replace'))
+            reply = ('ok ' if ok else 'err ') + text.replace('\n', ' ') + '\n'
+            self.wfile.write(reply.encode('utf-8'))
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class ControlServer:
+    """Serves the control protocol for a FanRegistry on a Unix socket."""
+
+    def __init__(self, registry, path=None):
+        self.registry = registry
+        self.path = path or SOCKET_PATH
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        """Bind the socket and serve it on a background thread.
+
+        Raises RuntimeError if another daemon is already listening on it.
+        """
+        make_runtime_dir(self.path)
+        if os.path.exists(self.path):
+            if ping(self.path):
+                raise RuntimeError(f"A fan control daemon is already listening on {self.path}")
+            os.unlink(self.path)  # stale socket from a process that died
+
+        self._server = _UnixServer(self.path, _Handler)
+        self._server.control = self
+        os.chmod(self.path, 0o660)
+        self._thread = threading.Thread(target=self._server.serve_forever,
+                                        name='control-socket', daemon=True)
+        self._thread.start()
+        # Imported here so the thin CLI client does not load logging
+        from event_log import get_logger
+        get_logger('daemon').info("Control socket listening on %s", self.path)
+
+    def stop(self):
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._server = None
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    def execute(self, line):
+        """Run one request line. Returns (success, reply text)."""
+        words = line.split()
+        if not words:
+            return False, "empty request"
+        command, args = words[0].lower(), words[1:]
+
+        try:
+            if command == 'ping':
+                return True, 'pong'
+            if command == 'speed' and len(args) in (1, 2):
+                fan = self._fan(args[1:])
+                return fan.change_speed(args[0], 'cli')
+            # Timer commands are validated and applied as the web API's are
+            if command == 'timer' and len(args) in (1, 2):
+                return self._fan(args[1:]).apply_timer(int(args[0]))
+            if command == 'cancel' and len(args) <= 1:
+                return self._fan(args).apply_timer(0)
+            if command == 'status' and len(args) <= 1:
+                if args:
+                    status = self._fan(args).status()
+                else:
+                    status = self.registry.status()
+                return True, json.dumps(status, default=str, separators=(',', ':'))
+        except LookupError as e:
+            return False, str(e)
+        except ValueError:
+            return False, f"invalid argument: {line.strip()}"
+        except Exception as e:
+            return False, f"{type(e).__name__}: {e}"
+
+        return False, f"unknown request: {line.strip()}"
+
+    def _fan(self, args):
+        fan = self.registry.get(args[0]) if args else self.registry.default
+        if fan is None:
+            raise LookupError(f"Unknown fan: {args[0] if args else '(default)'}")
+        return fan
+
+
+def send_command(line, path=None, timeout=CLIENT_TIMEOUT):
+    """Send one request to the daemon and return (success, reply text).
+
+    Raises OSError (e.g. FileNotFoundError, ConnectionRefusedError) if no
+    daemon is listening.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path or SOCKET_PATH)
+        sock.sendall(line.strip().encode('utf-8') + b'\n')
+        reply = sock.makefile('rb').readline().decode('utf-8').rstrip('\n')
+
+    status, _, text = reply.partition(' ')
+    return status == 'ok', text
+
+
+def ping(path=None):
+    """Return True if a daemon answers on the socket."""
+    try:
+        return send_command('ping', path, timeout=1.0)[0]
+    except OSError:
+        return False
+
+
+def client_main(cmd):
+    """Run a fan_control.py command through the daemon, if one is running.
+
+    Exits with the command's status when the daemon handled it. Returns only
+    when no daemon is listening (no socket, or a stale one), so the caller
+    can drive the relays itself once it holds the GPIO lock. Any other
+    socket error (permission denied, a timeout) exits with an error: a
+    daemon may well own the relays.
+    """
+    import sys
+
+    if cmd in ('off', 'low', 'med', 'high', 'hi'):
+        request = f"speed {cmd}"
+    elif cmd == 'status':
+        request = 'status'
+    else:
+        return
+
+    try:
+        ok, reply = send_command(request)
+    except (FileNotFoundError, ConnectionRefusedError):
+        if cmd == 'status':
+            print("No fan control daemon running")
+            sys.exit(1)
+        return
+    except OSError as e:
+        print(f"✗ Fan control daemon on {SOCKET_PATH} did not answer: {e}")
+        sys.exit(1)
+
+    if not ok:
+        print(f"✗ {reply}")
+        sys.exit(1)
+    print(reply if cmd == 'status' else f"Set speed: {cmd} (daemon)")
+    sys.exit(0)
+
+
+def main():
+    import argparse
+    import signal
+    import sys
+
+    parser = argparse.ArgumentParser(description="Run the fan control daemon")
+    parser.add_argument('--socket', default=SOCKET_PATH,
+                        help=f"Unix socket to listen on (default: {SOCKET_PATH})")
+    args = parser.parse_args()
+
+    import fan_control
+    from hardware_owner import hardware_owner
+    from schedules import ScheduleBook
+    from sensors import SensorHub
+    from state_journal import StateJournal
+    from usage import UsageStore
+
+    print("Starting fan control daemon...")
+    print(f"Mock Mode: {fan_control.MOCK_MODE}")
+
+    try:
+        fan_control.acquire_gpio_lock()
+    except RuntimeError as e:
+        print(f"✗ {e}")
+        sys.exit(1)
+
+    fan_control.init()
+    # Runtime and energy totals carry on from the last run
+    usage_store = UsageStore()
+    usage_store.attach(fan_control.registry)
+    # Bring back each fan's last speed and timers (off if it has none)
+    journal = StateJournal()
+    journal.restore(fan_control.registry)
+    journal.attach(fan_control.registry)
+    # Recurring schedules (managed through the web API)
+    def run_schedule(schedule):
+        fan = fan_control.registry.get(schedule.fan)
+        if fan is None:
+            return False, f"Unknown fan: {schedule.fan}"
+        return fan.change_speed(schedule.speed, 'schedule')
+
+    schedules = ScheduleBook(fan_control.registry, run_schedule)
+    schedules.start()
+    sensors = SensorHub(fan_control.registry)
+    sensors.start()
+
+    # Take commands only once the fans are back in their restored state
+    server = ControlServer(fan_control.registry, args.socket)
+    try:
+        server.start()
+    except RuntimeError as e:
+        print(f"✗ {e}")
+        schedules.stop()
+        sensors.stop()
+        journal.close()
+        usage_store.close()
+        sys.exit(1)
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    try:
+        stop.wait()
+    except KeyboardInterrupt:
+        pass
+
+    print("\nShutting down...")
+    server.stop()
+    schedules.stop()
+    sensors.stop()
+    journal.close()
+    usage_store.close()
+    fan_control.registry.scheduler.stop()
+    hardware_owner.stop()
+    fan_control.stop_button_polling()
+    fan_control.button_events.stop()
+
+
+if __name__ == '__main__':
+    main()
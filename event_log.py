@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Structured, non-blocking logging
+
+Every subsystem logs through its own logger under 'fan_control' (gpio,
+relays, buttons, timers, fans, hardware, web, daemon). setup_logging()
+hands every record to one background writer thread through a queue, so
+console and journal I/O never happen on the GPIO callback, hardware owner or
+request threads. The writer also keeps the most recent records in a ring
+buffer, served at /api/debug/log.
+
+Fields passed with extra={...} are kept as structured fields in the ring
+buffer, e.g. log.info("Fan speed set", extra={'fan': 'default', 'speed': 'high'}).
+"""
+
+import atexit
+import collections
+import logging
+import os
+
+# Parent of every subsystem logger
+ROOT_LOGGER = 'fan_control'
+
+# Level for the fan_control loggers (FAN_LOG_LEVEL=DEBUG for button traces)
+LOG_LEVEL = os.environ.get('FAN_LOG_LEVEL', 'INFO').upper()
+
+# Records kept in memory for /api/debug/log
+RING_BUFFER_SIZE = 500
+
+LOG_FORMAT = '%(asctime)s %(levelname)-7s %(name)s: %(message)s'
+
+# Attributes every LogRecord has; anything else arrived through extra=
+_STANDARD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+def get_logger(subsystem):
+    """Return the logger for a subsystem, e.g. get_logger('buttons')."""
+    return logging.getLogger(f'{ROOT_LOGGER}.{subsystem}')
+
+
+class RingBufferHandler(logging.Handler):
+    """Keeps the most recent records as plain dicts."""
+
+    def __init__(self, capacity=RING_BUFFER_SIZE):
+        super().__init__()
+        self.records = collections.deque(maxlen=capacity)
+        self._seq = 0
+
+    def emit(self, record):
+        self._seq += 1
+        entry = {
+            'seq': self._seq,
+            'time': record.created,
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        fields = {key: value for key, value in vars(record).items() if key not in _STANDARD_ATTRS}
+        if fields:
+            entry['fields'] = fields
+        self.records.append(entry)
+
+    def recent(self, limit=None, level=None, logger=None, since=0):
+        """Newest-last list of records, optionally filtered.
+
+        level is a minimum level name, logger a logger name prefix and since
+        a sequence number (only newer records are returned).
+        """
+        minimum = logging.getLevelName(level.upper()) if level else 0
+        if not isinstance(minimum, int):
+            raise ValueError(f"Unknown log level: {level}")
+        records = [entry for entry in list(self.records)
+                   if entry['seq'] > since
+                   and logging.getLevelName(entry['level']) >= minimum
+                   and (not logger or entry['logger'].startswith(logger))]
+        return records[-limit:] if limit else records
+
+
+# Recent records of every fan_control logger
+ring_buffer = RingBufferHandler()
+
+_listener = None
+
+
+def setup_logging(level=None, stream=None):
+    """Send the fan_control loggers through a queue to a background writer.
+
+    The writer prints to stream (stderr by default) and fills the ring
+    buffer. Safe to call more than once; later calls only change the level.
+    """
+    global _listener
+    # Imported here: importing event_log (and fan_control) should cost little
+    import logging.handlers
+    import queue
+
+    root = logging.getLogger(ROOT_LOGGER)
+    root.setLevel(level or LOG_LEVEL)
+    if _listener is not None:
+        return
+
+    log_queue = queue.SimpleQueue()
+    console = logging.StreamHandler(stream)
+    console.setFormatter(logging.Formatter(LOG_FORMAT))
+    _listener = logging.handlers.QueueListener(log_queue, console, ring_buffer)
+    _listener.start()
+
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.propagate = False
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Write out the queued records and stop the background writer."""
+    global _listener
+
+    import logging.handlers
+
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+        root = logging.getLogger(ROOT_LOGGER)
+        for handler in list(root.handlers):
+            if isinstance(handler, logging.handlers.QueueHandler):
+                root.removeHandler(handler)
+        root.propagate = True
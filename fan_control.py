@@ -1,13 +1,32 @@
 #!/usr/bin/env python3
+"""
+Fan control core: GPIO backend, fan controllers and button input.
+
+Importing this module touches no hardware. Call init() (or, for a single
+command, init_gpio() and a fan's setup_relays()) to take over the pins.
+"""
 import sys
 
+if __name__ == "__main__" and len(sys.argv) == 2:
+    # Thin client: a running daemon (control_daemon.py or the web app) owns
+    # the hardware, so hand it the command before loading anything else
+    import control_daemon
+    control_daemon.client_main(sys.argv[1].lower())
+
+from event_log import get_logger, setup_logging
+
+# One logger per subsystem (see event_log.py)
+gpio_log = get_logger('gpio')
+relay_log = get_logger('relays')
+button_log = get_logger('buttons')
+timer_log = get_logger('timers')
+fan_log = get_logger('fans')
+
 # Try to import RPi.GPIO, fall back to mock for development/testing
 try:
     import RPi.GPIO as GPIO
     MOCK_MODE = False
-    print("Running on Raspberry Pi with real GPIO")
 except ImportError:
-    print("RPi.GPIO not available - using mock GPIO for development/testing")
     MOCK_MODE = True
 
     # Mock GPIO class for development on non-Pi systems
@@ -29,11 +48,11 @@ except ImportError:
 
         @classmethod
         def setmode(cls, mode):
-            print(f"[MOCK] GPIO.setmode({mode})")
+            gpio_log.debug("[MOCK] GPIO.setmode(%s)", mode)
 
         @classmethod
         def setwarnings(cls, enabled):
-            print(f"[MOCK] GPIO.setwarnings({enabled})")
+            gpio_log.debug("[MOCK] GPIO.setwarnings(%s)", enabled)
 
         @classmethod
         def setup(cls, pin, mode, pull_up_down=None):
@@ -42,14 +61,19 @@ except ImportError:
                 cls._pin_states[pin] = cls.HIGH  # Default to HIGH for pulled-up input
             else:
                 cls._pin_states[pin] = cls.LOW  # Default to LOW for output
-            pull_str = f", pull_up_down={pull_up_down}" if pull_up_down else ""
-            print(f"[MOCK] GPIO.setup(pin={pin}, mode={mode}{pull_str})")
+            gpio_log.debug("[MOCK] GPIO.setup(pin=%s, mode=%s, pull_up_down=%s)", pin, mode, pull_up_down)
 
         @classmethod
         def output(cls, pin, state):
+            # Like RPi.GPIO, accept a list of channels (with one state or a list)
+            if isinstance(pin, (list, tuple)):
+                states = state if isinstance(state, (list, tuple)) else [state] * len(pin)
+                for p, s in zip(pin, states):
+                    cls._pin_states[p] = s
+                gpio_log.debug("[MOCK] GPIO.output(pins=%s, states=%s)", list(pin), states)
+                return
             cls._pin_states[pin] = state
-            state_name = "HIGH" if state else "LOW"
-            print(f"[MOCK] GPIO.output(pin={pin}, state={state_name})")
+            gpio_log.debug("[MOCK] GPIO.output(pin=%s, state=%s)", pin, "HIGH" if state else "LOW")
 
         @classmethod
         def input(cls, pin):
@@ -58,19 +82,19 @@ except ImportError:
 
         @classmethod
         def add_event_detect(cls, pin, edge, callback=None, bouncetime=200):
-            print(f"[MOCK] GPIO.add_event_detect(pin={pin}, edge={edge}, bouncetime={bouncetime})")
+            gpio_log.debug("[MOCK] GPIO.add_event_detect(pin=%s, edge=%s, bouncetime=%s)", pin, edge, bouncetime)
             if callback:
                 cls._callbacks[pin] = callback
 
         @classmethod
         def remove_event_detect(cls, pin):
-            print(f"[MOCK] GPIO.remove_event_detect(pin={pin})")
+            gpio_log.debug("[MOCK] GPIO.remove_event_detect(pin=%s)", pin)
             if pin in cls._callbacks:
                 del cls._callbacks[pin]
 
         @classmethod
         def cleanup(cls):
-            print("[MOCK] GPIO.cleanup()")
+            gpio_log.debug("[MOCK] GPIO.cleanup()")
             cls._pin_states.clear()
             cls._pin_modes.clear()
             cls._callbacks.clear()
@@ -79,15 +103,30 @@ except ImportError:
         def simulate_button_press(cls, pin):
             """Simulate a button press for testing"""
             if pin in cls._callbacks:
-                print(f"[MOCK] Simulating button press on pin {pin}")
+                gpio_log.debug("[MOCK] Simulating button press on pin %s", pin)
                 cls._callbacks[pin](pin)
 
     GPIO = MockGPIO()
 
-GPIO.setmode(GPIO.BCM)
-GPIO.setwarnings(False)
+import functools
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import metrics
+import state_journal
+import tracing
+from hardware_owner import hardware_owner, owned
+from usage import FanUsage
+from input_events import InputEventQueue
+from relay_driver import RelayDriver
+from scheduler import DeadlineScheduler
 
 # === YOUR MAPPING ===
+# Pins for the default fan. More fans can be described in a fan config file
+# (see load_fan_config below).
 RELAY_LOW_GPIO  = 26  # low speed
 RELAY_MED_GPIO  = 20  # medium speed
 RELAY_HIGH_GPIO = 21  # high speed
@@ -96,27 +135,55 @@ RELAY_HIGH_GPIO = 21  # high speed
 SPEED_BUTTON_GPIO = 16  # Speed cycling button
 TIMER_BUTTON_GPIO = 19  # Timer cycling button
 
+# === POWER ===
+# Watts the default fan draws at each speed, for the energy totals (per-fan
+# "power" in the fan config file overrides it)
+POWER_WATTS = {'off': 0, 'low': 25, 'med': 45, 'high': 70}
+
 # Button state tracking
 speed_states = ['off', 'low', 'med', 'high']
 timer_states = ['off', '1hr', '2hr', '4hr']
-current_speed_index = 0
-current_timer_index = 0
 
-# Last press time for debouncing
-import time
-last_speed_press = 0
-last_timer_press = 0
+# Timer lengths a user command may set (the web API, the control socket)
+TIMER_HOURS = (1, 2, 4)
+
 DEBOUNCE_TIME = 0.5  # 500ms debounce
 
-# Callback hooks for external integration (e.g., web app)
+# Safety limit on continuous running, per fan
+SAFETY_MAX_HOURS = 6
+
+# While a timer runs, its countdown is republished this often, so
+# remaining_seconds in a cached status is at most this stale (clients that
+# count down from the deadlines need no more)
+COUNTDOWN_TICK_SECONDS = 60
+
+# Fan config file: {"fans": [{"id": ..., "relays": {"low": .., "med": .., "high": ..},
+#                             "speed_button": .., "timer_button": ..,
+#                             "power": {"low": .., "med": .., "high": ..}}, ...]}
+FAN_CONFIG_PATH = os.environ.get(
+    'FAN_CONFIG', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fans.json'))
+
+# Set once init_gpio() has configured the GPIO library
+gpio_ready = False
+
+# Lock file held by the one process that owns the GPIO hardware (None:
+# gpio.lock in the private runtime directory shared with the control socket)
+GPIO_LOCK_PATH = os.environ.get('FAN_GPIO_LOCK')
+gpio_lock_file = None
+
+# Callback hooks for external integration (e.g., web app).
+# These fire for the default fan's buttons; other fans are handled by their
+# controllers directly.
 speed_change_callback = None
 timer_change_callback = None
 
-# Button polling thread variables
+# Button input loop thread variables
 button_thread = None
 button_thread_running = False
-last_speed_state = None
-last_timer_state = None
+
+# The ButtonInput created by setup_buttons()
+button_input = None
+
 
 def register_speed_change_callback(callback_func):
     """Register a callback function to be called when speed changes via button"""
@@ -129,246 +196,1241 @@ def register_timer_change_callback(callback_func):
     timer_change_callback = callback_func
 
 
-def speed_button_callback(pin):
-    """Handle speed button press - cycles through off, low, med, high"""
-    global current_speed_index
+# === ACTIVE LEVEL SETTING ===
+# Most Pi relay boards are active-LOW: pin LOW = relay ON.
+# If your relays behave inverted, change these two lines so:
+ACTIVE_LEVEL = GPIO.HIGH
+INACTIVE_LEVEL = GPIO.LOW
+# ACTIVE_LEVEL   = GPIO.LOW
+# INACTIVE_LEVEL = GPIO.HIGH
+
+SPEED_PINS = {
+    "low":  RELAY_LOW_GPIO,
+    "med":  RELAY_MED_GPIO,
+    "high": RELAY_HIGH_GPIO,
+}
+
+# Every relay write of every fan goes through this driver, which skips writes
+# that change nothing and enforces the break-before-make dead time
+relay_driver = RelayDriver(GPIO, ACTIVE_LEVEL, INACTIVE_LEVEL)
+
+
+def acquire_gpio_lock(path=None):
+    """Make this process the only owner of the GPIO state.
+
+    Takes an exclusive lock on GPIO_LOCK_PATH for the life of the process and
+    raises RuntimeError if another process (e.g. a second server) holds it.
+    """
+    global gpio_lock_file
+    import fcntl
+    import control_daemon
+
+    if gpio_lock_file is not None:
+        return
+    path = path or GPIO_LOCK_PATH or os.path.join(control_daemon.runtime_dir(), 'gpio.lock')
+    try:
+        control_daemon.make_runtime_dir(path)
+        # O_NOFOLLOW: never truncate the target of a symlink planted at path
+        fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW | os.O_CLOEXEC, 0o644)
+    except OSError as e:
+        raise RuntimeError(f"Cannot open the fan GPIO lock {path}: {e}")
+    lock_file = os.fdopen(fd, 'r+')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        raise RuntimeError(f"Another process already owns the fan GPIO (lock: {path})")
+    lock_file.seek(0)
+    lock_file.truncate()
+    lock_file.write(f"{os.getpid()}\n")
+    lock_file.flush()
+    gpio_lock_file = lock_file
+
+
+class SystemClock:
+    """Time as seen by the fan timers, timestamps and button debouncing.
+
+    simulation.VirtualClock provides the same methods on virtual time.
+    """
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def now(self):
+        return datetime.now()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
 
-    print(f"[DEBUG] speed_button_callback() called on pin {pin}")
+clock = SystemClock()
 
-    # Cycle to next speed
-    current_speed_index = (current_speed_index + 1) % len(speed_states)
-    new_speed = speed_states[current_speed_index]
 
-    print(f"Speed button pressed: Setting fan to {new_speed}")
+def _now_text():
+    return clock.now().strftime('%Y-%m-%d %H:%M:%S')
 
-    # If there's a callback registered (e.g., from web app), use it
-    if speed_change_callback:
-        print(f"[DEBUG] Calling web app callback for speed change")
+
+class FanState:
+    """Immutable snapshot of one fan's speed and timers.
+
+    A FanController never changes its snapshot: every change builds a
+    modified copy with replace() and swaps it in with one assignment
+    (copy-on-write, on the hardware owner thread). A reader that takes
+    fan.current gets a consistent speed and timers without a lock, and the
+    time left on the timers is derived from their deadlines, so reading
+    changes nothing and never actuates. The dicts also carry each deadline
+    as a Unix time, so a client holding an older copy (e.g. a cached
+    /api/status body) can count down on its own.
+    """
+
+    __slots__ = ('speed', 'last_changed', 'source', 'mock_mode',
+                 'timer_hours', 'timer_end', 'safety_max_hours', 'safety_end')
+
+    def __init__(self, speed='off', last_changed=None, source=None, mock_mode=MOCK_MODE,
+                 timer_hours=0, timer_end=None, safety_max_hours=SAFETY_MAX_HOURS, safety_end=None):
+        set_field = object.__setattr__
+        set_field(self, 'speed', speed)
+        set_field(self, 'last_changed', last_changed)
+        set_field(self, 'source', source)             # what made the last speed change (see speed_source)
+        set_field(self, 'mock_mode', mock_mode)
+        set_field(self, 'timer_hours', timer_hours)
+        set_field(self, 'timer_end', timer_end)       # datetime, None while no timer runs
+        set_field(self, 'safety_max_hours', safety_max_hours)
+        set_field(self, 'safety_end', safety_end)     # datetime, None while the fan is off
+
+    def __setattr__(self, name, value):
+        raise AttributeError("FanState is immutable; use replace()")
+
+    def replace(self, **changes):
+        """A copy with some fields changed."""
+        fields = {name: getattr(self, name) for name in self.__slots__}
+        fields.update(changes)
+        return FanState(**fields)
+
+    @property
+    def timer_active(self):
+        return self.timer_end is not None
+
+    @property
+    def safety_active(self):
+        return self.safety_end is not None
+
+    def state_dict(self):
+        return {
+            'speed': self.speed,
+            'last_changed': self.last_changed,
+            'mock_mode': self.mock_mode
+        }
+
+    def timer_dict(self, now):
+        if self.timer_end is None:
+            return {'active': False, 'duration_hours': 0, 'start_time': None, 'end_time': None,
+                    'deadline': None, 'remaining_seconds': 0}
+        remaining = max(0, int((self.timer_end - now).total_seconds()))
+        return {
+            'active': True,
+            'duration_hours': self.timer_hours,
+            'start_time': self.timer_end - timedelta(hours=self.timer_hours),
+            'end_time': self.timer_end,
+            'deadline': round(self.timer_end.timestamp(), 3),
+            # Rounded up to the next full minute for display (2:00 rather than 1:59)
+            'remaining_seconds': remaining + (60 - remaining % 60) if remaining % 60 else remaining
+        }
+
+    def safety_dict(self, now):
+        if self.safety_end is None:
+            return {'active': False, 'start_time': None, 'max_hours': self.safety_max_hours,
+                    'deadline': None, 'remaining_seconds': 0}
+        start = self.safety_end - timedelta(hours=self.safety_max_hours)
+        total = self.safety_max_hours * 3600
+        return {
+            'active': True,
+            'start_time': start,
+            'max_hours': self.safety_max_hours,
+            'deadline': round(self.safety_end.timestamp(), 3),
+            'remaining_seconds': max(0, total - int((now - start).total_seconds()))
+        }
+
+    def status(self, now):
+        """current_state, timer_state and safety_timer_state dicts as of now (a datetime)."""
+        return {
+            'current_state': self.state_dict(),
+            'timer_state': self.timer_dict(now),
+            'safety_timer_state': self.safety_dict(now)
+        }
+
+
+def notifies_once(method):
+    """Send one state notification at the end of a FanController command.
+
+    The _notify() calls made while the command runs, including those of the
+    commands it calls in turn (a speed change cancels or restarts timers),
+    are collected into a single notification sent when the outermost one
+    returns. Runs on the hardware owner thread (put it under @owned).
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        self._notify_depth += 1
         try:
-            speed_change_callback(new_speed)
-        except Exception as e:
-            print(f"Error in speed change callback: {e}")
-            # Fall back to direct control if callback fails
-            set_speed(new_speed)
-    else:
-        # No callback registered, use direct control
-        set_speed(new_speed)
+            return method(self, *args, **kwargs)
+        finally:
+            self._notify_depth -= 1
+            if self._notify_depth == 0 and self._notify_pending:
+                self._notify_pending = False
+                self._notify()
+    return wrapper
 
 
-def timer_button_callback(pin):
-    """Handle timer button press - cycles through off, 1hr, 2hr, 4hr"""
-    global current_timer_index
+class FanController:
+    """One fan: its relay and button pins, its speed state and its timers.
+
+    Relay writes go through write_speeds() so that several fans can be
+    switched in one hardware pass. State changes are reported to the
+    registry, which forwards them to its listeners (e.g. the web app).
 
-    print(f"[DEBUG] timer_button_callback() called on pin {pin}")
+    The speed and timers are held in an immutable FanState (fan.current)
+    that is replaced, never modified, so readers need no lock. state,
+    timer_state and safety_timer_state are dict copies of it.
 
-    # Cycle to next timer setting
-    current_timer_index = (current_timer_index + 1) % len(timer_states)
-    new_timer = timer_states[current_timer_index]
+    Methods that actuate or change state run on the hardware owner thread
+    (see hardware_owner.py), whichever thread calls them.
+    """
 
-    print(f"Timer button pressed: Setting timer to {new_timer}")
+    def __init__(self, fan_id, speed_pins, speed_button=None, timer_button=None,
+                 name=None, scheduler=None, safety_max_hours=SAFETY_MAX_HOURS, power_watts=None):
+        self.fan_id = fan_id
+        self.name = name or fan_id
+        self.speed_pins = dict(speed_pins)
+        self.speed_button = speed_button
+        self.timer_button = timer_button
+        self.scheduler = scheduler
+        self.registry = None
+
+        # Position in speed_states / timer_states for the cycle buttons
+        self.speed_index = 0
+        self.timer_index = 0
+
+        # Speed and timers; only ever replaced (see FanState)
+        self.current = FanState(last_changed=_now_text(), safety_max_hours=safety_max_hours)
+
+        # Scheduled-call handles for the active timers
+        self._timer_handle = None
+        self._safety_timer_handle = None
+        self._countdown_tick_handle = None
+
+        # Nesting depth of @notifies_once commands, and whether one of them
+        # changed the state (notified once the outermost returns)
+        self._notify_depth = 0
+        self._notify_pending = False
+
+        # Bumped whenever a timer is armed or cancelled. An expiry carries the
+        # generation it was armed with, so one that fired while a newer
+        # command was queued ahead of it on the hardware owner is ignored.
+        self._timer_generation = 0
+        self._safety_generation = 0
+
+        # Metric series, created once so updates allocate nothing (see metrics.py)
+        self.relay_metrics = {
+            speed: (metrics.relay_transitions.add((fan_id, speed), fan=fan_id, speed=speed),
+                    metrics.relay_transition_seconds.add((fan_id, speed), fan=fan_id, speed=speed))
+            for speed in speed_states}
+        self.speed_seconds = {speed: metrics.speed_seconds.add((fan_id, speed), fan=fan_id, speed=speed)
+                              for speed in speed_states}
+        self.button_metrics = {
+            kind: (metrics.button_presses.add(pin, fan=fan_id, button=kind, pin=pin),
+                   metrics.button_debounce_rejections.add(pin, fan=fan_id, button=kind, pin=pin))
+            for kind, pin in (('speed', speed_button), ('timer', timer_button)) if pin is not None}
+        self.timer_metrics = {kind: metrics.timers_active.add((fan_id, kind), fan=fan_id, timer=kind)
+                              for kind in ('timer', 'safety')}
+        self._speed_since = clock.monotonic()
+        self._speed_time_lock = threading.Lock()
+
+        # Runtime and energy per speed, in total and per day (see usage.py)
+        self.usage = FanUsage(speed_states, {**POWER_WATTS, **(power_watts or {})})
+
+    def __repr__(self):
+        return f"FanController({self.fan_id!r}, speed={self.current.speed!r})"
+
+    @property
+    def speed_source(self):
+        """What made the last speed change: 'web', 'button', 'timer', 'safety',
+        'cli', 'restore', 'schedule', 'sensor' (None until something does)."""
+        return self.current.source
+
+    @property
+    def state(self):
+        """Copy of the current_state dict (speed, last_changed, mock_mode)."""
+        return self.current.state_dict()
+
+    @property
+    def timer_state(self):
+        """Copy of the timer_state dict, with the time left as of now."""
+        return self.current.timer_dict(clock.now())
+
+    @property
+    def safety_timer_state(self):
+        """Copy of the safety_timer_state dict, with the time left as of now."""
+        return self.current.safety_dict(clock.now())
+
+    # --- Hardware -------------------------------------------------------
+
+    def setup_relays(self, preserve=False):
+        """Configure this fan's relay pins as outputs, all off.
+
+        With preserve=True the relays keep their current levels (read back
+        into the relay driver), so a command that repeats the current speed
+        does not drop the fan.
+        """
+        for pin in self.speed_pins.values():
+            relay_driver.claim(pin, None if preserve else INACTIVE_LEVEL)
+
+    def relay_levels(self, speed_name):
+        """Return {pin: level} for every relay pin of this fan at speed_name."""
+        return {pin: ACTIVE_LEVEL if name == speed_name else INACTIVE_LEVEL
+                for name, pin in self.speed_pins.items()}
+
+    @owned('relays')
+    def write_speed(self, speed_name):
+        """Drive the relays for speed_name without touching the state."""
+        write_speeds({self: speed_name})
+
+    # --- Speed ----------------------------------------------------------
+
+    @owned('speed')
+    @notifies_once
+    def change_speed(self, speed, source=None):
+        """Change the fan speed and update state and timers.
+
+        source says what asked for the change (see speed_source).
+        Returns (success, message).
+        """
+        speed = validate_speed(speed)
+        if speed is None:
+            return False, f"Invalid speed. Must be one of {speed_states}"
 
-    # If there's a callback registered (e.g., from web app), use it
-    if timer_change_callback:
         try:
-            timer_change_callback(new_timer)
+            self.write_speed(speed)
         except Exception as e:
-            print(f"Error in timer change callback: {e}")
-    else:
-        # No callback registered, just print
+            return False, f"Error setting fan speed: {str(e)}"
+
+        return True, self.commit_speed(speed, source)
+
+    @owned()
+    @notifies_once
+    def commit_speed(self, speed, source=None):
+        """Record a speed that has already been written to the relays."""
+        self.account_speed_time()
+        self.current = self.current.replace(speed=speed, last_changed=_now_text(), source=source)
+        self.speed_index = speed_states.index(speed)
+
+        if speed == 'off':
+            # Cancel timers when manually turning off
+            self.cancel_timer()
+            self.cancel_safety_timer()
+        else:
+            # Start or reset safety timer when fan is turned on
+            self.start_safety_timer()
+
+        self._notify()
+        fan_log.info("Fan '%s' speed set to %s", self.fan_id, speed,
+                     extra={'fan': self.fan_id, 'speed': speed, 'event': 'speed_changed'})
+
+        message = f"Fan speed set to: {speed.upper()}"
+        if MOCK_MODE:
+            message += " (MOCK MODE)"
+        return message
+
+    @owned()
+    @notifies_once
+    def cycle_speed(self, source=None):
+        """Advance to the next speed in speed_states. Returns (success, message, speed)."""
+        new_speed = speed_states[(self.speed_index + 1) % len(speed_states)]
+        success, message = self.change_speed(new_speed, source)
+        return success, message, new_speed
+
+    # --- User timer -----------------------------------------------------
+
+    @owned('timer')
+    @notifies_once
+    def set_timer(self, hours):
+        """Set a timer for the specified number of hours."""
+        # Cancel existing timer
+        self.cancel_timer()
+
+        # Set new timer
+        self._arm_timer(hours, hours * 3600)
+        self._notify()
+
+        return True, f"Timer set for {hours} hour{'s' if hours != 1 else ''}"
+
+    def _arm_timer(self, hours, remaining):
+        """Start an hours-long timer with remaining seconds left on it."""
+        end_time = clock.now() + timedelta(seconds=remaining)
+        self.current = self.current.replace(timer_hours=hours, timer_end=end_time)
+        self.timer_index = timer_states.index(f'{hours}hr') if f'{hours}hr' in timer_states else 0
+
+        # Fire timer_expired once at the deadline
+        self._timer_generation += 1
+        self._timer_handle = self.scheduler.call_later(remaining, self.timer_expired, self._timer_generation)
+        self._schedule_countdown_tick()
+
+    @owned('timer')
+    @notifies_once
+    def cancel_timer(self):
+        """Cancel the active timer."""
+        if self._timer_handle is not None:
+            self._timer_handle.cancel()
+            self._timer_handle = None
+        self._timer_generation += 1
+
+        self.current = self.current.replace(timer_hours=0, timer_end=None)
+        self.timer_index = 0
+        self._notify()
+
+    @owned()
+    @notifies_once
+    def cycle_timer(self, steps=1):
+        """Advance to the next timer setting. Returns (success, message, timer)."""
+        new_timer = timer_states[(self.timer_index + steps) % len(timer_states)]
+
         if new_timer == 'off':
-            print("Timer disabled")
+            self.cancel_timer()
+            success, message = True, 'Timer cycled to off'
+        else:
+            # Convert timer state to hours (e.g., '1hr' -> 1)
+            success, message = self.set_timer(int(new_timer.replace('hr', '')))
+            if success:
+                message = f'Timer cycled to {new_timer}'
+
+        # Reset safety timer since this is user interaction
+        if self.current.speed != 'off':
+            self.start_safety_timer()
+
+        return success, message, new_timer
+
+    @owned('timer')
+    @notifies_once
+    def apply_timer(self, hours):
+        """Set (or with 0, cancel) the timer for a user command. Returns (success, message).
+
+        Only TIMER_HOURS lengths are accepted. Like any user interaction, it
+        resets the safety timer of a running fan.
+        """
+        if hours == 0:
+            self.cancel_timer()
+            success, message = True, 'Timer cancelled'
+        elif hours not in TIMER_HOURS:
+            return False, "Invalid timer duration. Must be 1, 2, or 4 hours"
         else:
-            print(f"Timer set to {new_timer} (web app will handle actual timing)")
+            success, message = self.set_timer(hours)
+
+        # Reset safety timer since this is user interaction
+        if self.current.speed != 'off':
+            self.start_safety_timer()
+        return success, message
+
+    @owned(expires=False)
+    @notifies_once
+    def timer_expired(self, generation=None):
+        """Handle timer expiration.
+
+        generation is the one the timer was armed with; an expiry for a timer
+        since replaced or cancelled does nothing.
+        """
+        if generation is not None and generation != self._timer_generation:
+            timer_log.debug("Ignoring a stale timer expiry for fan '%s'", self.fan_id)
+            return
+        self._timer_handle = None
+        self.current = self.current.replace(timer_hours=0, timer_end=None)
+        self.change_speed('off', 'timer')
+        timer_log.info("Timer expired - Fan '%s' turned off automatically", self.fan_id,
+                       extra={'fan': self.fan_id, 'event': 'timer_expired'})
+
+    # --- Safety timer ---------------------------------------------------
+
+    @owned('safety')
+    @notifies_once
+    def start_safety_timer(self):
+        """Start or reset the safety timer."""
+        # Cancel existing safety timer
+        self.cancel_safety_timer()
+
+        # Only start safety timer if fan is not off
+        if self.current.speed == 'off':
+            return
+
+        # Set new safety timer
+        self._arm_safety_timer(self.current.safety_max_hours * 3600)
+        self._notify()
+
+        timer_log.info("Safety timer started: Fan '%s' will auto-stop after %s hours of continuous operation",
+                       self.fan_id, self.current.safety_max_hours)
+
+    def _arm_safety_timer(self, remaining):
+        """Start the safety timer with remaining seconds left on it."""
+        self.current = self.current.replace(safety_end=clock.now() + timedelta(seconds=remaining))
+
+        # Fire safety_timer_expired once at the deadline
+        self._safety_generation += 1
+        self._safety_timer_handle = self.scheduler.call_later(remaining, self.safety_timer_expired,
+                                                              self._safety_generation)
+        self._schedule_countdown_tick()
+
+    @owned('safety')
+    @notifies_once
+    def cancel_safety_timer(self):
+        """Cancel the safety timer."""
+        if self._safety_timer_handle is not None:
+            self._safety_timer_handle.cancel()
+            self._safety_timer_handle = None
+        self._safety_generation += 1
+
+        self.current = self.current.replace(safety_end=None)
+        self._notify()
+
+    @owned(expires=False)
+    @notifies_once
+    def safety_timer_expired(self, generation=None):
+        """Handle safety timer expiration by forcing fan off.
+
+        A stale expiry (see timer_expired) does nothing.
+        """
+        if generation is not None and generation != self._safety_generation:
+            timer_log.debug("Ignoring a stale safety timer expiry for fan '%s'", self.fan_id)
+            return
+        timer_log.warning("SAFETY TIMER EXPIRED: Fan '%s' has been running for %s+ hours. Automatically turning off for safety.",
+                          self.fan_id, self.current.safety_max_hours,
+                          extra={'fan': self.fan_id, 'event': 'safety_timer_expired'})
+        self._safety_timer_handle = None
+        # Force fan off for safety
+        self.write_speed('off')
+        self.account_speed_time()
+        self.current = self.current.replace(speed='off', last_changed=_now_text(), source='safety',
+                                            safety_end=None)
+        self.speed_index = 0
+        # Also cancel regular timer if active
+        self.cancel_timer()
+        self._notify()
+
+    # --- Persistence ----------------------------------------------------
+
+    def snapshot(self):
+        """This fan's speed and timer deadlines (Unix time), as a state journal record."""
+        current = self.current
+        timer_end, safety_end = current.timer_end, current.safety_end
+        return {
+            'fan': self.fan_id,
+            'speed': current.speed,
+            'last_changed': current.last_changed,
+            'timer_hours': current.timer_hours if timer_end else 0,
+            'timer_end': round(timer_end.timestamp(), 3) if timer_end else None,
+            'safety_end': round(safety_end.timestamp(), 3) if safety_end else None,
+            'time': round(clock.now().timestamp(), 3),
+        }
+
+    @owned()
+    @notifies_once
+    def restore(self, record):
+        """Bring back a journaled speed and the time left on its timers.
+
+        A deadline that passed while nothing was running has done its job:
+        the fan comes back off. Returns the speed restored.
+        """
+        now = clock.now().timestamp()
+        speed = validate_speed(record.get('speed')) or 'off'
+        if state_journal.is_expired(record, now):
+            speed = 'off'
+
+        self.write_speed(speed)
+        self.cancel_timer()
+        self.cancel_safety_timer()
+        self.account_speed_time()
+        self.current = self.current.replace(speed=speed, last_changed=record.get('last_changed') or _now_text(),
+                                            source='restore')
+        self.speed_index = speed_states.index(speed)
+
+        if speed != 'off':
+            if record.get('timer_end') is not None:
+                self._arm_timer(record.get('timer_hours') or 0, record['timer_end'] - now)
+            safety_end = record.get('safety_end')
+            self._arm_safety_timer(safety_end - now if safety_end is not None
+                                   else self.current.safety_max_hours * 3600)
+
+        self._notify()
+        fan_log.info("Fan '%s' restored to %s", self.fan_id, speed,
+                     extra={'fan': self.fan_id, 'speed': speed, 'event': 'restored'})
+        return speed
+
+    # --- Status ---------------------------------------------------------
+
+    def account_speed_time(self):
+        """Add the time since the last call to the current speed's runtime and energy totals.
+
+        Called before every speed change, so each transition costs one update.
+        """
+        with self._speed_time_lock:
+            now = clock.monotonic()
+            elapsed = max(0.0, now - self._speed_since)
+            speed = self.current.speed
+            self.speed_seconds[speed].inc(elapsed)
+            self.usage.add(speed, elapsed, clock.now())
+            self._speed_since = now
+
+    def usage_report(self, days=None):
+        """Hours and kWh per speed, in total and for the newest days, up to now."""
+        self.account_speed_time()
+        return {'fan': self.fan_id, **self.usage.report(days)}
+
+    def status(self):
+        """Return this fan's current_state, timer_state and safety_timer_state.
+
+        Built from one snapshot and free of side effects: a timer past its
+        deadline shows 0 left until the scheduler turns the fan off.
+        """
+        return self.current.status(clock.now())
+
+    def _schedule_countdown_tick(self):
+        """Republish the state once a minute while a timer is counting down."""
+        current = self.current
+        if self._countdown_tick_handle is None and (current.timer_active or current.safety_active):
+            self._countdown_tick_handle = self.scheduler.call_later(COUNTDOWN_TICK_SECONDS, self._countdown_tick)
+
+    @owned(expires=False)
+    def _countdown_tick(self):
+        """Publish the state and arm the next tick, on the owner thread like the expiries."""
+        self._countdown_tick_handle = None
+        self._notify()
+        self._schedule_countdown_tick()
+
+    def _notify(self):
+        if self._notify_depth:
+            self._notify_pending = True
+        elif self.registry is not None:
+            self.registry.notify(self)
+
+    # --- Buttons --------------------------------------------------------
+
+    @owned(wait=False)
+    def on_speed_button(self, presses=1):
+        """Handle speed button presses - each one cycles through off, low, med, high"""
+        new_speed = speed_states[(self.speed_index + presses) % len(speed_states)]
+        button_log.info("Speed button pressed: Setting fan '%s' to %s", self.fan_id, new_speed,
+                        extra={'fan': self.fan_id, 'speed': new_speed, 'presses': presses})
+
+        # If there's a callback registered (e.g., from web app), use it
+        if speed_change_callback and self.registry is not None and self is self.registry.default:
+            button_log.debug("Calling web app callback for speed change")
+            traced = tracing.clock() if tracing.enabled else None
+            try:
+                speed_change_callback(new_speed)
+                return
+            except Exception as e:
+                button_log.error("Error in speed change callback: %s", e)
+                # Fall back to direct control if callback fails
+            finally:
+                if traced is not None:
+                    tracing.record('button.speed_change_callback', traced, speed=new_speed)
+
+        self.change_speed(new_speed, 'button')
+
+    @owned(wait=False)
+    def on_timer_button(self, presses=1):
+        """Handle timer button presses - each one cycles through off, 1hr, 2hr, 4hr"""
+        new_timer = timer_states[(self.timer_index + presses) % len(timer_states)]
+        button_log.info("Timer button pressed: Setting fan '%s' timer to %s", self.fan_id, new_timer,
+                        extra={'fan': self.fan_id, 'timer': new_timer, 'presses': presses})
+
+        # If there's a callback registered (e.g., from web app), use it
+        if timer_change_callback and self.registry is not None and self is self.registry.default:
+            traced = tracing.clock() if tracing.enabled else None
+            try:
+                timer_change_callback(new_timer)
+            except Exception as e:
+                button_log.error("Error in timer change callback: %s", e)
+            if traced is not None:
+                tracing.record('button.timer_change_callback', traced, timer=new_timer)
+            return
 
+        self.cycle_timer(presses)
 
-def start_button_polling():
-    """Start polling thread for button presses when edge detection fails"""
-    global button_thread, button_thread_running, last_speed_state, last_timer_state
 
-    if button_thread_running:
+class FanRegistry:
+    """All fans driven by this process, in configuration order.
+
+    The first fan added is the default fan used by the single-fan API.
+    """
+
+    def __init__(self, scheduler=None):
+        # One scheduler thread serves the timers of every fan
+        self.scheduler = scheduler or DeadlineScheduler(name='fan-timers')
+        self._fans = {}
+        self._listeners = []
+
+    def add(self, fan):
+        if fan.fan_id in self._fans:
+            raise ValueError(f"Duplicate fan id: {fan.fan_id}")
+        fan.registry = self
+        if fan.scheduler is None:
+            fan.scheduler = self.scheduler
+        self._fans[fan.fan_id] = fan
+        return fan
+
+    def get(self, fan_id):
+        """Return the fan with this id, or None."""
+        return self._fans.get(fan_id)
+
+    def ids(self):
+        return list(self._fans)
+
+    def __iter__(self):
+        return iter(list(self._fans.values()))
+
+    def __len__(self):
+        return len(self._fans)
+
+    @property
+    def default(self):
+        return next(iter(self._fans.values()), None)
+
+    def use_scheduler(self, scheduler):
+        """Run the timers of every fan on another scheduler (e.g. asyncio's loop)."""
+        self.scheduler = scheduler
+        for fan in self:
+            fan.scheduler = scheduler
+
+    def add_listener(self, callback):
+        """Call callback(fan) whenever a fan's state changes."""
+        self._listeners.append(callback)
+
+    def notify(self, fan):
+        for callback in self._listeners:
+            try:
+                callback(fan)
+            except Exception as e:
+                fan_log.error("Error in fan state listener: %s", e)
+
+    def button_pins(self):
+        """Return {pin: (fan, 'speed' | 'timer')} for every configured button."""
+        pins = {}
+        for fan in self:
+            if fan.speed_button is not None:
+                pins[fan.speed_button] = (fan, 'speed')
+            if fan.timer_button is not None:
+                pins[fan.timer_button] = (fan, 'timer')
+        return pins
+
+    def setup_relays(self, preserve=False):
+        for fan in self:
+            fan.setup_relays(preserve)
+
+    def bulk_commands(self, data):
+        """Turn a bulk speed request into {fan_id: speed}. Returns (commands, error).
+
+        data is {"speed": "low", "fans": ["a", "b"]} ("fans" left out for
+        every fan) or {"commands": {"a": "low", "b": "off"}}. error is None,
+        or a message for a malformed request or a fan list naming an unknown fan.
+        """
+        if not isinstance(data, dict):
+            return None, 'Speed or commands parameter required'
+        if 'commands' in data:
+            if not isinstance(data['commands'], dict):
+                return None, 'commands must map fan ids to speeds'
+            return data['commands'], None
+        if not data.get('speed'):
+            return None, 'Speed or commands parameter required'
+
+        fan_ids = data.get('fans')
+        if fan_ids is None:
+            fan_ids = self.ids()
+        elif not isinstance(fan_ids, list) or not all(isinstance(fan_id, str) for fan_id in fan_ids):
+            return None, 'fans must be a list of fan ids'
+        unknown = [fan_id for fan_id in fan_ids if fan_id not in self._fans]
+        if unknown:
+            return None, f"Unknown fan: {', '.join(unknown)}"
+        return {fan_id: data['speed'] for fan_id in fan_ids}, None
+
+    def apply_speeds(self, commands, source=None):
+        """Set several fans at once: commands is {fan_id: speed}.
+
+        Every relay change for every affected fan is written in one hardware
+        pass before any state is updated. Returns {fan_id: (success, message)}.
+        """
+        return hardware_owner.call(self._apply_speeds, dict(commands), source)
+
+    def _apply_speeds(self, commands, source=None):
+        results = {}
+        targets = {}
+        for fan_id, speed in commands.items():
+            fan = self.get(fan_id)
+            if fan is None:
+                results[fan_id] = (False, f"Unknown fan: {fan_id}")
+                continue
+            speed = validate_speed(speed)
+            if speed is None:
+                results[fan_id] = (False, f"Invalid speed. Must be one of {speed_states}")
+                continue
+            targets[fan] = speed
+
+        if targets:
+            try:
+                write_speeds(targets)
+            except Exception as e:
+                for fan in targets:
+                    results[fan.fan_id] = (False, f"Error setting fan speed: {str(e)}")
+                return results
+
+        for fan, speed in targets.items():
+            results[fan.fan_id] = (True, fan.commit_speed(speed, source))
+        return results
+
+    def status(self):
+        """Return {fan_id: status} for every fan."""
+        return {fan.fan_id: fan.status() for fan in self}
+
+
+def validate_speed(speed):
+    """Return the normalized speed name, or None if it is not valid."""
+    if not isinstance(speed, str):
+        return None
+    speed = speed.lower()
+    if speed == 'hi':
+        speed = 'high'
+    return speed if speed in speed_states else None
+
+
+def write_speeds(targets):
+    """Drive the relays of several fans in one pass: targets is {fan: speed}.
+
+    The relay driver writes every relay that must turn off before any relay
+    turns on, so no fan ever has two speeds energized at once. Relays that
+    are already at the right level are not written, so repeating the
+    current speed costs nothing.
+    """
+    levels = {}
+    changed = []
+    for fan, speed in targets.items():
+        if any(relay_driver.level(pin) is None for pin in fan.speed_pins.values()):
+            # First use without init(): claim this fan's relays on demand
+            init_gpio()
+            fan.setup_relays(preserve=True)
+        fan_levels = fan.relay_levels(speed)
+        if any(relay_driver.level(pin) != level for pin, level in fan_levels.items()):
+            changed.append(fan)
+        levels.update(fan_levels)
+
+    start = time.perf_counter()
+    if not relay_driver.apply(levels):
         return
+    elapsed = time.perf_counter() - start
 
-    # Initialize button states
-    if not MOCK_MODE:
-        last_speed_state = GPIO.input(SPEED_BUTTON_GPIO)
-        last_timer_state = GPIO.input(TIMER_BUTTON_GPIO)
+    for fan in changed:
+        transitions, seconds = fan.relay_metrics[targets[fan]]
+        transitions.inc()
+        seconds.observe(elapsed)
+
+    for fan, speed in targets.items():
+        if speed in fan.speed_pins:
+            relay_log.debug("Fan '%s' speed set to: %s (GPIO pin %s)", fan.fan_id, speed.upper(), fan.speed_pins[speed])
+        else:
+            relay_log.debug("Fan '%s' relays turned OFF", fan.fan_id)
+
+
+def load_fan_config(path=None):
+    """Build a FanRegistry from the fan config file, or the default single fan."""
+    path = path or FAN_CONFIG_PATH
+    fan_registry = FanRegistry()
+
+    if os.path.exists(path):
+        import json
+        with open(path) as f:
+            config = json.load(f)
+        for entry in config.get('fans', []):
+            fan_registry.add(FanController(
+                entry['id'],
+                {speed: int(pin) for speed, pin in entry['relays'].items()},
+                speed_button=entry.get('speed_button'),
+                timer_button=entry.get('timer_button'),
+                name=entry.get('name'),
+                safety_max_hours=entry.get('safety_max_hours', SAFETY_MAX_HOURS),
+                power_watts=entry.get('power')))
+        fan_log.info("Loaded %d fan(s) from %s", len(fan_registry), path)
+
+    if not len(fan_registry):
+        fan_registry.add(FanController('default', SPEED_PINS,
+                                       speed_button=SPEED_BUTTON_GPIO,
+                                       timer_button=TIMER_BUTTON_GPIO))
+    return fan_registry
+
+
+# Every fan driven by this process, built from the fan config file on first
+# use rather than at import. fan_control.registry and fan_control.default_fan
+# (which backs the single-fan API) are module attributes that load it.
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    """The process-wide FanRegistry, loaded from the fan config file on first call."""
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = load_fan_config()
+    return _registry
+
+
+def __getattr__(name):
+    if name == 'registry':
+        return get_registry()
+    if name == 'default_fan':
+        return get_registry().default
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def speed_button_callback(pin, presses=1):
+    """Handle speed button press - cycles through off, low, med, high"""
+    button_log.debug("speed_button_callback() called on pin %s (x%d)", pin, presses)
+    fans = get_registry()
+    fan, kind = fans.button_pins().get(pin, (fans.default, 'speed'))
+    fan.on_speed_button(presses)
+
+
+def timer_button_callback(pin, presses=1):
+    """Handle timer button press - cycles through off, 1hr, 2hr, 4hr"""
+    button_log.debug("timer_button_callback() called on pin %s (x%d)", pin, presses)
+    fans = get_registry()
+    fan, kind = fans.button_pins().get(pin, (fans.default, 'timer'))
+    fan.on_timer_button(presses)
+
+
+def handle_button_event(event):
+    """Run the button handler for a queued ButtonEvent (on a consumer thread)."""
+    if event.kind == 'speed':
+        speed_button_callback(event.pin, event.presses)
     else:
-        last_speed_state = GPIO.HIGH
-        last_timer_state = GPIO.HIGH
+        timer_button_callback(event.pin, event.presses)
+
+
+# Edge callbacks and the poll loop push presses here; a fixed pool of
+# consumer threads runs the handlers
+button_events = InputEventQueue(handle_button_event)
+
+
+def start_button_polling():
+    """Start the button input loop thread (edge verification or polling)"""
+    global button_thread, button_thread_running
+
+    if button_thread_running:
+        return
 
     button_thread_running = True
 
-    import threading
-    button_thread = threading.Thread(target=poll_buttons, daemon=True)
+    button_thread = threading.Thread(target=poll_buttons, name='button-input', daemon=True)
     button_thread.start()
 
-    print("✓ Button polling started (fallback method)")
-    print(f"Speed button on pin {SPEED_BUTTON_GPIO} (polling)")
-    print(f"Timer button on pin {TIMER_BUTTON_GPIO} (polling)")
+    mode = button_input.mode if button_input else 'poll'
+    button_log.info("✓ Button input loop started (%s mode)", mode)
+    for pin, (fan, kind) in get_registry().button_pins().items():
+        button_log.info("%s button for fan '%s' on pin %s (%s)", kind.capitalize(), fan.fan_id, pin, mode)
 
 
-def poll_buttons():
-    """Poll buttons for state changes"""
-    global last_speed_state, last_timer_state, last_speed_press, last_timer_press
+# Seconds between button samples when polling
+POLL_INTERVAL = 0.1
+
+# Seconds between verification samples while edge detection is active
+VERIFY_INTERVAL = 1.0
+
+# An edge this long before a verification sample still accounts for the
+# level change it sees (covers the 200ms hardware bouncetime)
+EDGE_GRACE = 0.3
+
+# Seconds spent polling before edge detection is tried again
+EDGE_RETRY_INTERVAL = 300
+
+
+class ButtonPoller:
+    """Detects debounced button presses from periodic level samples.
+
+    Used by ButtonInput both for polling and for verifying edge detection.
+    """
+
+    def __init__(self, button_pins=None):
+        self.button_pins = button_pins if button_pins is not None else get_registry().button_pins()
+        self.poll_count = 0
+
+        # Initialize button states
+        if not MOCK_MODE:
+            self.last_states = {pin: GPIO.input(pin) for pin in self.button_pins}
+        else:
+            self.last_states = {pin: GPIO.HIGH for pin in self.button_pins}
+        self.last_presses = {pin: 0 for pin in self.button_pins}
+
+    def sample(self, current_time):
+        """Read every button once. Returns [(pin, kind)] for new presses."""
+        presses = []
+        self.poll_count += 1
+
+        for pin, (fan, kind) in self.button_pins.items():
+            state = GPIO.input(pin)
+            if self.last_states[pin] == GPIO.HIGH and state == GPIO.LOW:
+                if current_time - self.last_presses[pin] > DEBOUNCE_TIME:
+                    button_log.debug("%s button press detected on pin %s! %s -> %s",
+                                     kind.capitalize(), pin, self.last_states[pin], state)
+                    self.last_presses[pin] = current_time
+                    presses.append((pin, kind))
+                else:
+                    fan.button_metrics[kind][1].inc()
+
+            self.last_states[pin] = state
+
+        # Debug output every 50 polls (5 seconds at 100ms intervals)
+        if self.poll_count % 50 == 0 and button_log.isEnabledFor(logging.DEBUG):
+            levels = ", ".join(f"{pin}={'HIGH' if level else 'LOW'}" for pin, level in self.last_states.items())
+            button_log.debug("Poll #%d: %s", self.poll_count, levels)
+
+        return presses
+
+    def dispatch(self, pin, kind, source='poll', started=None):
+        """Queue a press for the button event consumers.
+
+        When tracing, the press starts a new trace with a button.<source>
+        span from started (default: now).
+        """
+        fan = self.button_pins[pin][0]
+        fan.button_metrics[kind][0].inc()
+        trace = None
+        if tracing.enabled:
+            trace = tracing.new_trace()
+            now = tracing.clock()
+            tracing.record(f'button.{source}', now if started is None else started, now,
+                           trace=trace, pin=pin, button=kind)
+        button_events.push(pin, kind, clock.monotonic(), trace)
+
+
+class ButtonInput:
+    """Hybrid edge/poll button input with a lost-interrupt watchdog.
+
+    In 'edge' mode presses arrive as GPIO interrupts, and step() takes a
+    cheap verification sample every VERIFY_INTERVAL. A falling level with no
+    matching edge means interrupts are being lost: the press is dispatched
+    from the sample and the input switches to 'poll' mode, sampling every
+    POLL_INTERVAL. Edge detection is tried again every EDGE_RETRY_INTERVAL.
+
+    step() is driven by the input loop thread (poll_buttons) or, in asyncio
+    mode, by a task on the event loop.
+    """
+
+    def __init__(self, button_pins=None):
+        self.poller = ButtonPoller(button_pins)
+        self.button_pins = self.poller.button_pins
+        self.mode = None  # 'edge' or 'poll' once set up
+        self.retry_at = 0.0
+        self.last_sample = clock.monotonic()
+        self.last_edges = {pin: float('-inf') for pin in self.button_pins}
+
+        # Counters for diagnostics
+        self.stats = {
+            'edge_presses': 0,
+            'polled_presses': 0,
+            'missed_edges': 0,
+            'switches_to_poll': 0,
+            'switches_to_edge': 0,
+        }
+
+    def enable_edges(self):
+        """Switch to edge detection. Returns False (staying in poll mode) if unavailable."""
+        added = []
+        try:
+            for pin in self.button_pins:
+                try:
+                    GPIO.remove_event_detect(pin)
+                except Exception:
+                    pass  # Ignore if no event detection was set
+                GPIO.add_event_detect(pin, GPIO.FALLING, callback=self._on_edge, bouncetime=200)
+                added.append(pin)
+        except RuntimeError as e:
+            button_log.warning("✗ Failed to add button event detection: %s", e)
+            self._remove_edges(added)
+            return False
+
+        # Verification starts from the current levels
+        now = clock.monotonic()
+        for pin in self.button_pins:
+            self.poller.last_states[pin] = GPIO.input(pin)
+        self.last_sample = now
+        if self.mode == 'poll':
+            self.stats['switches_to_edge'] += 1
+        self.mode = 'edge'
+        return True
+
+    def use_polling(self, now):
+        """Switch to polling until the next edge detection retry."""
+        self._remove_edges(self.button_pins)
+        if self.mode == 'edge':
+            self.stats['switches_to_poll'] += 1
+        self.mode = 'poll'
+        self.retry_at = now + EDGE_RETRY_INTERVAL
+
+    def step(self, now):
+        """Take one sample. Returns the seconds until the next one."""
+        presses = self.poller.sample(now)
+
+        if self.mode == 'edge':
+            missed = False
+            for pin, kind in presses:
+                if self.last_edges[pin] >= self.last_sample - EDGE_GRACE:
+                    continue  # the interrupt saw this press
+                button_log.warning("⚠ GPIO %s fell with no edge event - interrupts lost, switching to polling", pin,
+                                   extra={'pin': pin, 'event': 'missed_edge'})
+                self.stats['missed_edges'] += 1
+                self.poller.dispatch(pin, kind)
+                missed = True
+            self.last_sample = now
+            if not missed:
+                return VERIFY_INTERVAL
+            self.use_polling(now)
+            return POLL_INTERVAL
+
+        for pin, kind in presses:
+            self.stats['polled_presses'] += 1
+            self.poller.dispatch(pin, kind)
+        self.last_sample = now
+
+        if now >= self.retry_at:
+            if self.enable_edges():
+                button_log.info("✓ Button edge detection restored")
+                return VERIFY_INTERVAL
+            self.retry_at = now + EDGE_RETRY_INTERVAL
+        return POLL_INTERVAL
+
+    def _on_edge(self, pin):
+        # Runs on the GPIO library's callback thread: record and queue only
+        traced = tracing.clock() if tracing.enabled else None
+        now = clock.monotonic()
+        fan, kind = self.button_pins[pin]
+        if now - self.last_edges[pin] <= DEBOUNCE_TIME:
+            # Release bounce that outlasted the hardware bouncetime
+            fan.button_metrics[kind][1].inc()
+            if traced is not None:
+                tracing.record('button.debounced', traced, trace=tracing.new_trace(), pin=pin, button=kind)
+            return
+        self.last_edges[pin] = now
+        self.stats['edge_presses'] += 1
+        self.poller.dispatch(pin, kind, 'edge', traced)
+
+    @staticmethod
+    def _remove_edges(pins):
+        for pin in pins:
+            try:
+                GPIO.remove_event_detect(pin)
+            except Exception:
+                pass
 
-    poll_count = 0
-    debug_counter = 0
 
-    print(f"[DEBUG] Polling thread started. MOCK_MODE={MOCK_MODE}")
+# Series for the metrics filled in at scrape time
+_input_mode_metrics = {mode: metrics.button_input_mode.add(mode, mode=mode) for mode in ('edge', 'poll')}
+
+
+@metrics.add_collector
+def collect_metrics():
+    """Bring the scrape-time metrics up to date (called by metrics.render())."""
+    for fan in get_registry():
+        fan.account_speed_time()
+        current = fan.current
+        fan.timer_metrics['timer'].set(1 if current.timer_active else 0)
+        fan.timer_metrics['safety'].set(1 if current.safety_active else 0)
+    mode = button_input.mode if button_input is not None else None
+    for name, series in _input_mode_metrics.items():
+        series.set(1 if name == mode else 0)
+    metrics.button_events_dropped[None].set(button_events.stats['dropped'])
+    metrics.scheduler_pending[None].set(get_registry().scheduler.pending())
+
+
+def poll_buttons():
+    """Run the button input loop: verification samples, or polling after a fallback"""
+    button_log.debug("Button input thread started. MOCK_MODE=%s", MOCK_MODE)
 
     while button_thread_running:
         try:
-            if not MOCK_MODE:
-                current_time = time.time()
-                poll_count += 1
-
-                # Debug output every 50 polls (5 seconds at 100ms intervals)
-                debug_counter += 1
-                if debug_counter >= 50:
-                    debug_counter = 0
-                    speed_state = GPIO.input(SPEED_BUTTON_GPIO)
-                    timer_state = GPIO.input(TIMER_BUTTON_GPIO)
-                    speed_text = "HIGH" if speed_state else "LOW"
-                    timer_text = "HIGH" if timer_state else "LOW"
-                    print(f"[DEBUG] Poll #{poll_count}: Speed={speed_text}, Timer={timer_text}")
-
-                # Check speed button
-                speed_state = GPIO.input(SPEED_BUTTON_GPIO)
-                if (last_speed_state == GPIO.HIGH and
-                    speed_state == GPIO.LOW and
-                    current_time - last_speed_press > DEBOUNCE_TIME):
-
-                    print(f"[DEBUG] Speed button press detected! {last_speed_state} -> {speed_state}")
-                    last_speed_press = current_time
-                    # Call the callback in a separate thread to avoid blocking
-                    import threading
-                    threading.Thread(target=speed_button_callback, args=(SPEED_BUTTON_GPIO,), daemon=True).start()
-
-                last_speed_state = speed_state
-
-                # Check timer button
-                timer_state = GPIO.input(TIMER_BUTTON_GPIO)
-                if (last_timer_state == GPIO.HIGH and
-                    timer_state == GPIO.LOW and
-                    current_time - last_timer_press > DEBOUNCE_TIME):
-
-                    print(f"[DEBUG] Timer button press detected! {last_timer_state} -> {timer_state}")
-                    last_timer_press = current_time
-                    # Call the callback in a separate thread to avoid blocking
-                    import threading
-                    threading.Thread(target=timer_button_callback, args=(TIMER_BUTTON_GPIO,), daemon=True).start()
-
-                last_timer_state = timer_state
+            if button_input is not None:
+                # Button handlers hand off to the hardware owner and return at once
+                delay = button_input.step(clock.monotonic())
             else:
-                print(f"[DEBUG] In mock mode - polling disabled")
-                time.sleep(5)  # Sleep longer in mock mode
+                button_log.debug("No button input set up - polling disabled")
+                delay = 5  # Sleep longer without buttons
 
-            time.sleep(0.1)  # Poll every 100ms
+            time.sleep(delay)
 
         except Exception as e:
-            print(f"Error in button polling: {e}")
+            button_log.error("Error in button polling: %s", e)
             time.sleep(1)  # Wait longer on error
 
 
 def stop_button_polling():
-    """Stop button polling thread"""
+    """Stop the button input loop thread"""
     global button_thread_running
 
     button_thread_running = False
     if button_thread:
-        button_thread.join(timeout=1)
+        button_thread.join(timeout=VERIFY_INTERVAL + 0.5)
 
-    print("Button polling stopped")
+    button_log.info("Button polling stopped")
 
 
-def setup_buttons():
-    """Setup GPIO pins for button inputs - preserving existing relay setup"""
-    global button_thread, button_thread_running
+def setup_buttons(start_polling=None):
+    """Setup GPIO pins for button inputs - preserving existing relay setup
+
+    Edge detection is used when available, falling back to polling. Either
+    way start_polling is called to run the input loop (edge verification or
+    polling); it defaults to start_button_polling (a thread).
+    """
+    global button_input
+
+    start_polling = start_polling or start_button_polling
 
     if MOCK_MODE:
-        print("Mock mode - button setup skipped")
+        button_log.info("Mock mode - button setup skipped")
         return
 
-    try:
-        # Clean up only button-related event detection (don't wipe out relay setup)
-        try:
-            GPIO.remove_event_detect(SPEED_BUTTON_GPIO)
-            print(f"Removed existing event detection on GPIO {SPEED_BUTTON_GPIO}")
-        except:
-            pass  # Ignore if no event detection was set
-
-        try:
-            GPIO.remove_event_detect(TIMER_BUTTON_GPIO)
-            print(f"Removed existing event detection on GPIO {TIMER_BUTTON_GPIO}")
-        except:
-            pass  # Ignore if no event detection was set
+    button_pins = get_registry().button_pins()
 
+    try:
         # Setup button pins as inputs with pull-up resistors
         # (GPIO mode should already be set from relay setup)
-        GPIO.setup(SPEED_BUTTON_GPIO, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-        GPIO.setup(TIMER_BUTTON_GPIO, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-        print(f"GPIO pins {SPEED_BUTTON_GPIO} and {TIMER_BUTTON_GPIO} configured as inputs")
-
-        # Add event detection for speed button (individual error handling like button_test.py)
-        try:
-            GPIO.add_event_detect(SPEED_BUTTON_GPIO, GPIO.FALLING,
-                                callback=speed_button_callback, bouncetime=200)
-            print(f"✓ Speed button event detection added (GPIO {SPEED_BUTTON_GPIO})")
-        except RuntimeError as e:
-            print(f"✗ Failed to add speed button event detection: {e}")
-            # Don't return here, try polling fallback
-            start_button_polling()
-            return
-
-        # Add event detection for timer button
-        try:
-            GPIO.add_event_detect(TIMER_BUTTON_GPIO, GPIO.FALLING,
-                                callback=timer_button_callback, bouncetime=200)
-            print(f"✓ Timer button event detection added (GPIO {TIMER_BUTTON_GPIO})")
-        except RuntimeError as e:
-            print(f"✗ Failed to add timer button event detection: {e}")
-            # Clean up the speed button event detection and fall back to polling
-            try:
-                GPIO.remove_event_detect(SPEED_BUTTON_GPIO)
-            except:
-                pass
-            start_button_polling()
-            return
-
-        print("Button GPIO pins configured successfully (edge detection)")
+        for pin in button_pins:
+            GPIO.setup(pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+        button_log.info("GPIO pins %s configured as inputs", ', '.join(str(pin) for pin in button_pins))
+
+        button_input = ButtonInput(button_pins)
+        if button_input.enable_edges():
+            for pin, (fan, kind) in button_pins.items():
+                button_log.info("✓ %s button event detection added for fan '%s' (GPIO %s)", kind.capitalize(), fan.fan_id, pin)
+            button_log.info("Button GPIO pins configured successfully (edge detection, verified every %ss)", VERIFY_INTERVAL)
+        else:
+            button_log.warning("Falling back to polling method...")
+            button_input.use_polling(clock.monotonic())
 
     except Exception as e:
-        print(f"Error setting up buttons: {e}")
-        print("Falling back to polling method...")
-        start_button_polling()
-
-
-# === ACTIVE LEVEL SETTING ===
-# Most Pi relay boards are active-LOW: pin LOW = relay ON.
-# If your relays behave inverted, change these two lines so:
-ACTIVE_LEVEL = GPIO.HIGH
-INACTIVE_LEVEL = GPIO.LOW
-# ACTIVE_LEVEL   = GPIO.LOW
-# INACTIVE_LEVEL = GPIO.HIGH
+        button_log.error("Error setting up buttons: %s", e)
+        if button_input is None:
+            return
+        button_log.warning("Falling back to polling method...")
+        button_input.use_polling(clock.monotonic())
 
-SPEED_PINS = {
-    "low":  RELAY_LOW_GPIO,
-    "med":  RELAY_MED_GPIO,
-    "high": RELAY_HIGH_GPIO,
-}
+    start_polling()
 
 
 def test_buttons():
     """Test button functionality in mock mode"""
-    import time
     if not MOCK_MODE:
         print("Button testing only available in mock mode")
         return
 
     print("\n=== Testing Button Functionality ===")
     print("Current states:")
-    print(f"Speed: {speed_states[current_speed_index]}")
-    print(f"Timer: {timer_states[current_timer_index]}")
+    fan = get_registry().default
+    print(f"Speed: {speed_states[fan.speed_index]}")
+    print(f"Timer: {timer_states[fan.timer_index]}")
 
     print("\nSimulating speed button presses...")
     for i in range(5):
@@ -383,49 +1445,113 @@ def test_buttons():
         time.sleep(0.6)  # Wait longer than debounce time
 
 
-# Setup pins as outputs and default them all OFF
-for pin in SPEED_PINS.values():
-    GPIO.setup(pin, GPIO.OUT)
-    GPIO.output(pin, INACTIVE_LEVEL)
+def init_gpio():
+    """Configure the GPIO library (pin numbering, warnings). Idempotent."""
+    global gpio_ready
+
+    if gpio_ready:
+        return
+    if MOCK_MODE:
+        gpio_log.info("RPi.GPIO not available - using mock GPIO for development/testing")
+    else:
+        gpio_log.info("Running on Raspberry Pi with real GPIO")
+    GPIO.setmode(GPIO.BCM)
+    GPIO.setwarnings(False)
+    gpio_ready = True
+
+
+def init(relays=True, buttons=True, start_polling=None):
+    """Explicitly initialize the hardware for a long-running process.
+
+    relays: set up every fan's relay pins as outputs, keeping their levels.
+    buttons: set up the button inputs (start_polling is passed on to
+    setup_buttons).
+    Logging goes through the background writer from here on (event_log.py).
+    """
+    setup_logging()
+    init_gpio()
+
+    if relays:
+        # Setup pins as outputs. They keep their levels: the caller restores
+        # the journaled speeds (or turns the fans off) right after
+        get_registry().setup_relays(preserve=True)
+
+    if buttons:
+        # Setup button pins for physical control
+        setup_buttons(start_polling)
+
 
-# Setup button pins for physical control
-setup_buttons()
+def restore_relays(records):
+    """Early boot: drive every fan's relays to its journaled speed, nothing more.
+
+    records is {fan_id: record} from state_journal.load(). Fans without a
+    record, or whose timer ran out meanwhile, are turned off. Timers are
+    restored later, by the server (see state_journal.StateJournal.restore).
+    Returns {fan_id: speed}.
+    """
+    init_gpio()
+    now = clock.now().timestamp()
+    targets = {}
+    for fan in get_registry():
+        record = records.get(fan.fan_id)
+        speed = 'off'
+        if record is not None and not state_journal.is_expired(record, now):
+            speed = validate_speed(record.get('speed')) or 'off'
+        fan.setup_relays(preserve=True)
+        targets[fan] = speed
+    hardware_owner.call(write_speeds, targets)
+    return {fan.fan_id: speed for fan, speed in targets.items()}
 
 
 def all_off():
-    """Turn all speed relays off."""
-    for pin in SPEED_PINS.values():
-        GPIO.output(pin, INACTIVE_LEVEL)
-    if MOCK_MODE:
-        print("[MOCK] All fan relays turned OFF")
+    """Turn all speed relays of the default fan off."""
+    get_registry().default.write_speed('off')
 
 
 def set_speed(speed_name: str):
     """
     speed_name: 'off', 'low', 'med', 'high'
-    Ensures only one relay is active at a time.
+    Drives the default fan's relays. Ensures only one relay is active at a time.
     """
-    # Always start by turning everything off
-    all_off()
-
-    # Then enable the specific speed, if requested
-    if speed_name in SPEED_PINS:
-        GPIO.output(SPEED_PINS[speed_name], ACTIVE_LEVEL)
-        if MOCK_MODE:
-            print(f"[MOCK] Fan speed set to: {speed_name.upper()} (GPIO pin {SPEED_PINS[speed_name]})")
+    get_registry().default.write_speed(speed_name)
 
 
 if __name__ == "__main__":
     if len(sys.argv) != 2:
-        print("Usage: sudo ./fan_control.py [off|low|med|high|test]")
+        print("Usage: sudo ./fan_control.py [off|low|med|high|status|test|restore]")
         sys.exit(1)
 
     cmd = sys.argv[1].lower()
+    if cmd not in ("off", "low", "med", "high", "hi", "test", "restore"):
+        print("Unknown command:", cmd)
+        sys.exit(1)
+
+    # No daemon answered (see control_daemon.client_main): drive the relays
+    # directly, but only as their one owner
+    try:
+        acquire_gpio_lock()
+    except RuntimeError as e:
+        print(f"✗ {e}")
+        sys.exit(1)
 
     if cmd == "test":
+        init()
         test_buttons()
         sys.exit(0)
-    elif cmd == "off":
+
+    if cmd == "restore":
+        # Early boot (e.g. a systemd oneshot before the server): bring back
+        # the journaled speeds; the server restores the timers when it starts
+        restored = restore_relays(state_journal.load())
+        print("Restored: " + ", ".join(f"{fan_id}={speed}" for fan_id, speed in restored.items()))
+        sys.exit(0)
+
+    # A single command only needs the default fan's relay pins. They keep
+    # their current levels so the relay driver only writes what changes.
+    init_gpio()
+    get_registry().default.setup_relays(preserve=True)
+
+    if cmd == "off":
         set_speed("off")
     elif cmd == "low":
         set_speed("low")
@@ -433,9 +1559,6 @@ if __name__ == "__main__":
         set_speed("med")
     elif cmd in ("high", "hi"):
         set_speed("high")
-    else:
-        print("Unknown command:", cmd)
-        sys.exit(1)
 
     # NOTE: No GPIO.cleanup() here on purpose.
     # We want the relays to stay in their last state after exit.
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+Hardware owner thread
+
+All actuation (relay writes and the fan state that goes with them) runs on a
+single thread that reads a command queue, so request threads, GPIO callback
+threads and timer threads can never interleave their writes.
+
+- Commands submitted with the same coalescing key collapse: a newer command
+  replaces a pending older one and both callers get the newer result. A key
+  must only be shared by calls of the same method, whose results have the
+  same shape (e.g. set_timer never takes over a cancel_timer caller).
+- Every command has a deadline. A command still queued when its deadline
+  passes fails with HardwareTimeout, and callers stop waiting at the
+  deadline, so a stuck GPIO call cannot hang an HTTP request. Commands
+  submitted with expires=False (timer expiries) never expire in the queue:
+  their caller still stops waiting, but they run once the owner is free.
+- Callers get a concurrent.futures.Future for the result.
+"""
+
+import collections
+import functools
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+import tracing
+
+# How long a command may wait and run before its caller gives up (seconds)
+COMMAND_TIMEOUT = 5.0
+
+
+class HardwareTimeout(TimeoutError):
+    """A hardware command did not complete before its deadline."""
+
+
+class _Command:
+    __slots__ = ('func', 'key', 'deadline', 'futures', 'superseded', 'trace')
+
+    def __init__(self, func, key, deadline, future):
+        self.func = func
+        self.key = key
+        self.deadline = deadline
+        self.futures = [future]
+        self.superseded = False
+        self.trace = None  # (trace id, submit time) when tracing
+
+
+class HardwareOwner:
+    """Runs hardware commands one at a time on a dedicated thread."""
+
+    def __init__(self, name='hardware-owner', timeout=COMMAND_TIMEOUT):
+        self.name = name
+        self.timeout = timeout
+        self._queue = collections.deque()
+        self._pending = {}  # coalescing key -> queued command
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+
+        # Counters for diagnostics
+        self.stats = {
+            'executed': 0,
+            'coalesced': 0,
+            'expired': 0,
+            'failed': 0,
+        }
+
+    def on_owner_thread(self):
+        return self._thread is not None and threading.current_thread() is self._thread
+
+    def submit(self, func, *args, key=None, timeout=None, expires=True, **kwargs):
+        """Queue func(*args, **kwargs) and return a Future for its result.
+
+        A pending command with the same key is replaced by this one. Called
+        from the owner thread itself, the command runs immediately. With
+        expires=False it runs however long it waits in the queue.
+        """
+        future = Future()
+        call = functools.partial(func, *args, **kwargs)
+
+        if self.on_owner_thread():
+            future.set_running_or_notify_cancel()
+            try:
+                future.set_result(call())
+            except BaseException as e:
+                future.set_exception(e)
+            return future
+
+        deadline = None
+        if expires:
+            deadline = time.monotonic() + (self.timeout if timeout is None else timeout)
+        command = _Command(call, key, deadline, future)
+        if tracing.enabled and tracing.current() is not None:
+            command.trace = (tracing.current(), tracing.clock())
+
+        with self._cond:
+            if key is not None:
+                previous = self._pending.get(key)
+                if previous is not None:
+                    # Collapse: the newer command takes over the older callers
+                    previous.superseded = True
+                    command.futures = previous.futures + command.futures
+                    self.stats['coalesced'] += 1
+                self._pending[key] = command
+            self._queue.append(command)
+            self._ensure_thread()
+            self._cond.notify()
+
+        return future
+
+    def call(self, func, *args, key=None, timeout=None, expires=True, **kwargs):
+        """Run func on the owner thread and wait for its result.
+
+        Raises HardwareTimeout if it does not finish before the deadline
+        (with expires=False the command itself still runs later).
+        """
+        timeout = self.timeout if timeout is None else timeout
+        future = self.submit(func, *args, key=key, timeout=timeout, expires=expires, **kwargs)
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            raise HardwareTimeout(f"Hardware command {getattr(func, '__name__', func)} timed out after {timeout}s")
+
+    def stop(self):
+        """Stop the owner thread after the queued commands have run."""
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread and not self.on_owner_thread():
+            self._thread.join(timeout=1)
+        self._thread = None
+
+    def _ensure_thread(self):
+        # Called with self._cond held; the thread starts on first use
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running and not self._queue:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                command = self._queue.popleft()
+                if command.superseded:
+                    continue
+                if command.key is not None and self._pending.get(command.key) is command:
+                    del self._pending[command.key]
+
+            futures = [f for f in command.futures if f.set_running_or_notify_cancel()]
+
+            if command.deadline is not None and time.monotonic() > command.deadline:
+                self.stats['expired'] += 1
+                error = HardwareTimeout("Hardware command expired before it could run")
+                for future in futures:
+                    future.set_exception(error)
+                continue
+
+            if command.trace is not None:
+                trace, submitted = command.trace
+                started = tracing.clock()
+                tracing.record('hardware.queued', submitted, started, trace=trace)
+                token = tracing.set_current(trace)
+
+            try:
+                result = command.func()
+            except BaseException as e:
+                self.stats['failed'] += 1
+                for future in futures:
+                    future.set_exception(e)
+            else:
+                self.stats['executed'] += 1
+                for future in futures:
+                    future.set_result(result)
+            finally:
+                if command.trace is not None:
+                    tracing.record('hardware.run', started, trace=trace,
+                                   command=getattr(command.func.func, '__qualname__', None))
+                    tracing.reset_current(token)
+
+
+def owned(coalesce=None, wait=True, expires=True):
+    """Decorator: run a FanController method on the hardware owner thread.
+
+    coalesce names a coalescing group; calls of the same method in the same
+    group for the same fan collapse to the newest (the key is (coalesce,
+    method name, fan id)). Different methods never collapse into each other,
+    so each caller gets a result of the method it called. With wait=False
+    the caller gets the Future back instead of waiting for the result.
+    expires=False is for commands that must not be dropped however long the
+    owner is busy (timer expiries).
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            key = (coalesce, method.__name__, self.fan_id) if coalesce else None
+            if wait:
+                return hardware_owner.call(method, self, *args, key=key, expires=expires, **kwargs)
+            return hardware_owner.submit(method, self, *args, key=key, expires=expires, **kwargs)
+        return wrapper
+    return decorator
+
+
+# The single owner of the GPIO hardware in this process
+hardware_owner = HardwareOwner()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Bounded button event queue
+
+GPIO edge callbacks and the button poll loop only push a small timestamped
+event here and return, so the GPIO library's callback thread is never held
+up by handlers or printing. A fixed pool of consumer threads runs the
+handlers.
+
+- The queue is bounded; an event that does not fit is dropped and counted.
+- Presses of a button that is already queued collapse into the queued event,
+  which carries a press count: five quick presses of the speed button become
+  one "advance by five" and a single relay transition.
+"""
+
+import collections
+import threading
+import time
+
+import tracing
+from event_log import get_logger
+
+log = get_logger('buttons')
+
+# Most distinct events waiting at once
+EVENT_QUEUE_SIZE = 32
+
+# Consumer threads running the handlers
+EVENT_CONSUMERS = 2
+
+
+class ButtonEvent:
+    """One or more presses of a button, waiting to be handled."""
+
+    __slots__ = ('pin', 'kind', 'timestamp', 'presses', 'trace', 'queued_at')
+
+    def __init__(self, pin, kind, timestamp, trace=None):
+        self.pin = pin
+        self.kind = kind
+        self.timestamp = timestamp  # time.monotonic() of the first press
+        self.presses = 1
+        self.trace = trace  # trace id of the first press, when tracing
+        self.queued_at = tracing.clock() if trace is not None else None
+
+    def __repr__(self):
+        return f"ButtonEvent(pin={self.pin}, kind={self.kind!r}, presses={self.presses})"
+
+
+class InputEventQueue:
+    """Bounded, collapsing queue of button events with a fixed consumer pool."""
+
+    def __init__(self, handler, maxsize=EVENT_QUEUE_SIZE, consumers=EVENT_CONSUMERS,
+                 name='button-events', clock=time.monotonic):
+        self.handler = handler
+        self.maxsize = maxsize
+        self.consumers = consumers
+        self.name = name
+        self.clock = clock
+        self._queue = collections.deque()
+        self._queued = {}  # pin -> event still waiting in the queue
+        self._cond = threading.Condition()
+        self._threads = []
+        self._running = False
+
+        # Counters for diagnostics
+        self.stats = {
+            'pushed': 0,     # presses offered to the queue
+            'collapsed': 0,  # presses merged into a queued event
+            'dropped': 0,    # presses lost because the queue was full
+            'handled': 0,    # events run by a consumer
+            'failed': 0,     # events whose handler raised
+            'max_wait': 0.0, # longest time an event waited for a consumer
+        }
+
+    def push(self, pin, kind, timestamp=None, trace=None):
+        """Queue a press without blocking. Returns False if it was dropped.
+
+        trace is the press's trace id when tracing (see tracing.py).
+        """
+        timestamp = self.clock() if timestamp is None else timestamp
+        with self._cond:
+            self.stats['pushed'] += 1
+            event = self._queued.get(pin)
+            if event is not None and event.kind == kind:
+                event.presses += 1
+                self.stats['collapsed'] += 1
+                if trace is not None:
+                    tracing.record('button.collapsed', tracing.clock(), trace=trace, into_trace=event.trace)
+                return True
+            if len(self._queue) >= self.maxsize:
+                self.stats['dropped'] += 1
+                if trace is not None:
+                    tracing.record('button.dropped', tracing.clock(), trace=trace)
+                return False
+            event = ButtonEvent(pin, kind, timestamp, trace)
+            self._queue.append(event)
+            self._queued[pin] = event
+            self._ensure_threads()
+            self._cond.notify()
+        return True
+
+    def pending(self):
+        """Number of events waiting for a consumer."""
+        return len(self._queue)
+
+    def drain(self):
+        """Handle every queued event on the calling thread.
+
+        With consumers=0 (as in the simulator) this is the only way events
+        get handled. Returns the number of events handled.
+        """
+        handled = 0
+        while True:
+            with self._cond:
+                if not self._queue:
+                    return handled
+                event = self._pop()
+            self._handle(event)
+            handled += 1
+
+    def stop(self):
+        """Stop the consumers after the queued events have been handled."""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        current = threading.current_thread()
+        for thread in self._threads:
+            if thread is not current:
+                thread.join(timeout=1)
+        self._threads = []
+
+    def _ensure_threads(self):
+        # Called with self._cond held; the consumers start on first use
+        if self._running or not self.consumers:
+            return
+        self._running = True
+        self._threads = [threading.Thread(target=self._run, name=f'{self.name}-{i}', daemon=True)
+                         for i in range(self.consumers)]
+        for thread in self._threads:
+            thread.start()
+
+    def _pop(self):
+        # Called with self._cond held
+        event = self._queue.popleft()
+        if self._queued.get(event.pin) is event:
+            del self._queued[event.pin]
+        return event
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running and not self._queue:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                event = self._pop()
+            self._handle(event)
+
+    def _handle(self, event):
+        wait = self.clock() - event.timestamp
+        if wait > self.stats['max_wait']:
+            self.stats['max_wait'] = wait
+
+        if event.trace is not None:
+            started = tracing.clock()
+            tracing.record('button.queued', event.queued_at, started, trace=event.trace,
+                           pin=event.pin, presses=event.presses)
+            token = tracing.set_current(event.trace)
+
+        try:
+            self.handler(event)
+        except Exception as e:
+            self.stats['failed'] += 1
+            log.exception("Error handling %r", event)
+        else:
+            self.stats['handled'] += 1
+        finally:
+            if event.trace is not None:
+                tracing.record('button.handle', started, trace=event.trace)
+                tracing.reset_current(token)
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Prometheus metrics
+
+Counters, gauges and histograms served at /metrics in the Prometheus text
+exposition format. Every labelled series is created up front (one per route,
+per fan and speed, per button pin) and looked up by a plain key, so
+recording a sample is a dict lookup and a few additions under the series'
+own lock: no label tuples, dicts or strings are built per event, which keeps
+updates cheap enough for every relay write and button edge.
+
+Values that are cheaper to read than to track (input mode, active timers,
+queue drops) are filled in by collectors registered with add_collector(),
+which run only when /metrics is scraped.
+
+Example:
+
+    series = relay_transitions.add(('default', 'high'), fan='default', speed='high')   # at setup
+    series.inc()                                                                       # per event
+"""
+
+import bisect
+import threading
+
+# Request latency buckets (seconds)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Relay transition buckets (seconds); a break-before-make transition includes the 50 ms dead time
+RELAY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.06, 0.075, 0.1, 0.25, 0.5, 1.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_metrics = []
+_collectors = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _label_text(labels, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in labels.items()]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _CounterSeries:
+    __slots__ = ('labels', 'value', '_lock')
+
+    def __init__(self, labels):
+        self.labels = labels
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def set(self, value):
+        # For counts kept elsewhere (e.g. queue stats) and copied in by a collector
+        self.value = value
+
+
+class _GaugeSeries:
+    __slots__ = ('labels', 'value')
+
+    def __init__(self, labels):
+        self.labels = labels
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+
+class _HistogramSeries:
+    __slots__ = ('labels', 'buckets', 'counts', 'sum', 'count', '_lock')
+
+    def __init__(self, labels, buckets):
+        self.labels = labels
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self._series = {}
+        _metrics.append(self)
+        if not labelnames:
+            self.add(None)  # an unlabelled metric has one series, metric[None]
+
+    def add(self, key, **labels):
+        """Create the series for key (once) and return it."""
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = self._new_series(labels)
+        return series
+
+    def __getitem__(self, key):
+        return self._series[key]
+
+    def get(self, key, default=None):
+        return self._series.get(key, default)
+
+    def render(self, lines):
+        lines.append(f'# HELP {self.name} {self.help}')
+        lines.append(f'# TYPE {self.name} {self.kind}')
+        for series in list(self._series.values()):
+            self._render_series(series, lines)
+
+
+class Counter(_Metric):
+    """A value that only goes up."""
+
+    kind = 'counter'
+
+    def _new_series(self, labels):
+        return _CounterSeries(labels)
+
+    def _render_series(self, series, lines):
+        lines.append(f'{self.name}{_label_text(series.labels)} {_number(series.value)}')
+
+
+class Gauge(_Metric):
+    """A value that is set, usually by a collector at scrape time."""
+
+    kind = 'gauge'
+
+    def _new_series(self, labels):
+        return _GaugeSeries(labels)
+
+    def _render_series(self, series, lines):
+        lines.append(f'{self.name}{_label_text(series.labels)} {_number(series.value)}')
+
+
+class Histogram(_Metric):
+    """Counts of observations in fixed buckets, plus their sum and count."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help_text, labelnames)
+
+    def _new_series(self, labels):
+        return _HistogramSeries(labels, self.buckets)
+
+    def _render_series(self, series, lines):
+        with series._lock:
+            counts, total, count = list(series.counts), series.sum, series.count
+        cumulative = 0
+        for bound, n in zip(self.buckets + (float('inf'),), counts):
+            cumulative += n
+            le = f'le="{_number(bound)}"'
+            lines.append(f'{self.name}_bucket{_label_text(series.labels, le)} {cumulative}')
+        lines.append(f'{self.name}_sum{_label_text(series.labels)} {_number(total)}')
+        lines.append(f'{self.name}_count{_label_text(series.labels)} {count}')
+
+
+def add_collector(func):
+    """Run func() before every scrape, to fill in gauges. Returns func."""
+    _collectors.append(func)
+    return func
+
+
+def render():
+    """All metrics in the Prometheus text format."""
+    for collect in _collectors:
+        collect()
+    lines = []
+    for metric in _metrics:
+        metric.render(lines)
+    return '\n'.join(lines) + '\n'
+
+
+# === Metrics ===
+# Series are added by the code that updates them: per route by web_app.py and
+# async_app.py, per fan, speed and button by fan_control.FanController.
+
+http_request_seconds = Histogram(
+    'fan_http_request_duration_seconds', "Time to handle an HTTP request, per route", ('route',))
+
+relay_transitions = Counter(
+    'fan_relay_transitions_total', "Relay writes that changed a fan's relays, per target speed",
+    ('fan', 'speed'))
+relay_transition_seconds = Histogram(
+    'fan_relay_transition_seconds', "Time to drive a fan's relays to a new speed, dead time included",
+    ('fan', 'speed'), RELAY_BUCKETS)
+speed_seconds = Counter(
+    'fan_speed_seconds_total', "Time spent at each speed", ('fan', 'speed'))
+
+button_presses = Counter(
+    'fan_button_presses_total', "Button presses accepted (edge or polled)", ('fan', 'button', 'pin'))
+button_debounce_rejections = Counter(
+    'fan_button_debounce_rejections_total', "Button edges ignored as contact bounce",
+    ('fan', 'button', 'pin'))
+button_events_dropped = Counter(
+    'fan_button_events_dropped_total', "Button presses lost because the event queue was full")
+button_input_mode = Gauge(
+    'fan_button_input_mode', "1 for the active button input mode (edge or poll)", ('mode',))
+
+timers_active = Gauge(
+    'fan_timers_active', "1 while a fan's timer is running", ('fan', 'timer'))
+scheduler_pending = Gauge(
+    'fan_scheduler_pending_calls', "Timer callbacks waiting on the scheduler")
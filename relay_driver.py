@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Shadow-register relay driver
+
+Keeps a copy of the level last written to every relay output so writes that
+would not change anything are skipped. A transition is applied as at most two
+batched multi-channel writes: first every relay that turns off, then, after
+an explicit break-before-make dead time, every relay that turns on. Two
+speeds of the same fan are therefore never energized together.
+"""
+
+import threading
+import time
+
+import tracing
+
+# Minimum time between releasing one relay and energizing another (seconds).
+# Covers the release time of typical relay modules with margin.
+RELAY_DEAD_TIME = 0.05
+
+
+class RelayDriver:
+    """Drives relay output pins through a shadow copy of their levels."""
+
+    def __init__(self, gpio, active_level, inactive_level, dead_time=RELAY_DEAD_TIME,
+                 clock=time.perf_counter, sleep=time.sleep):
+        self.gpio = gpio
+        self.active_level = active_level
+        self.inactive_level = inactive_level
+        self.dead_time = dead_time
+        self.clock = clock
+        self.sleep = sleep
+        self._shadow = {}
+        self._lock = threading.Lock()
+
+        # Counters for diagnostics
+        self.stats = {
+            'transitions': 0,      # apply() calls that wrote something
+            'skipped': 0,          # apply() calls that changed nothing
+            'pin_writes': 0,       # individual pin levels written
+            'last_dead_time': 0.0, # measured break-to-make gap of the last transition
+            'max_dead_time': 0.0,
+        }
+
+    def claim(self, pin, level=None):
+        """Configure pin as an output.
+
+        With a level, the pin is driven to it. Without one the current output
+        level is read back and kept, so claiming does not disturb a relay
+        that is already on.
+        """
+        with self._lock:
+            self.gpio.setup(pin, self.gpio.OUT)
+            if level is None:
+                level = self.gpio.input(pin)
+            else:
+                self.gpio.output(pin, level)
+                self.stats['pin_writes'] += 1
+            self._shadow[pin] = level
+
+    def level(self, pin):
+        """Return the shadowed level of pin (None if never claimed)."""
+        return self._shadow.get(pin)
+
+    def levels(self):
+        return dict(self._shadow)
+
+    def apply(self, levels):
+        """Bring the pins in levels ({pin: level}) to the requested levels.
+
+        Returns the number of pins written (0 if nothing changed).
+        """
+        with self._lock:
+            breaks = [pin for pin, level in levels.items()
+                      if level != self.active_level and self._shadow.get(pin) != level]
+            makes = [pin for pin, level in levels.items()
+                     if level == self.active_level and self._shadow.get(pin) != level]
+
+            if not breaks and not makes:
+                self.stats['skipped'] += 1
+                return 0
+
+            traced = tracing.clock() if tracing.enabled else None
+
+            if breaks:
+                self._write(breaks, self.inactive_level)
+                released_at = self.clock()
+                if traced is not None:
+                    traced = tracing.record('relay.break', traced, pins=breaks)
+
+            if makes:
+                if breaks:
+                    # Break-before-make: wait out the dead time, then measure it
+                    remaining = self.dead_time - (self.clock() - released_at)
+                    if remaining > 0:
+                        self.sleep(remaining)
+                    dead_time = self.clock() - released_at
+                    self.stats['last_dead_time'] = dead_time
+                    self.stats['max_dead_time'] = max(self.stats['max_dead_time'], dead_time)
+                    if traced is not None:
+                        traced = tracing.record('relay.dead_time', traced)
+                self._write(makes, self.active_level)
+                if traced is not None:
+                    tracing.record('relay.make', traced, pins=makes)
+
+            self.stats['transitions'] += 1
+            return len(breaks) + len(makes)
+
+    def _write(self, pins, level):
+        # One multi-channel call (RPi.GPIO accepts a list of channels)
+        if len(pins) == 1:
+            self.gpio.output(pins[0], level)
+        else:
+            self.gpio.output(pins, [level] * len(pins))
+        for pin in pins:
+            self._shadow[pin] = level
+        self.stats['pin_writes'] += len(pins)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Deadline Scheduler
+
+A single background thread that runs callbacks at absolute deadlines.
+Pending calls are kept in a heap ordered by deadline, and the thread sleeps
+until the earliest one is due (or until a new, earlier call is scheduled).
+Every call returns a handle that can be cancelled.
+"""
+
+import heapq
+import itertools
+import threading
+import time
+
+from event_log import get_logger
+
+log = get_logger('timers')
+
+
+class ScheduledCall:
+    """Handle for a callback scheduled on a DeadlineScheduler."""
+
+    __slots__ = ('deadline', 'callback', 'args', 'cancelled', '_scheduler')
+
+    def __init__(self, scheduler, deadline, callback, args):
+        self._scheduler = scheduler
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        """Cancel the call. Safe to call more than once or after it fired."""
+        if not self.cancelled:
+            self.cancelled = True
+            self._scheduler._discard(self)
+
+    def remaining(self):
+        """Seconds until the deadline (never negative)."""
+        return max(0.0, self.deadline - self._scheduler.clock())
+
+
+class DeadlineScheduler:
+    """Runs callbacks at monotonic-clock deadlines on one worker thread."""
+
+    def __init__(self, name='deadline-scheduler', clock=time.monotonic):
+        self.name = name
+        self.clock = clock
+        self._heap = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._running = False
+        self._pending = 0
+
+    def call_at(self, deadline, callback, *args):
+        """Schedule callback(*args) at an absolute clock() deadline."""
+        call = ScheduledCall(self, deadline, callback, args)
+        with self._cond:
+            heapq.heappush(self._heap, (deadline, next(self._counter), call))
+            self._pending += 1
+            self._ensure_thread()
+            # Wake the worker if this is the new earliest deadline
+            if self._heap[0][2] is call:
+                self._cond.notify()
+        return call
+
+    def call_later(self, delay, callback, *args):
+        """Schedule callback(*args) to run after delay seconds."""
+        return self.call_at(self.clock() + delay, callback, *args)
+
+    def pending(self):
+        """Number of scheduled calls that have not fired or been cancelled."""
+        return self._pending
+
+    def stop(self):
+        """Stop the worker thread. Pending calls are dropped."""
+        with self._cond:
+            self._running = False
+            self._heap.clear()
+            self._pending = 0
+            self._cond.notify()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=1)
+        self._thread = None
+
+    def _discard(self, call):
+        with self._cond:
+            self._pending -= 1
+            # Drop cancelled entries from the top so the worker doesn't wake
+            # up early for them; deeper entries are skipped when popped.
+            while self._heap and self._heap[0][2].cancelled:
+                heapq.heappop(self._heap)
+            self._cond.notify()
+
+    def _ensure_thread(self):
+        # Called with self._cond held. The thread is started lazily so that
+        # creating a scheduler costs nothing until something is scheduled.
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                call = None
+                while self._running and call is None:
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    deadline, _, head = self._heap[0]
+                    if head.cancelled:
+                        heapq.heappop(self._heap)
+                        continue
+                    delay = deadline - self.clock()
+                    if delay > 0:
+                        self._cond.wait(delay)
+                        continue
+                    heapq.heappop(self._heap)
+                    # Mark as done so a late cancel() is a no-op
+                    head.cancelled = True
+                    self._pending -= 1
+                    call = head
+                if not self._running:
+                    return
+
+            try:
+                call.callback(*call.args)
+            except Exception as e:
+                log.exception("Error in scheduled callback %s", getattr(call.callback, '__name__', call.callback))
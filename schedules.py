@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""
+Recurring schedules
+
+A schedule sets a fan to a speed at a time of day on chosen weekdays, e.g.
+weekdays at 22:00 go low and at 06:00 go off. Schedules are kept in a JSON
+file and managed through /api/schedules.
+
+The next fire time of every enabled schedule sits in a heap, and one call on
+the fan registry's scheduler is armed for the earliest of them, so the
+schedules cost nothing while they wait, however many there are. When it
+fires, every schedule that is due runs and is pushed back with its next fire
+time. Heap entries of edited or deleted schedules are dropped when they
+reach the top. The wait is capped at RECHECK_INTERVAL so that a wall clock
+step (e.g. NTP after boot) is noticed.
+
+A schedule's action goes through the same path as a web speed change
+(web_app.change_fan_speed): relays, state, and the safety timer started or
+cancelled.
+"""
+
+import heapq
+import itertools
+import json
+import os
+import re
+import threading
+from datetime import datetime, time as time_of_day, timedelta
+
+import fan_control
+from event_log import get_logger
+from state_journal import fsync_dir
+
+log = get_logger('timers')
+
+# Schedules file
+SCHEDULES_PATH = os.environ.get(
+    'FAN_SCHEDULES', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schedules.json'))
+
+# Longest wait between checks of the wall clock (seconds)
+RECHECK_INTERVAL = 900
+
+# A schedule found due later than this (e.g. after the clock jumped forward)
+# is skipped rather than run late (seconds)
+MISFIRE_GRACE = 900
+
+WEEKDAYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+# Weekday numbers (Monday = 0) of a schedule that runs daily
+EVERY_DAY = tuple(range(7))
+# Accepted spellings of each day: the abbreviation or the full name
+DAY_NAMES = {name: index for index, full in enumerate(
+    ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday'))
+    for name in (WEEKDAYS[index], full)}
+DAY_GROUPS = {
+    'daily': WEEKDAYS,
+    'weekdays': WEEKDAYS[:5],
+    'weekends': WEEKDAYS[5:],
+}
+
+_TIME_PATTERN = re.compile(r'^([01]?\d|2[0-3]):([0-5]\d)$')
+
+
+class Schedule:
+    """Set fan to speed at a time of day on some weekdays."""
+
+    def __init__(self, schedule_id, fan, speed, at, days=EVERY_DAY, enabled=True, name=None):
+        self.id = schedule_id
+        self.fan = fan
+        self.speed = speed
+        self.at = at                # datetime.time
+        self.days = tuple(days)     # weekday numbers, Monday = 0
+        self.enabled = enabled
+        self.name = name
+        self.next_fire = None       # datetime, None while disabled
+
+    def next_after(self, moment):
+        """The first fire time strictly after moment (a datetime), or None."""
+        if not self.days:
+            return None
+        for offset in range(8):
+            day = moment.date() + timedelta(days=offset)
+            if day.weekday() in self.days:
+                fire = datetime.combine(day, self.at)
+                if fire > moment:
+                    return fire
+        return None
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'fan': self.fan,
+            'speed': self.speed,
+            'time': self.at.strftime('%H:%M'),
+            'days': [WEEKDAYS[day] for day in self.days],
+            'enabled': self.enabled,
+            'next_fire': self.next_fire.isoformat() if self.next_fire else None,
+        }
+
+
+def parse_schedule(data, registry, schedule_id, current=None):
+    """Build a Schedule from a request body, on top of current's fields for an update.
+
+    Raises ValueError with a message for the client.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("Schedule must be a JSON object")
+    fields = current.to_dict() if current else {'fan': registry.default.fan_id, 'days': 'daily',
+                                                'enabled': True, 'name': None}
+    fields.update(data)
+
+    fan = fields.get('fan')
+    if not isinstance(fan, str) or registry.get(fan) is None:
+        raise ValueError(f"Unknown fan: {fan}")
+
+    speed = fan_control.validate_speed(fields.get('speed'))
+    if speed is None:
+        raise ValueError(f"Invalid speed. Must be one of {fan_control.speed_states}")
+
+    match = _TIME_PATTERN.match(str(fields.get('time') or ''))
+    if not match:
+        raise ValueError("time must be HH:MM (24-hour)")
+    at = time_of_day(int(match.group(1)), int(match.group(2)))
+
+    days = fields.get('days')
+    if isinstance(days, str):
+        days = DAY_GROUPS.get(days.lower(), [days])
+    if not isinstance(days, (list, tuple)) or not days:
+        raise ValueError("days must be a list of weekdays or one of daily, weekdays, weekends")
+    try:
+        days = sorted({DAY_NAMES[str(day).lower()] for day in days})
+    except KeyError:
+        raise ValueError(f"days must be weekday names ({', '.join(WEEKDAYS)} or in full)")
+
+    enabled = fields.get('enabled')
+    if not isinstance(enabled, bool):
+        raise ValueError("enabled must be true or false")
+
+    name = fields.get('name')
+    return Schedule(schedule_id, fan, speed, at, days, enabled, str(name) if name is not None else None)
+
+
+class ScheduleBook:
+    """The schedules of a fan registry and the next-fire index that runs them.
+
+    apply(schedule) performs a schedule's action; it runs on the scheduler
+    (or hardware owner) thread and returns (success, message).
+    """
+
+    def __init__(self, registry, apply, path=None):
+        self.registry = registry
+        self.apply = apply
+        self.path = path or SCHEDULES_PATH
+        self._schedules = {}  # id -> Schedule
+        self._index = []      # heap of (fire time, seq, schedule id)
+        self._seq = itertools.count()
+        self._handle = None
+        self._next_id = 1  # ids are never reused, even after a delete
+        self._lock = threading.Lock()
+
+        # Counters for diagnostics
+        self.stats = {
+            'fired': 0,
+            'failed': 0,
+            'missed': 0,   # skipped: found due later than MISFIRE_GRACE
+            'wakeups': 0,  # scheduler calls, including RECHECK_INTERVAL checks
+        }
+
+    # --- Lifecycle ------------------------------------------------------
+
+    def start(self):
+        """Load the saved schedules and arm the earliest one."""
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+            saved, next_id = data.get('schedules', []), int(data.get('next_id', 1))
+        except FileNotFoundError:
+            saved, next_id = [], 1
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+            log.warning("Schedules file %s unreadable, starting with none: %s", self.path, e)
+            saved, next_id = [], 1
+
+        with self._lock:
+            for data in saved:
+                try:
+                    schedule = parse_schedule(data, self.registry, int(data['id']))
+                except (ValueError, KeyError, TypeError) as e:
+                    log.warning("Skipping saved schedule %s: %s", data.get('id') if isinstance(data, dict) else data, e)
+                    continue
+                self._schedules[schedule.id] = schedule
+            self._next_id = max([next_id, self._next_id] + [schedule_id + 1 for schedule_id in self._schedules])
+            now = fan_control.clock.now()
+            for schedule in self._schedules.values():
+                self._push(schedule, now)
+            self._arm(now)
+        if self._schedules:
+            log.info("Loaded %d schedule(s) from %s", len(self._schedules), self.path)
+
+    def stop(self):
+        with self._lock:
+            if self._handle is not None:
+                self._handle.cancel()
+                self._handle = None
+
+    # --- CRUD -----------------------------------------------------------
+
+    def list(self):
+        with self._lock:
+            return [schedule.to_dict() for schedule in sorted(self._schedules.values(), key=lambda s: s.id)]
+
+    def get(self, schedule_id):
+        """The schedule as a dict, or None."""
+        with self._lock:
+            schedule = self._schedules.get(schedule_id)
+            return schedule.to_dict() if schedule else None
+
+    def create(self, data):
+        """Add a schedule from a request body. Returns it as a dict; raises ValueError."""
+        with self._lock:
+            schedule = parse_schedule(data, self.registry, self._next_id)
+            self._next_id += 1
+            return self._put(schedule)
+
+    def update(self, schedule_id, data):
+        """Change some fields of a schedule. Returns it as a dict (None if unknown); raises ValueError."""
+        with self._lock:
+            current = self._schedules.get(schedule_id)
+            if current is None:
+                return None
+            schedule = parse_schedule(data, self.registry, schedule_id, current)
+            return self._put(schedule)
+
+    def delete(self, schedule_id):
+        """Remove a schedule. Returns False if there was none."""
+        with self._lock:
+            if self._schedules.pop(schedule_id, None) is None:
+                return False
+            self._save()
+            # Its heap entry is dropped when it reaches the top
+            self._arm(fan_control.clock.now())
+            return True
+
+    def _put(self, schedule):
+        # Called with self._lock held
+        self._schedules[schedule.id] = schedule
+        now = fan_control.clock.now()
+        self._push(schedule, now)
+        self._save()
+        self._arm(now)
+        return schedule.to_dict()
+
+    # --- Index ----------------------------------------------------------
+
+    def _push(self, schedule, after):
+        schedule.next_fire = schedule.next_after(after) if schedule.enabled else None
+        if schedule.next_fire is not None:
+            heapq.heappush(self._index, (schedule.next_fire, next(self._seq), schedule.id))
+        if len(self._index) > 2 * len(self._schedules) + 16:
+            # Mostly stale entries from edits: rebuild from the live schedules
+            self._index = [(s.next_fire, next(self._seq), s.id)
+                           for s in self._schedules.values() if s.next_fire is not None]
+            heapq.heapify(self._index)
+
+    def _live_head(self):
+        # Drop stale entries from the top; returns the earliest live one or None
+        while self._index:
+            fire, _, schedule_id = self._index[0]
+            schedule = self._schedules.get(schedule_id)
+            if schedule is not None and schedule.next_fire == fire:
+                return fire
+            heapq.heappop(self._index)
+        return None
+
+    def _arm(self, now):
+        # Called with self._lock held: one scheduler call for the earliest fire time
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        fire = self._live_head()
+        if fire is None:
+            return
+        delay = min(max(0.0, (fire - now).total_seconds()), RECHECK_INTERVAL)
+        self._handle = self.registry.scheduler.call_later(delay, self._wake)
+
+    def _wake(self):
+        with self._lock:
+            self.stats['wakeups'] += 1
+            now = fan_control.clock.now()
+            due = []
+            while True:
+                fire = self._live_head()
+                if fire is None or fire > now:
+                    break
+                schedule = self._schedules[heapq.heappop(self._index)[2]]
+                if (now - fire).total_seconds() > MISFIRE_GRACE:
+                    self.stats['missed'] += 1
+                    log.warning("Schedule %s missed its %s run; skipping it", schedule.id,
+                                fire.isoformat(timespec='minutes'))
+                else:
+                    due.append(schedule)
+                self._push(schedule, now)
+
+        # Run the actions outside the lock: they wait for the hardware owner
+        for schedule in due:
+            try:
+                success, message = self.apply(schedule)
+            except Exception as e:
+                success, message = False, str(e)
+            self.stats['fired' if success else 'failed'] += 1
+            log_method = log.info if success else log.error
+            log_method("Schedule %s set fan '%s' to %s: %s", schedule.id, schedule.fan, schedule.speed, message,
+                       extra={'fan': schedule.fan, 'speed': schedule.speed, 'event': 'schedule_fired',
+                              'schedule': schedule.id})
+
+        with self._lock:
+            self._arm(fan_control.clock.now())
+
+    def pending(self):
+        """Enabled schedules waiting in the index."""
+        with self._lock:
+            return sum(1 for schedule in self._schedules.values() if schedule.next_fire is not None)
+
+    # --- Persistence ----------------------------------------------------
+
+    def _save(self):
+        # Called with self._lock held
+        data = {'next_id': self._next_id, 'schedules': [{key: value for key, value in schedule.to_dict().items() if key != 'next_fire'}
+                              for schedule in sorted(self._schedules.values(), key=lambda s: s.id)]}
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, indent=2)
+            f.write('\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        fsync_dir(self.path)
@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+"""
+Sensors and automatic speed
+
+Temperature and humidity sensors that show their readings as Linux sysfs
+files (1-wire w1_slave or temperature, thermal zones, IIO
+in_humidityrelative_input) are sampled on their own interval into
+fixed-size numpy ring buffers. Any file holding a number works, so plain
+files stand in for sysfs in tests and the simulation.
+
+Auto mode maps a sensor to a fan's speed. Each update takes the samples
+that arrived since the last one and, on whole arrays:
+- smooths them with a moving average over the last `window` samples
+  (failed reads are NaN and left out of the average)
+- turns them into a level with a hysteresis band per threshold: a speed
+  is entered at its threshold and only left below threshold - band
+
+Below every threshold the fan is off. A level change is applied at most
+once per min_hold seconds, through the same speed change as the web
+interface (safety timer included). Auto mode only acts when the level
+changes, so a manual speed or the safety timer stands until the readings
+move to another level.
+
+Sensors and auto mode are described in sensors.json (or $FAN_SENSORS):
+
+    {"sensors": [{"id": "attic", "path": "/sys/bus/w1/devices/28-0000/w1_slave",
+                  "interval": 10, "scale": 0.001}],
+     "auto": [{"fan": "default", "sensor": "attic",
+               "thresholds": {"low": 26, "med": 29, "high": 32},
+               "band": 1.0, "window": 6, "min_hold": 120}]}
+"""
+
+import json
+import os
+import threading
+
+import numpy as np
+
+import fan_control
+from event_log import get_logger
+
+log = get_logger('sensors')
+
+# Sensor and auto mode config file
+SENSORS_PATH = os.environ.get(
+    'FAN_SENSORS', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sensors.json'))
+
+# Samples kept per sensor
+BUFFER_SIZE = 720
+
+# Defaults for sensors.json entries
+DEFAULT_INTERVAL = 10     # seconds between samples
+DEFAULT_SCALE = 0.001     # sysfs temperatures and humidities are in thousandths
+DEFAULT_WINDOW = 6        # samples in the moving average
+DEFAULT_BAND = 1.0        # hysteresis, in sensor units
+DEFAULT_MIN_HOLD = 120    # seconds between automatic speed changes
+
+
+def read_sysfs(path, scale=DEFAULT_SCALE):
+    """Read one value from a sysfs-style file, times scale.
+
+    Handles a bare number (thermal zones, IIO, 1-wire temperature) and the
+    two-line 1-wire w1_slave format, whose CRC line must end in YES.
+    Raises OSError or ValueError when there is no valid reading.
+    """
+    with open(path) as f:
+        text = f.read()
+    if 't=' in text:
+        if 'YES' not in text.splitlines()[0]:
+            raise ValueError("1-wire CRC check failed")
+        text = text.rsplit('t=', 1)[1]
+    return float(text.strip()) * scale
+
+
+class SampleBuffer:
+    """Fixed-size ring buffer of (Unix time, value) samples."""
+
+    def __init__(self, size=BUFFER_SIZE):
+        self.size = size
+        self.times = np.zeros(size, dtype=np.float64)
+        self.values = np.full(size, np.nan)
+        self.count = 0  # samples ever appended; the next goes in slot count % size
+        self._lock = threading.Lock()
+
+    def append(self, t, value):
+        with self._lock:
+            slot = self.count % self.size
+            self.times[slot] = t
+            self.values[slot] = value
+            self.count += 1
+
+    def latest(self, n):
+        """The newest n (or fewer) samples as (times, values), oldest first."""
+        with self._lock:
+            n = min(n, self.count, self.size)
+            end = self.count % self.size
+            index = np.arange(end - n, end) % self.size
+            return self.times[index], self.values[index]
+
+
+def moving_average(values, window):
+    """Mean of each value and the window - 1 before it, ignoring NaN.
+
+    The first values average over what is there; a stretch with no valid
+    value gives NaN.
+    """
+    valid = ~np.isnan(values)
+    sums = np.cumsum(np.where(valid, values, 0.0))
+    counts = np.cumsum(valid)
+    sums[window:] = sums[window:] - sums[:-window]
+    counts[window:] = counts[window:] - counts[:-window]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+
+
+def hysteresis(values, thresholds, band, initial=0):
+    """Levels for a run of values: the number of thresholds each value is past.
+
+    Level k is entered when a value reaches thresholds[k - 1] and left when
+    one drops below thresholds[k - 1] - band; in between (and for NaN) the
+    previous level holds. initial is the level before the first value.
+    """
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64)[:, None]
+    # Per threshold: 1 = switch on, 0 = switch off, -1 = hold
+    events = np.where(values >= thresholds, 1, np.where(values < thresholds - band, 0, -1))
+    # Carry the last event of each threshold forward
+    rows = np.arange(len(values))[:, None]
+    last = np.maximum.accumulate(np.where(events >= 0, rows, -1), axis=0)
+    before = (np.arange(len(thresholds)) < initial).astype(int)
+    on = np.where(last >= 0, np.take_along_axis(events, np.maximum(last, 0), axis=0), before)
+    return on.sum(axis=1)
+
+
+class Sensor:
+    """One sysfs reading, sampled every interval seconds into a SampleBuffer."""
+
+    def __init__(self, sensor_id, path, interval=DEFAULT_INTERVAL, scale=DEFAULT_SCALE, size=BUFFER_SIZE):
+        self.id = sensor_id
+        self.path = path
+        self.interval = interval
+        self.scale = scale
+        self.buffer = SampleBuffer(size)
+        self.next_due = fan_control.clock.monotonic()  # monotonic time of the next sample
+        self.stats = {'samples': 0, 'errors': 0}
+        self._failing = False
+
+    def sample(self):
+        """Take one reading. A failed read is stored as NaN."""
+        try:
+            value = read_sysfs(self.path, self.scale)
+            if self._failing:
+                log.info("Sensor %s reading again", self.id)
+            self._failing = False
+        except (OSError, ValueError) as e:
+            value = np.nan
+            self.stats['errors'] += 1
+            if not self._failing:
+                log.warning("Sensor %s: no reading from %s: %s", self.id, self.path, e)
+            self._failing = True
+        self.buffer.append(fan_control.clock.now().timestamp(), value)
+        self.stats['samples'] += 1
+        return value
+
+    def status(self):
+        times, values = self.buffer.latest(1)
+        return {
+            'path': self.path,
+            'interval': self.interval,
+            'time': float(times[0]) if len(times) else None,
+            'value': None if not len(values) or np.isnan(values[0]) else float(values[0]),
+            **self.stats,
+        }
+
+
+class AutoSpeed:
+    """Drives a fan's speed from a sensor's filtered readings."""
+
+    def __init__(self, fan, sensor, thresholds, band=DEFAULT_BAND, window=DEFAULT_WINDOW,
+                 min_hold=DEFAULT_MIN_HOLD, enabled=True):
+        # Speeds in speed_states order; level k runs the fan at speeds[k]
+        configured = [speed for speed in fan_control.speed_states if speed in thresholds and speed != 'off']
+        limits = [float(thresholds[speed]) for speed in configured]
+        if not configured or any(b <= a for a, b in zip(limits, limits[1:])):
+            raise ValueError("thresholds must rise with the speed")
+        self.fan = fan
+        self.sensor = sensor
+        self.speeds = ['off'] + configured
+        self.thresholds = limits
+        self.band = band
+        self.window = window
+        self.min_hold = min_hold
+        self.enabled = enabled
+        self.level = self.fan_level()
+        self.smoothed = None
+        self._seen = sensor.buffer.count
+        self._last_change = None
+
+    def fan_level(self):
+        """The level of the fan's current speed (a speed without a threshold counts as off)."""
+        speed = self.fan.current.speed
+        return self.speeds.index(speed) if speed in self.speeds else 0
+
+    def update(self, now):
+        """Filter the samples that arrived since the last update; change speed if the level moved."""
+        new = self.sensor.buffer.count - self._seen
+        if new <= 0:
+            return
+        self._seen = self.sensor.buffer.count
+        _, values = self.sensor.buffer.latest(new + self.window - 1)
+        smoothed = moving_average(values, self.window)[-new:]
+        self.smoothed = None if np.isnan(smoothed[-1]) else float(smoothed[-1])
+        level = int(hysteresis(smoothed, self.thresholds, self.band, self.level)[-1])
+
+        if not self.enabled or level == self.level:
+            return
+        if self._last_change is not None and now - self._last_change < self.min_hold:
+            return  # try again with the next sample
+        self._last_change = now  # a failed change also waits min_hold before retrying
+        speed = self.speeds[level]
+        reading = 'n/a' if self.smoothed is None else f'{self.smoothed:.2f}'
+        log.info("Auto: fan '%s' to %s (%s %s)", self.fan.fan_id, speed, self.sensor.id, reading,
+                 extra={'fan': self.fan.fan_id, 'speed': speed, 'event': 'auto_speed', 'sensor': self.sensor.id})
+        success, message = self.fan.change_speed(speed, 'sensor')
+        if success:
+            self.level = level
+        else:
+            log.warning("Auto: fan '%s' stays at %s: %s", self.fan.fan_id, self.speeds[self.level], message,
+                        extra={'fan': self.fan.fan_id, 'event': 'auto_speed_failed', 'sensor': self.sensor.id})
+
+    def status(self):
+        return {
+            'sensor': self.sensor.id,
+            'enabled': self.enabled,
+            'speed': self.speeds[self.level],
+            'smoothed': self.smoothed,
+            'thresholds': dict(zip(self.speeds[1:], self.thresholds)),
+            'band': self.band,
+            'window': self.window,
+            'min_hold': self.min_hold,
+        }
+
+
+class SensorHub:
+    """The sensors and auto mode controllers of a fan registry, sampled on one thread."""
+
+    def __init__(self, registry):
+        self.registry = registry
+        self.sensors = {}  # id -> Sensor
+        self.auto = {}     # fan_id -> AutoSpeed
+        self._stop = threading.Event()
+        self._thread = None
+
+    def configure(self, config):
+        """Set up sensors and auto mode from a sensors.json dict. Raises ValueError."""
+        for entry in config.get('sensors', []):
+            self.sensors[entry['id']] = Sensor(entry['id'], entry['path'],
+                                               interval=entry.get('interval', DEFAULT_INTERVAL),
+                                               scale=entry.get('scale', DEFAULT_SCALE))
+        for entry in config.get('auto', []):
+            fan = self.registry.get(entry.get('fan')) if entry.get('fan') else self.registry.default
+            sensor = self.sensors.get(entry.get('sensor'))
+            if fan is None or sensor is None:
+                raise ValueError(f"auto entry needs a known fan and sensor: {entry}")
+            self.auto[fan.fan_id] = AutoSpeed(fan, sensor, entry['thresholds'],
+                                              band=entry.get('band', DEFAULT_BAND),
+                                              window=entry.get('window', DEFAULT_WINDOW),
+                                              min_hold=entry.get('min_hold', DEFAULT_MIN_HOLD),
+                                              enabled=entry.get('enabled', True))
+
+    def start(self, path=None):
+        """Load sensors.json (if there is one) and start sampling."""
+        path = path or SENSORS_PATH
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self.configure(json.load(f))
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                log.error("Sensor config %s not loaded: %s", path, e)
+                return
+            log.info("Loaded %d sensor(s), %d auto mode fan(s) from %s", len(self.sensors), len(self.auto), path)
+        if self.sensors and self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='sensors', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def step(self, now):
+        """Sample every sensor that is due at monotonic time now and update auto mode.
+
+        Returns the seconds until the next sample is due.
+        """
+        sampled = False
+        for sensor in self.sensors.values():
+            if now >= sensor.next_due:
+                sensor.sample()
+                # Keep to the interval grid; once a whole interval behind,
+                # start a new one from now rather than catch up back to back
+                sensor.next_due += sensor.interval
+                if sensor.next_due <= now:
+                    sensor.next_due = now + sensor.interval
+                sampled = True
+        if sampled:
+            for auto in self.auto.values():
+                try:
+                    auto.update(now)
+                except Exception as e:
+                    log.error("Auto mode for fan '%s' failed: %s", auto.fan.fan_id, e)
+        if not self.sensors:
+            return DEFAULT_INTERVAL
+        return max(0.0, min(sensor.next_due for sensor in self.sensors.values()) - now)
+
+    def set_auto(self, fan_id, enabled):
+        """Switch auto mode for a fan on or off. Returns False if it has none."""
+        auto = self.auto.get(fan_id)
+        if auto is None:
+            return False
+        if enabled and not auto.enabled:
+            # Start from the speed the fan is at, so the next reading sets it
+            auto.level = auto.fan_level()
+        auto.enabled = enabled
+        return True
+
+    def status(self):
+        return {
+            'sensors': {sensor_id: sensor.status() for sensor_id, sensor in self.sensors.items()},
+            'auto': {fan_id: auto.status() for fan_id, auto in self.auto.items()},
+        }
+
+    def _run(self):
+        while True:
+            # Reading a 1-wire sensor can take most of a second, so sampling
+            # stays on this thread rather than on the timer scheduler
+            delay = self.step(fan_control.clock.monotonic())
+            if self._stop.wait(delay):
+                return
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Fan Control production server
+
+Runs web_app under waitress, a production-grade threaded WSGI server with
+HTTP keep-alive, a fixed worker pool and connection timeouts. Everything
+runs in this one process, which holds the GPIO lock, so the hardware state
+has exactly one owner (unlike the Flask dev server's reloader, which starts
+a second process).
+
+Usage: ./serve.py [--port 5002] [--threads 8] [--connection-limit 100] ...
+"""
+
+import argparse
+import sys
+
+# Worker threads kept free of event streams and long-polls, for everything else
+RESERVED_THREADS = 2
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the fan control web app in production mode")
+    parser.add_argument('--host', default='0.0.0.0', help="Interface to listen on (default: 0.0.0.0)")
+    parser.add_argument('--port', type=int, default=5002, help="Port to listen on (default: 5002)")
+    parser.add_argument('--threads', type=int, default=8,
+                        help="Worker threads handling requests (default: 8). Open "
+                             f"/api/events streams and long-polls may hold all but {RESERVED_THREADS}; "
+                             "further dashboards poll instead.")
+    parser.add_argument('--connection-limit', type=int, default=100,
+                        help="Maximum simultaneous connections (default: 100)")
+    parser.add_argument('--channel-timeout', type=int, default=120,
+                        help="Seconds an idle keep-alive connection stays open (default: 120)")
+    parser.add_argument('--backlog', type=int, default=64,
+                        help="Listen backlog (default: 64)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    try:
+        from waitress import serve
+    except ImportError:
+        print("waitress is required for production mode: pip install waitress")
+        sys.exit(1)
+
+    import fan_control
+    import state_journal
+
+    print("Starting Fan Control Web Interface (production server)...")
+    print(f"Mock Mode: {fan_control.MOCK_MODE}")
+
+    try:
+        # Early restore: the relays are back at their journaled speeds before
+        # Flask loads; start_hardware() then restores the timers
+        fan_control.acquire_gpio_lock()
+        fan_control.restore_relays(state_journal.load())
+
+        import web_app
+        web_app.max_waiting_requests = max(0, args.threads - RESERVED_THREADS)
+        web_app.start_hardware()
+    except RuntimeError as e:
+        print(f"✗ {e}")
+        sys.exit(1)
+
+    print(f"Access the interface at: http://localhost:{args.port}")
+    print(f"Worker threads: {args.threads} (up to {web_app.max_waiting_requests} for event streams "
+          f"and long-polls), connection limit: {args.connection_limit}")
+
+    try:
+        serve(web_app.app,
+              host=args.host,
+              port=args.port,
+              threads=args.threads,
+              connection_limit=args.connection_limit,
+              channel_timeout=args.channel_timeout,
+              backlog=args.backlog,
+              # Lets an event stream notice a closed dashboard at its next
+              # keep-alive and free its worker and slot
+              channel_request_lookahead=1,
+              ident='fan-control')
+    except KeyboardInterrupt:
+        print("\nShutting down...")
+        web_app.cleanup_gpio()
+
+
+if __name__ == '__main__':
+    main()
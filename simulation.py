@@ -0,0 +1,549 @@
+#!/usr/bin/env python3
+"""
+Virtual-clock simulation backend
+
+Runs fan_control (and web_app on top of it) in-process against a simulated
+GPIO on a virtual clock, so hours of timer and button behaviour take
+milliseconds and every run is deterministic:
+
+- VirtualClock: time only moves when the simulation advances it. Fan timers,
+  timestamps, button debouncing and the relay dead time all use it.
+- SimGPIO: an RPi.GPIO stand-in that records every output write with its
+  virtual time, drives button inputs from scripted waveforms (with contact
+  bounce) and fires edge callbacks the way RPi.GPIO does, bouncetime
+  included. Interrupt delivery can be switched off to simulate lost edges.
+- Simulation: installs both, runs the button input loop and the button event
+  queue on the virtual clock, and checks the relay history. Sensors
+  (sensors.SensorHub) can be sampled on the virtual clock too, reading
+  plain files in place of sysfs.
+
+Example:
+
+    sim = Simulation()
+    import web_app
+    web_app.app.test_client().post('/api/set_speed', json={'speed': 'high'})
+    sim.advance(hours=6)
+    sim.assert_speeds(['off', 'high', 'off'])    # the safety timer fired
+    sim.close()
+
+Run ./simulation.py for a few example scenarios.
+"""
+
+import heapq
+from datetime import datetime, timedelta
+
+import fan_control
+from event_log import get_logger
+from hardware_owner import hardware_owner
+from input_events import InputEventQueue
+from scheduler import DeadlineScheduler
+
+log = get_logger('timers')
+
+
+class VirtualClock:
+    """A clock that only moves when told to. Same interface as fan_control.SystemClock."""
+
+    def __init__(self, start=None):
+        self.start = start or datetime(2024, 1, 1)
+        self._now = 0.0
+
+    def monotonic(self):
+        return self._now
+
+    def now(self):
+        return self.start + timedelta(seconds=self._now)
+
+    def sleep(self, seconds):
+        # Time passes for the caller; nothing else runs meanwhile
+        if seconds > 0:
+            self._now += seconds
+
+    def set(self, t):
+        """Move the clock forward to t (never backwards)."""
+        self._now = max(self._now, t)
+
+
+class VirtualScheduler(DeadlineScheduler):
+    """DeadlineScheduler on a VirtualClock: calls run when the simulation reaches them."""
+
+    def __init__(self, clock):
+        super().__init__(name='virtual-scheduler', clock=clock.monotonic)
+
+    def next_deadline(self):
+        """Deadline of the earliest pending call, or None."""
+        with self._cond:
+            self._drop_cancelled()
+            return self._heap[0][0] if self._heap else None
+
+    def _drop_cancelled(self):
+        # Called with self._cond held
+        while self._heap and self._heap[0][2].cancelled:
+            heapq.heappop(self._heap)
+
+    def run_due(self):
+        """Run every call whose deadline has been reached. Returns how many ran."""
+        ran = 0
+        while True:
+            with self._cond:
+                self._drop_cancelled()
+                if not self._heap or self._heap[0][0] > self.clock():
+                    return ran
+                _, _, call = heapq.heappop(self._heap)
+                call.cancelled = True
+                self._pending -= 1
+            try:
+                call.callback(*call.args)
+            except Exception as e:
+                log.exception("Error in scheduled callback %s", getattr(call.callback, '__name__', call.callback))
+            ran += 1
+
+    def _ensure_thread(self):
+        pass  # no worker thread: the simulation runs due calls itself
+
+
+class SimGPIO:
+    """Simulated RPi.GPIO with recorded outputs and scripted inputs."""
+
+    BCM = "BCM"
+    OUT = "OUT"
+    IN = "IN"
+    HIGH = fan_control.GPIO.HIGH
+    LOW = fan_control.GPIO.LOW
+    PUD_UP = "PUD_UP"
+    PUD_DOWN = "PUD_DOWN"
+    RISING = "RISING"
+    FALLING = "FALLING"
+    BOTH = "BOTH"
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.levels = {}
+        self.modes = {}
+        self.history = []  # (time, {pin: level}) for every output call
+        self.interrupts = True
+        self._edges = {}  # pin -> [edge, callback, bouncetime, last callback time]
+
+    # --- RPi.GPIO interface ---------------------------------------------
+
+    def setmode(self, mode):
+        pass
+
+    def setwarnings(self, enabled):
+        pass
+
+    def setup(self, pin, mode, pull_up_down=None, initial=None):
+        self.modes[pin] = mode
+        if mode == self.IN:
+            self.levels[pin] = self.LOW if pull_up_down == self.PUD_DOWN else self.HIGH
+        else:
+            self.levels.setdefault(pin, self.LOW)
+
+    def output(self, pin, state):
+        pins = list(pin) if isinstance(pin, (list, tuple)) else [pin]
+        states = state if isinstance(state, (list, tuple)) else [state] * len(pins)
+        written = {}
+        for p, s in zip(pins, states):
+            if self.modes.get(p) != self.OUT:
+                raise RuntimeError(f"GPIO {p} has not been set up as an output")
+            self.levels[p] = written[p] = s
+        self.history.append((self.clock.monotonic(), written))
+
+    def input(self, pin):
+        if pin not in self.modes:
+            raise RuntimeError(f"GPIO {pin} has not been set up")
+        return self.levels[pin]
+
+    def add_event_detect(self, pin, edge, callback=None, bouncetime=None):
+        if pin in self._edges:
+            raise RuntimeError("Conflicting edge detection already enabled for this GPIO channel")
+        self._edges[pin] = [edge, callback, (bouncetime or 0) / 1000.0, None]
+
+    def remove_event_detect(self, pin):
+        self._edges.pop(pin, None)
+
+    def cleanup(self):
+        self._edges.clear()
+
+    # --- Simulation -----------------------------------------------------
+
+    def set_input(self, pin, level):
+        """Drive a button pin, firing edge callbacks like RPi.GPIO would."""
+        previous = self.levels.get(pin)
+        self.levels[pin] = level
+        detect = self._edges.get(pin)
+        if previous == level or detect is None or not self.interrupts:
+            return
+
+        edge, callback, bouncetime, last_call = detect
+        falling = level == self.LOW
+        if edge == self.BOTH or (edge == self.FALLING) == falling:
+            now = self.clock.monotonic()
+            if last_call is not None and now - last_call < bouncetime:
+                return  # suppressed by the library's bouncetime
+            detect[3] = now
+            if callback:
+                callback(pin)
+
+
+def bounce(count=3, period=0.002):
+    """Contact bounce after an edge: count extra level flips, period apart."""
+    return [period] * count
+
+
+class Simulation:
+    """Installs the simulated GPIO and virtual clock into fan_control.
+
+    Create it before the code under test starts timers; close() restores the
+    real backends.
+    """
+
+    def __init__(self, registry=None, start=None):
+        self.registry = registry or fan_control.registry
+        self.clock = VirtualClock(start)
+        self.scheduler = VirtualScheduler(self.clock)
+        self.gpio = SimGPIO(self.clock)
+        self.relay_driver = fan_control.relay_driver
+        self._saved = {
+            'GPIO': fan_control.GPIO,
+            'clock': fan_control.clock,
+            'button_events': fan_control.button_events,
+            'button_input': fan_control.button_input,
+            'gpio_ready': fan_control.gpio_ready,
+            'scheduler': self.registry.scheduler,
+            'relay': (self.relay_driver.gpio, self.relay_driver.clock, self.relay_driver.sleep,
+                      dict(self.relay_driver._shadow)),
+        }
+
+        # Time at each speed so far counts in real time, from here on in virtual time
+        self._restart_speed_time(self.clock)
+
+        fan_control.GPIO = self.gpio
+        fan_control.clock = self.clock
+        fan_control.gpio_ready = True
+        self.relay_driver.gpio = self.gpio
+        self.relay_driver.clock = self.clock.monotonic
+        self.relay_driver.sleep = self.clock.sleep
+        self.relay_driver._shadow.clear()
+        self.registry.use_scheduler(self.scheduler)
+
+        # Button events are handled by the simulation, not consumer threads
+        self.events = InputEventQueue(fan_control.handle_button_event, consumers=0,
+                                      clock=self.clock.monotonic)
+        fan_control.button_events = self.events
+
+        # Relays all off, buttons on edge detection with the verification loop
+        self.registry.setup_relays()
+        button_pins = self.registry.button_pins()
+        for pin in button_pins:
+            self.gpio.setup(pin, self.gpio.IN, pull_up_down=self.gpio.PUD_UP)
+        self.button_input = None
+        if button_pins:
+            self.button_input = fan_control.ButtonInput(button_pins)
+            self.button_input.enable_edges()
+            fan_control.button_input = self.button_input
+            self.scheduler.call_later(fan_control.VERIFY_INTERVAL, self._input_tick)
+
+    def close(self):
+        """Restore the real GPIO backend, clock and scheduler."""
+        saved = self._saved
+        self.scheduler.stop()
+        self._restart_speed_time(saved['clock'])
+        fan_control.GPIO = saved['GPIO']
+        fan_control.clock = saved['clock']
+        fan_control.button_events = saved['button_events']
+        fan_control.button_input = saved['button_input']
+        fan_control.gpio_ready = saved['gpio_ready']
+        self.registry.use_scheduler(saved['scheduler'])
+        gpio, clock, sleep, shadow = saved['relay']
+        self.relay_driver.gpio = gpio
+        self.relay_driver.clock = clock
+        self.relay_driver.sleep = sleep
+        self.relay_driver._shadow.clear()
+        self.relay_driver._shadow.update(shadow)
+
+    def _restart_speed_time(self, clock):
+        for fan in self.registry:
+            fan.account_speed_time()
+            fan._speed_since = clock.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # --- Time -----------------------------------------------------------
+
+    @property
+    def time(self):
+        """Virtual seconds since the simulation started."""
+        return self.clock.monotonic()
+
+    def advance(self, seconds=0.0, minutes=0.0, hours=0.0):
+        """Run everything due in the next stretch of virtual time, in order."""
+        end = self.time + seconds + minutes * 60 + hours * 3600
+        self.settle()
+        while True:
+            deadline = self.scheduler.next_deadline()
+            if deadline is None or deadline > end:
+                break
+            self.clock.set(deadline)
+            self.scheduler.run_due()
+            self.settle()
+        self.clock.set(end)
+
+    def settle(self):
+        """Handle queued button events and wait for the hardware owner to finish them."""
+        while self.events.drain():
+            hardware_owner.call(lambda: None)
+
+    def _input_tick(self):
+        delay = self.button_input.step(self.time)
+        self.scheduler.call_later(delay, self._input_tick)
+
+    # --- Buttons --------------------------------------------------------
+
+    def waveform(self, pin, steps, at=0.0):
+        """Schedule input levels: steps is [(seconds after at, level), ...]."""
+        start = self.time + at
+        for offset, level in steps:
+            self.scheduler.call_at(start + offset, self.gpio.set_input, pin, level)
+
+    def press(self, pin, at=0.0, hold=0.2, bounce=(), release_bounce=()):
+        """Schedule a button press: fall, bounce, hold, release, bounce.
+
+        bounce and release_bounce are the durations of the extra level
+        flips after each edge (see bounce()).
+        """
+        high, low = self.gpio.HIGH, self.gpio.LOW
+        steps = [(0.0, low)]
+        t, level = 0.0, low
+        for duration in bounce:
+            t += duration
+            level = high if level == low else low
+            steps.append((t, level))
+        if level != low:
+            steps.append((t, low))
+        t = max(t, hold)
+        steps.append((t, high))
+        level = high
+        for duration in release_bounce:
+            t += duration
+            level = high if level == low else low
+            steps.append((t, level))
+        if level != high:
+            steps.append((t, high))
+        self.waveform(pin, steps, at)
+
+    def press_speed(self, fan=None, **kwargs):
+        """Press the speed button of fan (default fan if None)."""
+        self.press(self._fan(fan).speed_button, **kwargs)
+
+    def press_timer(self, fan=None, **kwargs):
+        """Press the timer button of fan (default fan if None)."""
+        self.press(self._fan(fan).timer_button, **kwargs)
+
+    def lose_interrupts(self, lost=True):
+        """Stop (or resume) delivering edge callbacks; levels still change."""
+        self.gpio.interrupts = not lost
+
+    # --- Sensors --------------------------------------------------------
+
+    def drive_sensors(self, hub):
+        """Sample hub's sensors (and run its auto mode) on the virtual clock."""
+        def tick():
+            self.scheduler.call_later(hub.step(self.time), tick)
+        tick()
+
+    # --- Relay history --------------------------------------------------
+
+    def relay_speed(self, fan=None):
+        """Speed the relays of fan are set to right now."""
+        fan = self._fan(fan)
+        return self._speed_from_levels(fan, self.gpio.levels)
+
+    def speed_history(self, fan=None, gaps=False):
+        """[(time, speed)] each time fan's relays changed, starting with 'off' at 0.
+
+        Without gaps, the brief all-off moment of a break-before-make switch
+        is left out.
+        """
+        fan = self._fan(fan)
+        pins = set(fan.speed_pins.values())
+        levels = {pin: self.gpio.LOW for pin in pins}
+        history = [(0.0, 'off')]
+        for t, written in self.gpio.history:
+            if pins.isdisjoint(written):
+                continue
+            levels.update(written)
+            speed = self._speed_from_levels(fan, levels)
+            if history[-1][1] != speed:
+                history.append((t, speed))
+
+        if not gaps:
+            limit = self.relay_driver.dead_time * 2
+            history = [entry for i, entry in enumerate(history)
+                       if not (entry[1] == 'off' and 0 < i < len(history) - 1
+                               and history[i + 1][0] - entry[0] <= limit
+                               and history[i + 1][1] != 'off')]
+            merged = []
+            for entry in history:
+                if not merged or merged[-1][1] != entry[1]:
+                    merged.append(entry)
+            history = merged
+        return history
+
+    def speed_at(self, t, fan=None):
+        """Speed fan's relays were set to at virtual time t."""
+        speed = 'off'
+        for when, value in self.speed_history(fan, gaps=True):
+            if when > t:
+                break
+            speed = value
+        return speed
+
+    def assert_speeds(self, expected, fan=None):
+        """Assert the sequence of relay speeds (see speed_history)."""
+        actual = [speed for _, speed in self.speed_history(fan)]
+        if actual != list(expected):
+            raise AssertionError(f"relay speeds {actual}, expected {list(expected)}")
+
+    def assert_speed(self, expected, fan=None):
+        """Assert both the relays and the fan state show the expected speed."""
+        fan = self._fan(fan)
+        relays = self.relay_speed(fan)
+        if relays != expected or fan.current.speed != expected:
+            raise AssertionError(f"fan '{fan.fan_id}': relays {relays}, state {fan.current.speed}, expected {expected}")
+
+    def assert_speed_at(self, t, expected, fan=None):
+        actual = self.speed_at(t, fan)
+        if actual != expected:
+            raise AssertionError(f"relay speed at {t}s was {actual}, expected {expected}")
+
+    def assert_no_overlap(self):
+        """Assert no fan ever had two speed relays energized at once."""
+        levels = {}
+        for t, written in self.gpio.history:
+            levels.update(written)
+            for fan in self.registry:
+                if self._speed_from_levels(fan, levels) == 'overlap':
+                    raise AssertionError(f"fan '{fan.fan_id}' had two speed relays on at {t}s")
+
+    def _speed_from_levels(self, fan, levels):
+        on = [speed for speed, pin in fan.speed_pins.items()
+              if levels.get(pin) == fan_control.ACTIVE_LEVEL]
+        if len(on) > 1:
+            return 'overlap'
+        return on[0] if on else 'off'
+
+    def _fan(self, fan):
+        if fan is None:
+            return self.registry.default
+        if isinstance(fan, str):
+            return self.registry.get(fan)
+        return fan
+
+
+def run_examples():
+    """A few scenarios that take hours of wall time on real hardware."""
+    import os
+    import tempfile
+    import time
+
+    import web_app
+    from sensors import SensorHub
+
+    def scenario(name, func):
+        started = time.perf_counter()
+        sim = Simulation()
+        try:
+            func(sim)
+        finally:
+            # Leave every fan off with no timers for the next scenario
+            for fan in sim.registry:
+                fan.change_speed('off')
+                fan.timer_index = 0
+            sim.close()
+        print(f"✅ {name} ({(time.perf_counter() - started) * 1000:.0f} ms)")
+
+    client = web_app.app.test_client()
+
+    def safety_timer(sim):
+        client.post('/api/set_speed', json={'speed': 'high'})
+        sim.advance(hours=5, minutes=59)
+        sim.assert_speed('high')
+        sim.advance(minutes=1)
+        sim.assert_speed('off')
+        sim.assert_speeds(['off', 'high', 'off'])
+
+    def user_timer(sim):
+        client.post('/api/set_speed', json={'speed': 'med'})
+        client.post('/api/set_timer', json={'hours': 4})
+        sim.advance(hours=2)
+        assert client.get('/api/status').get_json()['timer_state']['remaining_seconds'] == 2 * 3600
+        sim.advance(hours=2)
+        sim.assert_speed('off')
+        sim.assert_speed_at(4 * 3600 - 1, 'med')
+
+    def bouncy_buttons(sim):
+        for i in range(3):
+            sim.press_speed(at=i * 2.0, bounce=bounce(5), release_bounce=bounce(3))
+        sim.advance(seconds=10)
+        sim.assert_speeds(['off', 'low', 'med', 'high'])
+        sim.assert_no_overlap()
+
+    def lost_interrupts(sim):
+        sim.lose_interrupts()
+        sim.press_speed(hold=1.5)
+        sim.advance(seconds=5)
+        sim.assert_speed('low')
+        assert fan_control.button_input.mode == 'poll'
+        sim.lose_interrupts(False)
+        sim.advance(seconds=fan_control.EDGE_RETRY_INTERVAL)
+        assert fan_control.button_input.mode == 'edge'
+
+    def sensor_auto_speed(sim):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'temp')
+
+            def set_temperature(celsius):
+                # Thermal zone format: millidegrees
+                with open(path, 'w') as f:
+                    f.write(f"{round(celsius * 1000)}\n")
+
+            hub = SensorHub(sim.registry)
+            hub.configure({'sensors': [{'id': 'room', 'path': path, 'interval': 10}],
+                           'auto': [{'sensor': 'room', 'thresholds': {'low': 26, 'med': 29, 'high': 32}}]})
+            set_temperature(24)
+            sim.drive_sensors(hub)
+            sim.advance(minutes=5)
+            sim.assert_speed('off')
+            set_temperature(27)
+            sim.advance(minutes=5)
+            sim.assert_speed('low')
+            # Noise across the low threshold, inside the band: no flapping
+            for i in range(60):
+                set_temperature(26.4 if i % 2 else 25.2)
+                sim.advance(seconds=10)
+            sim.assert_speed('low')
+            set_temperature(33)
+            sim.advance(minutes=5)
+            sim.assert_speed('high')
+            os.remove(path)  # the sensor goes away: the speed holds
+            sim.advance(minutes=5)
+            sim.assert_speed('high')
+            set_temperature(20)
+            sim.advance(minutes=10)
+            sim.assert_speed('off')
+            sim.assert_no_overlap()
+
+    scenario("Safety timer turns the fan off after 6 hours", safety_timer)
+    scenario("4-hour user timer counts down and turns the fan off", user_timer)
+    scenario("Bouncy button presses advance one speed each", bouncy_buttons)
+    scenario("Lost interrupts switch the buttons to polling and back", lost_interrupts)
+    scenario("Auto mode follows a temperature file without flapping", sensor_auto_speed)
+
+
+if __name__ == '__main__':
+    run_examples()
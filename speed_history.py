@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+Speed history
+
+Every speed transition of every fan (time, fan, new speed and what caused
+it: web, button, timer, safety, cli, restore, schedule, sensor) is kept in a fixed-size ring
+buffer of numpy arrays, about 12 bytes per transition, so memory stays flat
+however long the process runs; the oldest transitions are overwritten first.
+
+timeline() downsamples one fan's history into fixed-width buckets for
+/api/history: the speed in effect at the end of each bucket, the cause of
+that speed, the number of transitions in the bucket and the fraction of the
+bucket spent at each speed. It works on whole arrays (searchsorted and
+cumulative sums over the transitions), not per record, so a query costs the
+same whether the buffer holds ten transitions or sixty thousand.
+"""
+
+import math
+import threading
+
+import numpy as np
+
+import fan_control
+
+# Transitions kept across all fans (the oldest are overwritten)
+HISTORY_SIZE = 65536
+
+# Buckets returned by a query without a step, and the most a step may ask for
+DEFAULT_BUCKETS = 288
+MAX_BUCKETS = 5000
+
+# Causes of a speed change; anything else is recorded as 'other'
+SOURCES = ('other', 'web', 'button', 'timer', 'safety', 'cli', 'restore', 'schedule', 'sensor')
+
+SPEEDS = tuple(fan_control.speed_states)
+
+
+class SpeedHistory:
+    """Ring buffer of speed transitions, fed by a fan registry listener."""
+
+    def __init__(self, size=HISTORY_SIZE):
+        self.size = size
+        self.times = np.zeros(size, dtype=np.float64)   # Unix time
+        self.fans = np.zeros(size, dtype=np.uint16)     # index into fan_ids
+        self.speeds = np.zeros(size, dtype=np.uint8)    # index into SPEEDS
+        self.sources = np.zeros(size, dtype=np.uint8)   # index into SOURCES
+        self.count = 0  # transitions ever recorded; the next goes in slot count % size
+
+        self.fan_ids = []
+        self._fan_index = {}
+        self._last_speed = {}  # fan_id -> last speed recorded
+        self._lock = threading.Lock()
+
+    def attach(self, registry):
+        """Record every speed transition of the fans in registry from now on."""
+        registry.add_listener(self.record)
+        for fan in registry:
+            self.record(fan)
+
+    def record(self, fan):
+        """Append fan's speed if it changed since the last record (registry listener)."""
+        current = fan.current  # speed and source from the same snapshot
+        speed = current.speed
+        if self._last_speed.get(fan.fan_id) == speed:
+            return  # a timer or countdown update, not a transition
+        source = current.source if current.source in SOURCES else 'other'
+        now = fan_control.clock.now().timestamp()
+        with self._lock:
+            if self._last_speed.get(fan.fan_id) == speed:
+                return
+            self._last_speed[fan.fan_id] = speed
+            fan_index = self._fan_index.get(fan.fan_id)
+            if fan_index is None:
+                fan_index = self._fan_index[fan.fan_id] = len(self.fan_ids)
+                self.fan_ids.append(fan.fan_id)
+            slot = self.count % self.size
+            self.times[slot] = now
+            self.fans[slot] = fan_index
+            self.speeds[slot] = SPEEDS.index(speed)
+            self.sources[slot] = SOURCES.index(source)
+            self.count += 1
+
+    def _transitions(self, fan_id):
+        # Copies of fan_id's (times, speeds, sources), oldest first
+        with self._lock:
+            fan_index = self._fan_index.get(fan_id)
+            if fan_index is None:
+                empty = np.zeros(0)
+                return empty, empty.astype(np.uint8), empty.astype(np.uint8)
+            if self.count <= self.size:
+                order = slice(0, self.count)
+                times, fans = self.times[order], self.fans[order]
+                speeds, sources = self.speeds[order], self.sources[order]
+            else:
+                # Full: the oldest transition is in the next slot to be written
+                split = self.count % self.size
+                times = np.concatenate((self.times[split:], self.times[:split]))
+                fans = np.concatenate((self.fans[split:], self.fans[:split]))
+                speeds = np.concatenate((self.speeds[split:], self.speeds[:split]))
+                sources = np.concatenate((self.sources[split:], self.sources[:split]))
+            mine = fans == fan_index
+            times, speeds, sources = times[mine], speeds[mine], sources[mine]
+        if len(times) > 1 and (np.diff(times) < 0).any():
+            # The wall clock stepped back (e.g. NTP at boot): searchsorted needs sorted times
+            order = np.argsort(times, kind='stable')
+            times, speeds, sources = times[order], speeds[order], sources[order]
+        return times, speeds, sources
+
+    def timeline(self, fan_id, start=None, end=None, step=None):
+        """Downsample fan_id's speed between start and end (Unix times) into step-second buckets.
+
+        end defaults to now, start to 24 hours before end and step to
+        (end - start) / DEFAULT_BUCKETS. Buckets before the fan's first
+        recorded transition have speed None and spend no time at any speed.
+        Raises ValueError for a bad range or too many buckets.
+        """
+        now = fan_control.clock.now().timestamp()
+        end = now if end is None else float(end)
+        start = end - 86400 if start is None else float(start)
+        if not (math.isfinite(start) and math.isfinite(end)) or end <= start:
+            raise ValueError("'from' must be before 'to'")
+        step = (end - start) / DEFAULT_BUCKETS if step is None else float(step)
+        if not math.isfinite(step) or step <= 0:
+            raise ValueError("'step' must be a positive number of seconds")
+        buckets = math.ceil((end - start) / step)
+        if buckets > MAX_BUCKETS:
+            raise ValueError(f"{buckets} buckets requested; at most {MAX_BUCKETS}, use a larger step")
+
+        times, speeds, sources = self._transitions(fan_id)
+        edges = start + step * np.arange(buckets + 1)
+
+        # Transition in effect at each edge (-1: before the first one)
+        current = np.searchsorted(times, edges, side='right') - 1
+        known = current >= 0
+        at = np.where(known, current, 0)
+        at_end = at[1:]
+
+        # Seconds spent at each speed up to every edge: the cumulative time up
+        # to the transition in effect, plus the time since it (up to now)
+        levels = np.arange(len(SPEEDS))
+        if len(times):
+            seen = np.zeros((len(times), len(SPEEDS)))
+            seen[1:] = np.cumsum(np.diff(times)[:, None] * (speeds[:-1, None] == levels), axis=0)
+            since = np.clip(np.minimum(edges, now) - times[at], 0, None)
+            spent = seen[at] + since[:, None] * (speeds[at][:, None] == levels)
+            spent[~known] = 0
+        else:
+            spent = np.zeros((len(edges), len(SPEEDS)))
+        occupancy = np.diff(spent, axis=0) / step
+
+        speed_names = np.array(SPEEDS + (None,), dtype=object)
+        source_names = np.array(SOURCES + (None,), dtype=object)
+        speed_at_end = np.where(known[1:], speeds[at_end] if len(times) else 0, len(SPEEDS))
+        source_at_end = np.where(known[1:], sources[at_end] if len(times) else 0, len(SOURCES))
+
+        return {
+            'fan': fan_id,
+            'from': start,
+            'to': end,
+            'step': step,
+            'time': edges[:-1].tolist(),
+            'speed': speed_names[speed_at_end].tolist(),
+            'source': source_names[source_at_end].tolist(),
+            'changes': np.diff(np.searchsorted(times, edges, side='left')).tolist(),
+            'occupancy': {speed: np.round(occupancy[:, i], 4).tolist() for i, speed in enumerate(SPEEDS)},
+        }
+
+    def buffer_info(self):
+        """Buffer size, transitions recorded and the time of the oldest one kept."""
+        with self._lock:
+            held = min(self.count, self.size)
+            oldest = self.times[self.count % self.size if self.count > self.size else 0] if held else None
+            return {'capacity': self.size, 'recorded': self.count, 'held': held,
+                    'oldest': float(oldest) if oldest is not None else None}
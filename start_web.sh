@@ -31,5 +31,5 @@ if [ ! -f ".requirements_installed" ]; then
     echo "✅ Requirements installed successfully!"
 fi
 
-# Start the web application
-python web_app.py
\ No newline at end of file
+# Start the web application (production server)
+python serve.py
\ No newline at end of file
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+State change broadcasting
+
+Every state mutation calls publish(), which only bumps a monotonically
+increasing version counter and wakes waiting clients. The serialized state
+is built lazily, at most once per version, and the same bytes are shared by
+every connected client and poller: the JSON text for event streams, and the
+encoded body and its gzip variant for /api/status.
+
+Clients see the version as a tag, "<boot id>-<version>", used for ETags,
+long-poll since= and event ids. The boot id is random per process, so a tag
+kept from before a restart never matches the restarted server's state.
+"""
+
+import asyncio
+import gzip
+import secrets
+import threading
+
+# Compression level of the cached gzip body: it is built once per state
+# change, so the best ratio costs nothing per request
+GZIP_LEVEL = 9
+
+
+class StateBroadcaster:
+    """Versioned state with a shared, lazily built payload."""
+
+    def __init__(self, build_payload):
+        # build_payload(tag) returns the serialized state as a str
+        self._build_payload = build_payload
+        self.boot_id = secrets.token_hex(4)
+        self._cond = threading.Condition()
+        self._build_lock = threading.RLock()
+        self.version = 0
+        self._cached_version = -1
+        self._cached_payload = None
+        self._cached_body = None
+        self._cached_gzip = None
+        # One asyncio.Event per event loop, shared by all of its waiters
+        self._loop_events = {}
+
+    def publish(self):
+        """Record a state change and wake every waiting client."""
+        with self._cond:
+            self.version += 1
+            self._cond.notify_all()
+            loop_events = list(self._loop_events.items())
+        for loop, event in loop_events:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # Loop has been closed
+                with self._cond:
+                    self._loop_events.pop(loop, None)
+
+    def tag(self, version):
+        """The client-facing tag of version."""
+        return f'{self.boot_id}-{version}'
+
+    def parse_tag(self, tag):
+        """The version in a tag from this process, or None (another boot, or not a tag)."""
+        boot_id, _, version = (tag or '').rpartition('-')
+        if boot_id != self.boot_id or not version.isdigit():
+            return None
+        return int(version)
+
+    def payload(self):
+        """Return (version, payload) for the current state."""
+        with self._build_lock:
+            self._refresh()
+            return self._cached_version, self._cached_payload
+
+    def body(self, gzipped=False):
+        """Return (version, bytes) of the current payload as UTF-8, or gzip-compressed."""
+        with self._build_lock:
+            self._refresh()
+            if not gzipped:
+                return self._cached_version, self._cached_body
+            if self._cached_gzip is None:
+                # mtime=0 keeps the bytes identical for identical state
+                self._cached_gzip = gzip.compress(self._cached_body, GZIP_LEVEL, mtime=0)
+            return self._cached_version, self._cached_gzip
+
+    def _refresh(self):
+        # Called with self._build_lock held: rebuild the cache if the version moved
+        version = self.version
+        if self._cached_version != version:
+            payload = self._build_payload(self.tag(version))
+            self._cached_version = version
+            self._cached_payload = payload
+            self._cached_body = payload.encode()
+            self._cached_gzip = None
+
+    def wait_for_change(self, since, timeout=None):
+        """Block until the version differs from since.
+
+        Returns True if it changed, False if the timeout expired first.
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: self.version != since, timeout)
+
+    async def wait_for_change_async(self, since, timeout=None):
+        """Asyncio version of wait_for_change; many waiters share one Event."""
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while self.version == since:
+            with self._cond:
+                event = self._loop_events.get(loop)
+                if event is None or event.is_set():
+                    event = self._loop_events[loop] = asyncio.Event()
+            if self.version != since:
+                break
+            remaining = None if deadline is None else deadline - loop.time()
+            if remaining is not None and remaining <= 0:
+                return False
+            try:
+                await asyncio.wait_for(event.wait(), remaining)
+            except asyncio.TimeoutError:
+                return self.version != since
+        return True
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Crash-safe fan state journal
+
+Every fan state change (speed, user timer, safety timer) is appended to a
+journal file as one JSON line holding the fan's whole state, with timer
+deadlines as absolute Unix times. On startup the last line of each fan is
+replayed, so a restart or power blip brings back the speed and the time
+left on its timers instead of dropping the fan.
+
+- Appends are cheap: the state listener only queues the record, and a
+  writer thread writes the newest record of each changed fan and fsyncs
+  once per FSYNC_INTERVAL, so a burst of changes costs one flash write.
+- A line cut short by a crash is ignored on load (with everything after it).
+- Once the journal holds COMPACT_AFTER records it is rewritten with one line
+  per fan: written to a temporary file, fsynced and renamed over the old one.
+
+Early boot: `python3 fan_control.py restore` (or serve.py, before it loads
+the web stack) drives the relays straight from the journal; the server then
+restores the timers from the same records.
+"""
+
+import json
+import os
+import threading
+import time
+
+from event_log import get_logger
+
+log = get_logger('fans')
+
+# Journal file (keep it on persistent storage, not a tmpfs)
+JOURNAL_PATH = os.environ.get(
+    'FAN_STATE_JOURNAL', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fan_state.journal'))
+
+# Longest a recorded change waits for its fsync (seconds)
+FSYNC_INTERVAL = 1.0
+
+# Records in the journal before it is compacted to one per fan
+COMPACT_AFTER = 500
+
+
+def load(path=None):
+    """Return {fan_id: last record} from the journal (empty if there is none)."""
+    return _read(path or JOURNAL_PATH)[0]
+
+
+def _read(path):
+    # Returns (records by fan, lines read, damaged)
+    records = {}
+    count = 0
+    try:
+        with open(path, 'rb') as f:
+            for line in f:
+                try:
+                    if not line.endswith(b'\n'):
+                        raise ValueError("incomplete line")
+                    record = json.loads(line)
+                    records[record['fan']] = record
+                    count += 1
+                except (ValueError, KeyError, TypeError):
+                    # Torn write from a crash: nothing after it was acknowledged
+                    log.warning("State journal %s: ignoring a damaged record and anything after it", path)
+                    return records, count, True
+    except FileNotFoundError:
+        pass
+    return records, count, False
+
+
+def is_expired(record, now):
+    """True if a deadline in record passed by now (Unix time): the fan should be off."""
+    return any(record.get(key) is not None and record[key] <= now for key in ('timer_end', 'safety_end'))
+
+
+class StateJournal:
+    """Appends fan state records and fsyncs them in batches on a writer thread."""
+
+    def __init__(self, path=None, fsync_interval=FSYNC_INTERVAL, compact_after=COMPACT_AFTER):
+        self.path = path or JOURNAL_PATH
+        self.fsync_interval = fsync_interval
+        self.compact_after = compact_after
+        self.latest, self._records, damaged = _read(self.path)  # latest: fan_id -> last record
+        self._pending = {}  # fan_id -> newest record not yet written
+        self._cond = threading.Condition()
+        self._file = None
+        self._thread = None
+        self._running = False
+
+        # Counters for diagnostics
+        self.stats = {
+            'recorded': 0,    # records queued
+            'unchanged': 0,   # notifications that changed nothing persistent
+            'fsyncs': 0,
+            'compactions': 0,
+        }
+
+        if damaged:
+            # Appending after a torn line would hide the new records
+            self.compact()
+
+    def restore(self, registry):
+        """Put every fan back in its journaled state (off if it has none).
+
+        Returns {fan_id: speed restored}.
+        """
+        restored = {}
+        for fan in registry:
+            record = self.latest.get(fan.fan_id)
+            if record is None:
+                fan.change_speed('off', 'restore')
+                restored[fan.fan_id] = 'off'
+            else:
+                restored[fan.fan_id] = fan.restore(record)
+        return restored
+
+    def attach(self, registry):
+        """Record every state change of the fans in registry from now on."""
+        registry.add_listener(self.record)
+        for fan in registry:
+            self.record(fan)
+
+    def record(self, fan):
+        """Queue fan's current state if it differs from the last record (registry listener)."""
+        record = fan.snapshot()
+        with self._cond:
+            if _persistent(self.latest.get(fan.fan_id)) == _persistent(record):
+                self.stats['unchanged'] += 1
+                return
+            self.latest[fan.fan_id] = record
+            # Only a fan's newest state matters: a burst of changes writes one line per fan
+            self._pending[fan.fan_id] = record
+            self.stats['recorded'] += 1
+            self._ensure_thread()
+            self._cond.notify()
+
+    def flush(self):
+        """Write and fsync everything queued so far, compacting if due."""
+        with self._cond:
+            pending, self._pending = list(self._pending.values()), {}
+        if not pending:
+            return
+        if self._file is None:
+            self._file = open(self.path, 'ab')
+        self._file.write(b''.join(json.dumps(record, separators=(',', ':')).encode() + b'\n'
+                                  for record in pending))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.stats['fsyncs'] += 1
+        self._records += len(pending)
+        if self._records >= self.compact_after:
+            self.compact()
+
+    def compact(self):
+        """Rewrite the journal with only the latest record of each fan."""
+        with self._cond:
+            records = list(self.latest.values())
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            for record in records:
+                f.write(json.dumps(record, separators=(',', ':')).encode() + b'\n')
+            f.flush()
+            os.fsync(f.fileno())
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        os.replace(tmp_path, self.path)
+        fsync_dir(self.path)
+        self._records = len(records)
+        self.stats['compactions'] += 1
+
+    def close(self):
+        """Stop the writer thread after writing out everything queued."""
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _ensure_thread(self):
+        # Called with self._cond held; the writer starts on first use
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='state-journal', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running and not self._pending:
+                    self._cond.wait()
+                # Let a burst of changes collect into one write and fsync
+                deadline = time.monotonic() + self.fsync_interval
+                while self._running and time.monotonic() < deadline:
+                    self._cond.wait(deadline - time.monotonic())
+                if not self._running:
+                    return  # close() writes out the rest
+            try:
+                self.flush()
+            except OSError as e:
+                log.error("State journal write failed: %s", e)
+
+
+def _persistent(record):
+    # Everything but the record time
+    return None if record is None else {key: value for key, value in record.items() if key != 'time'}
+
+
+def fsync_dir(path):
+    """fsync the directory holding path, so a rename into it is durable."""
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
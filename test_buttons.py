@@ -13,12 +13,14 @@ sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
 import fan_control
 
+fan_control.init()
+
 def test_button_simulation():
     """Test button functionality by simulating button presses"""
     print("=== Testing Button Functionality ===")
     print("Current state:")
-    print(f"Speed: {fan_control.speed_states[fan_control.current_speed_index]}")
-    print(f"Timer: {fan_control.timer_states[fan_control.current_timer_index]}")
+    print(f"Speed: {fan_control.speed_states[fan_control.default_fan.speed_index]}")
+    print(f"Timer: {fan_control.timer_states[fan_control.default_fan.timer_index]}")
     print()
 
     print("Simulating speed button presses...")
@@ -26,7 +28,7 @@ def test_button_simulation():
         print(f"\n--- Speed Button Press {i+1} ---")
         fan_control.GPIO.simulate_button_press(fan_control.SPEED_BUTTON_GPIO)
         time.sleep(0.6)  # Wait for debounce
-        print(f"Current speed: {fan_control.speed_states[fan_control.current_speed_index]}")
+        print(f"Current speed: {fan_control.speed_states[fan_control.default_fan.speed_index]}")
 
     print("\n" + "="*50)
     print("Simulating timer button presses...")
@@ -34,7 +36,7 @@ def test_button_simulation():
         print(f"\n--- Timer Button Press {i+1} ---")
         fan_control.GPIO.simulate_button_press(fan_control.TIMER_BUTTON_GPIO)
         time.sleep(0.6)  # Wait for debounce
-        print(f"Current timer: {fan_control.timer_states[fan_control.current_timer_index]}")
+        print(f"Current timer: {fan_control.timer_states[fan_control.default_fan.timer_index]}")
 
 if __name__ == "__main__":
     test_button_simulation()
\ No newline at end of file
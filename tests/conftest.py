@@ -0,0 +1,59 @@
+"""
+Shared fixtures: fans on the simulated GPIO and virtual clock (simulation.py).
+
+Every file the fan modules would touch (GPIO lock, control socket, state
+journal, usage totals, schedules, sensors) is pointed at a temporary
+directory before they are imported. The fan config there gives the web app
+(the web fixture) the same two fans as the registry fixture.
+"""
+
+import json
+import os
+import tempfile
+
+_tmp = tempfile.mkdtemp(prefix='fan_control-tests-')
+for _name, _file in (('FAN_GPIO_LOCK', 'gpio.lock'), ('FAN_SOCKET', 'control.sock'),
+                     ('FAN_STATE_JOURNAL', 'fan_state.journal'), ('FAN_USAGE_FILE', 'fan_usage.json'),
+                     ('FAN_SCHEDULES', 'schedules.json'), ('FAN_SENSORS', 'sensors.json'),
+                     ('FAN_CONFIG', 'fans.json')):
+    os.environ[_name] = os.path.join(_tmp, _file)
+os.environ.setdefault('FAN_LOG_LEVEL', 'WARNING')
+
+import pytest
+
+import fan_control
+from simulation import Simulation
+
+# Read on first use of fan_control.registry
+with open(os.environ['FAN_CONFIG'], 'w') as _f:
+    json.dump({'fans': [{'id': 'default', 'relays': fan_control.SPEED_PINS},
+                        {'id': 'attic', 'relays': {'low': 5, 'med': 6, 'high': 13}}]}, _f)
+
+
+@pytest.fixture
+def registry():
+    """Two fans without buttons: 'default' on the standard relays and 'attic'."""
+    fans = fan_control.FanRegistry()
+    fans.add(fan_control.FanController('default', fan_control.SPEED_PINS))
+    fans.add(fan_control.FanController('attic', {'low': 5, 'med': 6, 'high': 13}))
+    return fans
+
+
+@pytest.fixture
+def sim(registry):
+    simulation = Simulation(registry)
+    yield simulation
+    simulation.close()
+
+
+@pytest.fixture
+def fan(sim):
+    return sim.registry.default
+
+
+@pytest.fixture
+def web():
+    """Flask test client for web_app, on the process-wide fans (turned off afterwards)."""
+    import web_app
+    yield web_app.app.test_client()
+    web_app.fan_registry.apply_speeds({fan.fan_id: 'off' for fan in web_app.fan_registry})
@@ -0,0 +1,97 @@
+"""asyncio control core and ASGI front end."""
+
+import asyncio
+import threading
+
+import async_app
+from async_app import AsyncioScheduler
+
+
+def test_scheduler_counts_cancels_from_other_threads():
+    async def run():
+        scheduler = AsyncioScheduler(asyncio.get_running_loop())
+        calls = [scheduler.call_later(0.01, lambda: None) for _ in range(200)]
+        threads = [threading.Thread(target=call.cancel) for call in calls]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for call in calls:
+            call.cancel()
+        await asyncio.sleep(0.05)
+        return scheduler.pending()
+
+    assert asyncio.run(run()) == 0
+
+
+def test_scheduler_stop_cancels_pending_calls():
+    ran = []
+
+    async def run():
+        scheduler = AsyncioScheduler(asyncio.get_running_loop())
+        scheduler.call_later(0.01, ran.append, 'a')
+        scheduler.call_later(0.02, ran.append, 'b')
+        scheduler.stop()
+        await asyncio.sleep(0.05)
+        return scheduler.pending()
+
+    assert asyncio.run(run()) == 0
+    assert ran == []
+
+
+def test_event_stream_ends_when_the_client_disconnects():
+    state = {}
+
+    async def chunks():
+        try:
+            while True:
+                yield "data: {}\n\n"
+                await asyncio.sleep(0.01)
+        finally:
+            state['closed'] = True
+
+    async def run():
+        disconnected = asyncio.Event()
+        sent = []
+
+        async def receive():
+            if not sent:
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            await disconnected.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            # Like uvicorn after a disconnect: no error, nothing sent
+            sent.append(message)
+            if len(sent) == 4:
+                disconnected.set()
+
+        response = async_app.StreamingResponse(chunks(), 'text/event-stream')
+        await asyncio.wait_for(response(send, receive), 5)
+        return sent
+
+    sent = asyncio.run(run())
+    assert sent[0]['type'] == 'http.response.start'
+    assert state['closed']
+
+
+def test_lifespan_reports_a_failed_startup(monkeypatch):
+    def fail():
+        raise RuntimeError("Another process already owns the fan GPIO")
+    monkeypatch.setattr(async_app.core, 'start', fail)
+
+    async def run():
+        messages = iter([{'type': 'lifespan.startup'}])
+        sent = []
+
+        async def receive():
+            return next(messages)
+
+        async def send(message):
+            sent.append(message)
+
+        await asyncio.wait_for(async_app.app({'type': 'lifespan'}, receive, send), 5)
+        return sent
+
+    assert asyncio.run(run()) == [{'type': 'lifespan.startup.failed',
+                                   'message': "Another process already owns the fan GPIO"}]
@@ -0,0 +1,121 @@
+"""Control socket protocol and the CLI's thin-client fallback."""
+
+import fcntl
+import os
+import socket
+import subprocess
+import sys
+
+import pytest
+
+import control_daemon
+from control_daemon import ControlServer, send_command
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def server(sim, tmp_path):
+    server = ControlServer(sim.registry, str(tmp_path / 'control.sock'))
+    server.start()
+    yield server
+    server.stop()
+
+
+def run_cli(tmp_path, *args):
+    env = dict(os.environ, FAN_SOCKET=str(tmp_path / 'control.sock'), FAN_GPIO_LOCK=str(tmp_path / 'gpio.lock'))
+    return subprocess.run([sys.executable, os.path.join(REPO_DIR, 'fan_control.py'), *args],
+                          env=env, capture_output=True, text=True, timeout=30)
+
+
+def test_protocol(sim, server):
+    assert control_daemon.ping(server.path)
+    assert send_command('speed high', server.path)[0]
+    sim.assert_speed('high')
+    assert send_command('speed low attic', server.path)[0]
+    sim.assert_speed('low', 'attic')
+    assert send_command('timer 2', server.path) == (True, 'Timer set for 2 hours')
+    assert sim.registry.default.timer_state['active']
+    assert send_command('cancel', server.path) == (True, 'Timer cancelled')
+    assert not sim.registry.default.timer_state['active']
+
+    ok, reply = send_command('status attic', server.path)
+    assert ok and '"speed":"low"' in reply
+    assert send_command('speed turbo', server.path)[0] is False
+    assert send_command('speed high garage', server.path) == (False, 'Unknown fan: garage')
+    assert send_command('timer soon', server.path)[0] is False
+    assert send_command('reboot', server.path)[0] is False
+
+
+def test_timer_commands_match_the_web_api(sim, server):
+    fan = sim.registry.default
+    assert send_command('timer 3', server.path) == (False, 'Invalid timer duration. Must be 1, 2, or 4 hours')
+    assert not fan.timer_state['active']
+
+    # Like a web request, a timer command restarts the safety timer
+    fan.change_speed('low')
+    sim.advance(hours=5)
+    assert send_command('timer 1', server.path)[0]
+    assert fan.safety_timer_state['remaining_seconds'] == 6 * 3600
+    sim.advance(hours=1)
+    sim.assert_speed('off')
+
+
+def test_second_server_on_the_same_socket_fails(sim, server):
+    with pytest.raises(RuntimeError):
+        ControlServer(sim.registry, server.path).start()
+
+
+def test_cli_goes_through_the_daemon(sim, server, tmp_path):
+    result = run_cli(tmp_path, 'med')
+    assert result.returncode == 0, result.stdout
+    assert 'Set speed: med (daemon)' in result.stdout
+    sim.assert_speed('med')
+
+
+def test_cli_drives_the_relays_without_a_daemon(tmp_path):
+    result = run_cli(tmp_path, 'high')
+    assert result.returncode == 0, result.stdout
+    assert 'Set speed: high' in result.stdout and '(daemon)' not in result.stdout
+
+
+def test_cli_falls_back_after_a_stale_socket(tmp_path):
+    stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    stale.bind(str(tmp_path / 'control.sock'))
+    stale.close()  # the file stays, nothing listens: ConnectionRefusedError
+    result = run_cli(tmp_path, 'low')
+    assert result.returncode == 0, result.stdout
+    assert 'Set speed: low' in result.stdout
+
+
+def test_cli_refuses_when_the_gpio_lock_is_held(tmp_path):
+    # e.g. serve.py still restoring state before it opens the socket
+    with open(tmp_path / 'gpio.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        result = run_cli(tmp_path, 'high')
+    assert result.returncode == 1
+    assert 'Another process already owns the fan GPIO' in result.stdout
+
+
+def test_cli_status_needs_a_daemon(tmp_path):
+    result = run_cli(tmp_path, 'status')
+    assert result.returncode == 1
+    assert 'No fan control daemon running' in result.stdout
+
+
+@pytest.mark.parametrize('error', [PermissionError(13, 'Permission denied'), TimeoutError('timed out')])
+def test_client_exits_on_other_socket_errors(monkeypatch, capsys, error):
+    def fail(line, path=None, timeout=None):
+        raise error
+    monkeypatch.setattr(control_daemon, 'send_command', fail)
+    with pytest.raises(SystemExit) as exit_info:
+        control_daemon.client_main('high')
+    assert exit_info.value.code == 1
+    assert 'did not answer' in capsys.readouterr().out
+
+
+def test_client_returns_when_no_daemon_listens(monkeypatch):
+    def missing(line, path=None, timeout=None):
+        raise FileNotFoundError(2, 'No such file or directory')
+    monkeypatch.setattr(control_daemon, 'send_command', missing)
+    assert control_daemon.client_main('high') is None
@@ -0,0 +1,71 @@
+"""Structured logging: the ring buffer and the background writer."""
+
+import logging
+import threading
+
+import pytest
+
+import event_log
+from event_log import RingBufferHandler, get_logger
+
+
+def make_record(name, level, message, **fields):
+    record = logging.LogRecord(name, level, __file__, 1, message, (), None)
+    record.__dict__.update(fields)
+    return record
+
+
+def test_ring_buffer_keeps_the_newest_records_with_their_fields():
+    buffer = RingBufferHandler(capacity=3)
+    for i in range(5):
+        buffer.handle(make_record('fan_control.fans', logging.INFO, f'change {i}', fan='attic', speed='low'))
+    records = buffer.recent()
+    assert [entry['message'] for entry in records] == ['change 2', 'change 3', 'change 4']
+    assert [entry['seq'] for entry in records] == [3, 4, 5]
+    assert records[-1]['fields'] == {'fan': 'attic', 'speed': 'low'}
+
+
+def test_ring_buffer_filters():
+    buffer = RingBufferHandler()
+    buffer.handle(make_record('fan_control.buttons', logging.DEBUG, 'edge'))
+    buffer.handle(make_record('fan_control.timers', logging.WARNING, 'safety'))
+    buffer.handle(make_record('fan_control.buttons', logging.INFO, 'press'))
+    assert [e['message'] for e in buffer.recent(level='info')] == ['safety', 'press']
+    assert [e['message'] for e in buffer.recent(logger='fan_control.buttons')] == ['edge', 'press']
+    assert [e['message'] for e in buffer.recent(since=2)] == ['press']
+    assert [e['message'] for e in buffer.recent(limit=1)] == ['press']
+    assert 'fields' not in buffer.recent()[0]
+    with pytest.raises(ValueError):
+        buffer.recent(level='loud')
+
+
+def test_records_are_written_on_the_background_thread(monkeypatch):
+    class Stream:
+        def __init__(self):
+            self.lines = []
+
+        def write(self, text):
+            self.lines.append((threading.current_thread().name, text))
+
+        def flush(self):
+            pass
+
+    stream = Stream()
+    monkeypatch.setattr(event_log, 'ring_buffer', RingBufferHandler())
+    event_log.setup_logging('INFO', stream)
+    try:
+        get_logger('fans').info("Fan '%s' speed set to %s", 'attic', 'med', extra={'fan': 'attic'})
+    finally:
+        event_log.stop_logging()
+        logging.getLogger(event_log.ROOT_LOGGER).setLevel(event_log.LOG_LEVEL)
+
+    written = [(thread, text) for thread, text in stream.lines if 'speed set' in text]
+    assert len(written) == 1 and written[0][0] != threading.current_thread().name
+    assert "fan_control.fans: Fan 'attic' speed set to med" in written[0][1]
+    assert event_log.ring_buffer.recent()[-1]['fields'] == {'fan': 'attic'}
+
+
+def test_debug_log_route(web):
+    assert web.get('/api/debug/log?limit=5').get_json()['capacity'] == event_log.RING_BUFFER_SIZE
+    response = web.get('/api/debug/log?level=loud')
+    assert response.status_code == 400 and 'error' in response.get_json()
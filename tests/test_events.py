@@ -0,0 +1,44 @@
+"""Server-Sent Events stream on /api/events."""
+
+import json
+
+
+def read_event(stream):
+    """The next event of an /api/events stream: (id, data)."""
+    fields = dict(line.split(': ', 1) for line in next(stream).decode().strip().splitlines())
+    return fields['id'], json.loads(fields['data'])
+
+
+def test_stream_pushes_every_state_change(web):
+    response = web.get('/api/events', buffered=False)
+    assert response.mimetype == 'text/event-stream'
+    assert response.headers['Cache-Control'] == 'no-cache'
+    stream = iter(response.response)
+    try:
+        first_id, status = read_event(stream)
+        assert status['current_state']['speed'] == 'off'
+        assert status['version'] == first_id
+
+        web.post('/api/set_speed', json={'speed': 'med'})
+        event_id, status = read_event(stream)
+        assert status['current_state']['speed'] == 'med'
+        assert event_id != first_id
+        assert status['safety_timer_state']['active']
+    finally:
+        response.close()
+
+
+def test_streams_beyond_the_limit_are_refused(web, monkeypatch):
+    import web_app
+    monkeypatch.setattr(web_app, 'max_waiting_requests', 1)
+    first = web.get('/api/events', buffered=False)
+    try:
+        refused = web.get('/api/events')
+        assert refused.status_code == 503
+        assert 'error' in refused.get_json()
+    finally:
+        first.close()
+    # Closing the stream frees its slot
+    second = web.get('/api/events', buffered=False)
+    assert second.status_code == 200
+    second.close()
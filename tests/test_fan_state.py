@@ -0,0 +1,68 @@
+"""Fan state snapshots and the notifications sent when they change."""
+
+import pytest
+
+
+@pytest.fixture
+def notified(sim):
+    """Fan ids in the order the registry reported their changes."""
+    fans = []
+    sim.registry.add_listener(lambda fan: fans.append(fan.fan_id))
+    return fans
+
+
+def test_state_is_replaced_not_modified(sim, fan):
+    before = fan.current
+    fan.change_speed('high')
+    assert before.speed == 'off' and before.safety_end is None
+    assert fan.current is not before
+    assert fan.current.speed == 'high' and fan.current.safety_end is not None
+
+
+@pytest.mark.parametrize('speed', ['high', 'off'])
+def test_speed_change_notifies_once(sim, fan, notified, speed):
+    fan.change_speed('low')
+    fan.set_timer(1)
+    notified.clear()
+    fan.change_speed(speed)
+    assert notified == ['default']
+
+
+@pytest.mark.parametrize('command', [
+    lambda fan: fan.set_timer(2),
+    lambda fan: fan.apply_timer(1),
+    lambda fan: fan.apply_timer(0),
+    lambda fan: fan.cycle_timer(),
+    lambda fan: fan.cycle_speed(),
+])
+def test_timer_and_cycle_commands_notify_once(sim, fan, notified, command):
+    fan.change_speed('med')
+    notified.clear()
+    command(fan)
+    assert notified == ['default']
+
+
+def test_expiries_notify_once(sim, fan, notified):
+    # Armed off the minute, so no countdown tick falls on the expiry
+    fan.change_speed('med')
+    sim.advance(seconds=30)
+    fan.set_timer(1)
+    sim.advance(hours=1, seconds=-1)
+    notified.clear()
+    sim.advance(seconds=1)
+    sim.assert_speed('off')
+    assert notified == ['default']
+
+    fan.change_speed('high')
+    sim.advance(seconds=20)
+    fan.change_speed('high')
+    sim.advance(hours=6, seconds=-1)
+    notified.clear()
+    sim.advance(seconds=1)
+    sim.assert_speed('off')
+    assert notified == ['default']
+
+
+def test_bulk_change_notifies_each_fan_once(sim, notified):
+    sim.registry.apply_speeds({'default': 'high', 'attic': 'low'})
+    assert sorted(notified) == ['attic', 'default']
@@ -0,0 +1,104 @@
+"""Hardware owner command queue: coalescing and deadlines."""
+
+import threading
+import time
+
+import pytest
+
+from hardware_owner import HardwareOwner, HardwareTimeout, hardware_owner
+
+
+def block(owner):
+    """Occupy owner's thread until the returned event is set."""
+    release = threading.Event()
+    started = threading.Event()
+
+    def blocker():
+        started.set()
+        release.wait(5)
+
+    owner.submit(blocker)
+    assert started.wait(5)
+    return release
+
+
+def wait_queued(owner, count):
+    deadline = time.monotonic() + 5
+    while len(owner._queue) < count:
+        assert time.monotonic() < deadline, "commands were not queued"
+        time.sleep(0.001)
+
+
+def test_same_key_collapses_to_the_newest():
+    owner = HardwareOwner(name='test-owner')
+    release = block(owner)
+    ran = []
+    first = owner.submit(ran.append, 1, key='speed')
+    second = owner.submit(ran.append, 2, key='speed')
+    other = owner.submit(ran.append, 3, key='timer')
+    release.set()
+
+    assert second.result(5) is None and first.result(5) is None
+    other.result(5)
+    assert ran == [2, 3]
+    assert owner.stats['coalesced'] == 1
+    owner.stop()
+
+
+def test_command_past_its_deadline_fails():
+    owner = HardwareOwner(name='test-owner')
+    release = block(owner)
+    future = owner.submit(lambda: 'ran', timeout=0.01)
+    time.sleep(0.05)
+    release.set()
+
+    with pytest.raises(HardwareTimeout):
+        future.result(5)
+    assert owner.stats['expired'] == 1
+    owner.stop()
+
+
+def test_caller_stops_waiting_at_the_deadline():
+    owner = HardwareOwner(name='test-owner')
+    release = block(owner)
+    with pytest.raises(HardwareTimeout):
+        owner.call(lambda: None, timeout=0.05)
+    release.set()
+    owner.stop()
+
+
+def test_set_and_cancel_timer_do_not_coalesce(sim, fan):
+    fan.change_speed('low')
+    results = {}
+
+    def run(name, method, *args):
+        results[name] = method(*args)
+
+    release = block(hardware_owner)
+    setter = threading.Thread(target=run, args=('set', fan.set_timer, 2))
+    setter.start()
+    wait_queued(hardware_owner, 1)
+    canceller = threading.Thread(target=run, args=('cancel', fan.cancel_timer))
+    canceller.start()
+    wait_queued(hardware_owner, 2)
+    release.set()
+    setter.join(5)
+    canceller.join(5)
+
+    assert results == {'set': (True, 'Timer set for 2 hours'), 'cancel': None}
+    assert not fan.timer_state['active']
+
+
+def test_timer_expiry_is_not_dropped_by_a_stalled_owner(sim, fan, monkeypatch):
+    monkeypatch.setattr(hardware_owner, 'timeout', 0.05)
+    fan.change_speed('high')
+    expired = hardware_owner.stats['expired']
+
+    release = block(hardware_owner)
+    sim.advance(hours=6)  # the safety expiry's caller gives up after 0.05 s
+    time.sleep(0.2)       # well past the command's deadline
+    release.set()
+    hardware_owner.call(lambda: None, timeout=5)
+
+    sim.assert_speed('off')
+    assert hardware_owner.stats['expired'] == expired
@@ -0,0 +1,60 @@
+"""Bounded button event queue: collapsing, dropping and the consumer pool."""
+
+import threading
+
+from input_events import InputEventQueue
+
+
+def test_presses_of_a_queued_button_collapse():
+    handled = []
+    events = InputEventQueue(handled.append, consumers=0)
+    for _ in range(5):
+        assert events.push(16, 'speed')
+    events.push(19, 'timer')
+    assert events.pending() == 2
+    assert events.drain() == 2
+    assert [(event.pin, event.presses) for event in handled] == [(16, 5), (19, 1)]
+    assert events.stats['collapsed'] == 4 and events.stats['handled'] == 2
+
+    # Once handled, the next press queues a new event
+    events.push(16, 'speed')
+    assert events.pending() == 1
+
+
+def test_a_full_queue_drops_new_buttons_but_still_collapses():
+    events = InputEventQueue(lambda event: None, maxsize=2, consumers=0)
+    assert events.push(1, 'speed') and events.push(2, 'speed')
+    assert not events.push(3, 'speed')
+    assert events.push(1, 'speed')
+    assert events.stats == {**events.stats, 'pushed': 4, 'dropped': 1, 'collapsed': 1}
+
+
+def test_a_failing_handler_is_counted_and_the_queue_goes_on():
+    def handler(event):
+        if event.pin == 1:
+            raise RuntimeError('boom')
+    events = InputEventQueue(handler, consumers=0)
+    events.push(1, 'speed')
+    events.push(2, 'speed')
+    assert events.drain() == 2
+    assert events.stats['failed'] == 1 and events.stats['handled'] == 1
+
+
+def test_consumer_threads_run_the_handlers():
+    done = threading.Event()
+    threads = []
+
+    def handler(event):
+        threads.append(threading.current_thread().name)
+        done.set()
+    events = InputEventQueue(handler, consumers=1, name='test-events')
+    events.push(16, 'speed')
+    assert done.wait(5)
+    events.stop()
+    assert threads == ['test-events-0']
+
+
+def test_collapsed_presses_make_one_relay_transition(sim, registry):
+    attic = registry.get('attic')
+    attic.on_speed_button(5).result()
+    sim.assert_speeds(['off', 'low'], attic)
@@ -0,0 +1,61 @@
+"""Prometheus metrics: series, text rendering and the /metrics route."""
+
+import re
+
+import pytest
+
+import metrics
+
+
+@pytest.fixture
+def registered(monkeypatch):
+    """Keep metrics made by a test out of the process-wide /metrics output."""
+    monkeypatch.setattr(metrics, '_metrics', [])
+    monkeypatch.setattr(metrics, '_collectors', [])
+
+
+def test_counter_and_gauge_render(registered):
+    presses = metrics.Counter('test_presses_total', "Presses", ('pin',))
+    presses.add(16, pin=16).inc()
+    presses[16].inc(2)
+    mode = metrics.Gauge('test_mode', "Mode")
+    metrics.add_collector(lambda: mode[None].set(1))
+    assert metrics.render() == (
+        '# HELP test_presses_total Presses\n'
+        '# TYPE test_presses_total counter\n'
+        'test_presses_total{pin="16"} 3\n'
+        '# HELP test_mode Mode\n'
+        '# TYPE test_mode gauge\n'
+        'test_mode 1\n')
+
+
+def test_histogram_buckets_are_cumulative(registered):
+    latency = metrics.Histogram('test_seconds', "Latency", ('route',), buckets=(0.1, 0.01))
+    series = latency.add('/', route='/')
+    for value in (0.005, 0.01, 0.05, 3.0):
+        series.observe(value)
+    lines = metrics.render().splitlines()
+    assert lines[2:] == [
+        'test_seconds_bucket{route="/",le="0.01"} 2',
+        'test_seconds_bucket{route="/",le="0.1"} 3',
+        'test_seconds_bucket{route="/",le="+Inf"} 4',
+        'test_seconds_sum{route="/"} 3.065',
+        'test_seconds_count{route="/"} 4',
+    ]
+
+
+def test_label_values_are_escaped(registered):
+    counter = metrics.Counter('test_total', "Escaping", ('name',))
+    counter.add(1, name='a "b"\\c\nd')
+    assert metrics.render().splitlines()[-1] == 'test_total{name="a \\"b\\"\\\\c\\nd"} 0'
+
+
+def test_metrics_route(web):
+    web.post('/api/fans/attic/set_speed', json={'speed': 'high'})
+    response = web.get('/metrics')
+    assert response.content_type == metrics.CONTENT_TYPE
+    text = response.get_data(as_text=True)
+    assert re.search(r'^fan_relay_transitions_total\{fan="attic",speed="high"\} [1-9]', text, re.M)
+    assert metrics.http_request_seconds['api_fan_set_speed'].count >= 1
+    assert 'fan_http_request_duration_seconds_count{route="unmatched"}' in text
+    assert 'fan_timers_active{fan="attic",timer="safety"} 1' in text
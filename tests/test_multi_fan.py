@@ -0,0 +1,64 @@
+"""Several fans in one process: the registry and the /api/fans routes."""
+
+import pytest
+
+
+def test_bulk_speed_writes_every_fan_in_one_pass(sim, registry):
+    results = registry.apply_speeds({'default': 'high', 'attic': 'low', 'garage': 'low', 'attic2': 'fast'})
+    assert results['default'][0] and results['attic'][0]
+    assert results['garage'] == (False, 'Unknown fan: garage')
+    assert not results['attic2'][0]
+    sim.assert_speed('high', registry.default)
+    sim.assert_speed('low', registry.get('attic'))
+    sim.assert_no_overlap()
+
+
+def test_fans_status_lists_every_fan(web):
+    response = web.get('/api/fans')
+    assert sorted(response.get_json()['fans']) == ['attic', 'default']
+    assert web.get('/api/fans', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+
+def test_single_fan_routes(web):
+    response = web.post('/api/fans/attic/set_speed', json={'speed': 'med'})
+    assert response.status_code == 200
+    assert web.get('/api/fans/attic/status').get_json()['current_state']['speed'] == 'med'
+    assert web.get('/api/fans/default/status').get_json()['current_state']['speed'] == 'off'
+
+    assert web.post('/api/fans/attic/set_timer', json={'hours': 2}).get_json()['success']
+    assert web.get('/api/fans/attic/status').get_json()['timer_state']['duration_hours'] == 2
+    assert web.post('/api/fans/attic/cycle_speed').get_json()['speed'] == 'high'
+
+    assert web.get('/api/fans/garage/status').status_code == 404
+    assert web.post('/api/fans/garage/set_speed', json={'speed': 'low'}).status_code == 404
+
+
+def test_bulk_route_sets_the_listed_fans(web):
+    response = web.post('/api/fans/set_speed', json={'speed': 'low', 'fans': ['attic']})
+    assert response.status_code == 200
+    assert response.get_json()['fans'] == {'attic': response.get_json()['fans']['attic']}
+    assert web.get('/api/fans').get_json()['fans']['default']['current_state']['speed'] == 'off'
+
+    response = web.post('/api/fans/set_speed', json={'speed': 'high'})
+    assert sorted(response.get_json()['results']) == ['attic', 'default']
+
+    response = web.post('/api/fans/set_speed', json={'commands': {'default': 'med', 'attic': 'off'}})
+    speeds = {fan_id: state['speed'] for fan_id, state in response.get_json()['fans'].items()}
+    assert speeds == {'default': 'med', 'attic': 'off'}
+
+
+@pytest.mark.parametrize('body, error', [
+    ({'speed': 'low', 'fans': 'attic'}, 'fans must be a list of fan ids'),
+    ({'speed': 'low', 'fans': {'attic': 1}}, 'fans must be a list of fan ids'),
+    ({'speed': 'low', 'fans': [1]}, 'fans must be a list of fan ids'),
+    ({'speed': 'low', 'fans': ['attic', 'garage']}, 'Unknown fan: garage'),
+    ({'commands': ['attic']}, 'commands must map fan ids to speeds'),
+    ({}, 'Speed or commands parameter required'),
+    (['attic'], 'Speed or commands parameter required'),
+])
+def test_bulk_route_rejects_a_malformed_request(web, body, error):
+    response = web.post('/api/fans/set_speed', json=body)
+    assert response.status_code == 400
+    assert response.get_json() == {'error': error}
+    # Nothing was switched
+    assert {fan['current_state']['speed'] for fan in web.get('/api/fans').get_json()['fans'].values()} == {'off'}
@@ -0,0 +1,110 @@
+"""Shadow-register relay driver: skipped writes and break-before-make."""
+
+import pytest
+
+from relay_driver import RelayDriver
+
+HIGH, LOW = 1, 0
+
+
+class RecordingGPIO:
+    """Records every output call, with the fake time it was made at."""
+
+    OUT = 'out'
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.calls = []
+        self.pins = {}
+
+    def setup(self, pin, mode):
+        self.pins.setdefault(pin, LOW)
+
+    def input(self, pin):
+        return self.pins[pin]
+
+    def output(self, pins, levels):
+        if isinstance(pins, int):
+            pins, levels = [pins], [levels]
+        self.pins.update(zip(pins, levels))
+        self.calls.append((self.clock.now, dict(zip(pins, levels))))
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def gpio(clock):
+    return RecordingGPIO(clock)
+
+
+@pytest.fixture
+def driver(gpio, clock):
+    driver = RelayDriver(gpio, HIGH, LOW, dead_time=0.05, clock=clock, sleep=clock.sleep)
+    for pin in (1, 2, 3):
+        driver.claim(pin, LOW)
+    gpio.calls.clear()
+    return driver
+
+
+def test_unchanged_levels_are_not_written(driver, gpio):
+    assert driver.apply({1: HIGH, 2: LOW, 3: LOW}) == 1
+    assert driver.apply({1: HIGH, 2: LOW, 3: LOW}) == 0
+    assert gpio.calls == [(0.0, {1: HIGH})]
+    assert driver.stats['transitions'] == 1 and driver.stats['skipped'] == 1
+
+
+def test_break_comes_a_dead_time_before_make(driver, gpio, clock):
+    driver.apply({1: HIGH, 2: LOW, 3: LOW})
+    gpio.calls.clear()
+    driver.apply({1: LOW, 2: HIGH, 3: LOW})
+    assert gpio.calls == [(0.0, {1: LOW}), (0.05, {2: HIGH})]
+    assert driver.stats['last_dead_time'] == pytest.approx(0.05)
+
+
+def test_time_already_spent_counts_towards_the_dead_time(gpio, clock):
+    def slow_clock():
+        clock.now += 0.03
+        return clock.now
+    sleeps = []
+    driver = RelayDriver(gpio, HIGH, LOW, dead_time=0.05, clock=slow_clock, sleep=sleeps.append)
+    driver.claim(1, HIGH)
+    driver.claim(2, LOW)
+    driver.apply({1: LOW, 2: HIGH})
+    # 0.03 s passed between the release and the dead time check
+    assert sleeps == [pytest.approx(0.02)]
+
+
+def test_several_pins_go_in_one_call_per_phase(driver, gpio):
+    driver.apply({1: HIGH, 2: HIGH})
+    assert len(gpio.calls) == 1
+    gpio.calls.clear()
+    driver.apply({1: LOW, 2: LOW, 3: HIGH})
+    assert [levels for _, levels in gpio.calls] == [{1: LOW, 2: LOW}, {3: HIGH}]
+
+
+def test_claim_without_a_level_keeps_the_relay_on(gpio, clock):
+    gpio.pins[4] = HIGH
+    driver = RelayDriver(gpio, HIGH, LOW, clock=clock, sleep=clock.sleep)
+    driver.claim(4)
+    assert driver.level(4) == HIGH and gpio.calls == []
+    assert driver.apply({4: HIGH}) == 0
+
+
+def test_fans_never_run_two_speeds_at_once(sim, fan):
+    for speed in ('low', 'high', 'med', 'off', 'high', 'low'):
+        fan.change_speed(speed)
+    sim.assert_no_overlap()
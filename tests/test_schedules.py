@@ -0,0 +1,67 @@
+"""Schedules: request parsing and firing on the virtual clock."""
+
+from datetime import datetime, time
+
+import pytest
+
+from schedules import Schedule, ScheduleBook, parse_schedule
+
+
+def test_parse_accepts_weekday_names_and_groups(registry):
+    schedule = parse_schedule({'speed': 'low', 'time': '22:00', 'days': ['Monday', 'tue']}, registry, 1)
+    assert schedule.to_dict()['days'] == ['mon', 'tue']
+    schedule = parse_schedule({'speed': 'off', 'time': '06:30', 'days': 'weekends'}, registry, 2)
+    assert schedule.to_dict()['days'] == ['sat', 'sun']
+    assert schedule.fan == 'default'
+
+
+@pytest.mark.parametrize('data', [
+    {'speed': 'low', 'time': '22:00', 'days': ['monkey']},
+    {'speed': 'low', 'time': '22:00', 'days': 'Tuesdayyy'},
+    {'speed': 'low', 'time': '22:00', 'days': []},
+    {'speed': 'low', 'time': '24:00'},
+    {'speed': 'turbo', 'time': '22:00'},
+    {'speed': 'low', 'time': '22:00', 'fan': 'garage'},
+    {'speed': 'low', 'time': '22:00', 'fan': ['default']},
+    {'speed': 'low', 'time': '22:00', 'enabled': 'yes'},
+    ['not', 'an', 'object'],
+])
+def test_parse_rejects_bad_requests(registry, data):
+    with pytest.raises(ValueError):
+        parse_schedule(data, registry, 1)
+
+
+def test_schedules_fire_on_their_days(sim, registry, tmp_path):
+    def apply(schedule):
+        return registry.get(schedule.fan).change_speed(schedule.speed, 'schedule')
+
+    # The virtual clock starts at midnight on Monday 2024-01-01
+    book = ScheduleBook(registry, apply, path=str(tmp_path / 'schedules.json'))
+    book.start()
+    book.create({'speed': 'low', 'time': '22:00', 'days': 'weekdays'})
+    book.create({'speed': 'off', 'time': '06:00', 'days': 'daily'})
+    book.create({'fan': 'attic', 'speed': 'high', 'time': '12:00', 'enabled': False})
+
+    sim.advance(hours=22)
+    sim.assert_speed('low')
+    sim.advance(hours=8)
+    sim.assert_speed('off')
+    sim.advance(hours=5 * 24)
+    # Up to Sunday 06:00: 22:00 Monday to Friday, 06:00 every day, the attic never
+    assert book.stats['fired'] == 5 + 7
+    sim.assert_speed('off', 'attic')
+
+    # Reloaded from the file by a new book
+    reloaded = ScheduleBook(registry, apply, path=str(tmp_path / 'schedules.json'))
+    reloaded.start()
+    assert [schedule['id'] for schedule in reloaded.list()] == [1, 2, 3]
+    assert reloaded.pending() == 2
+    book.stop()
+    reloaded.stop()
+
+
+def test_schedule_runs_daily_by_default():
+    schedule = Schedule(1, 'default', 'low', time(22, 0))
+    monday = datetime(2024, 1, 1, 23, 0)
+    assert schedule.next_after(monday) == datetime(2024, 1, 2, 22, 0)
+    assert schedule.to_dict()['days'] == ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
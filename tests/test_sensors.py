@@ -0,0 +1,112 @@
+"""Sensor filtering and auto mode, driven from plain files on the virtual clock."""
+
+import os
+
+import numpy as np
+import pytest
+
+from sensors import SensorHub, hysteresis, moving_average, read_sysfs
+
+
+@pytest.fixture
+def temperature(tmp_path):
+    """Set the simulated room temperature (thermal zone format: millidegrees)."""
+    path = tmp_path / 'temp'
+
+    def set_temperature(celsius):
+        path.write_text(f"{round(celsius * 1000)}\n")
+    set_temperature.path = str(path)
+    return set_temperature
+
+
+@pytest.fixture
+def hub(sim, temperature):
+    hub = SensorHub(sim.registry)
+    hub.configure({'sensors': [{'id': 'room', 'path': temperature.path, 'interval': 10}],
+                   'auto': [{'sensor': 'room', 'thresholds': {'low': 26, 'med': 29, 'high': 32}}]})
+    return hub
+
+
+def test_read_sysfs_formats(tmp_path):
+    w1 = tmp_path / 'w1_slave'
+    w1.write_text("72 01 4b 46 7f ff 0e 10 57 : crc=57 YES\n72 01 4b 46 7f ff 0e 10 57 t=23125\n")
+    assert read_sysfs(str(w1)) == pytest.approx(23.125)
+    w1.write_text("72 01 4b 46 7f ff 0e 10 57 : crc=57 NO\n72 01 4b 46 7f ff 0e 10 57 t=23125\n")
+    with pytest.raises(ValueError):
+        read_sysfs(str(w1))
+
+
+def test_moving_average_skips_failed_reads():
+    values = np.array([np.nan, 2.0, 4.0, np.nan, 6.0])
+    assert moving_average(values, 2)[1:].tolist() == [2.0, 3.0, 4.0, 6.0]
+    assert np.isnan(moving_average(values, 2)[0])
+
+
+def test_hysteresis_holds_inside_the_band():
+    levels = hysteresis([25.0, 26.0, 25.5, 25.1, 24.9, 30.0], [26.0, 29.0], 1.0)
+    assert levels.tolist() == [0, 1, 1, 1, 0, 2]
+
+
+def test_auto_mode_follows_the_sensor_without_flapping(sim, hub, temperature):
+    temperature(24)
+    sim.drive_sensors(hub)
+    sim.advance(minutes=5)
+    sim.assert_speed('off')
+    temperature(27)
+    sim.advance(minutes=5)
+    sim.assert_speed('low')
+
+    # Noise across the low threshold, inside the band
+    for i in range(60):
+        temperature(26.4 if i % 2 else 25.2)
+        sim.advance(seconds=10)
+    sim.assert_speed('low')
+    sim.assert_speeds(['off', 'low'])
+
+    temperature(33)
+    sim.advance(minutes=5)
+    sim.assert_speed('high')
+    sim.assert_no_overlap()
+
+
+def test_missing_sensor_holds_the_speed(sim, hub, temperature):
+    temperature(30)
+    sim.drive_sensors(hub)
+    sim.advance(minutes=5)
+    sim.assert_speed('med')
+    os.remove(temperature.path)  # the sensor goes away
+    sim.advance(minutes=10)
+    sim.assert_speed('med')
+    assert hub.status()['auto']['default']['smoothed'] is None
+
+
+def test_failed_speed_change_is_retried(sim, hub, temperature, monkeypatch):
+    fan = sim.registry.default
+    monkeypatch.setattr(fan, 'change_speed', lambda speed, source=None: (False, 'relay fault'))
+    temperature(27)
+    sim.drive_sensors(hub)
+    sim.advance(minutes=5)
+    assert hub.auto['default'].level == 0
+
+    monkeypatch.undo()
+    sim.advance(minutes=5)
+    sim.assert_speed('low')
+    assert hub.auto['default'].level == 1
+
+
+def test_sampling_late_does_not_catch_up_back_to_back(hub, temperature):
+    temperature(24)
+    room = hub.sensors['room']
+    start = room.next_due
+    hub.step(start)
+    assert room.stats['samples'] == 1 and room.next_due == start + 10
+
+    # A step that comes 2.5 intervals late takes one sample, then waits a whole interval
+    hub.step(start + 35)
+    assert room.stats['samples'] == 2 and room.next_due == start + 45
+    hub.step(start + 40)
+    assert room.stats['samples'] == 2
+
+    # A little late keeps the grid
+    hub.step(start + 47)
+    assert room.stats['samples'] == 3 and room.next_due == start + 55
@@ -0,0 +1,86 @@
+"""Speed history ring buffer and its downsampled timeline."""
+
+import pytest
+
+import fan_control
+from speed_history import MAX_BUCKETS, SpeedHistory
+
+
+@pytest.fixture
+def history(sim):
+    history = SpeedHistory()
+    history.attach(sim.registry)
+    return history
+
+
+def test_timeline_buckets(sim, fan, history):
+    start = fan_control.clock.now().timestamp()
+    sim.advance(minutes=5)
+    fan.change_speed('low', 'web')
+    sim.advance(minutes=20)
+    fan.change_speed('high', 'button')
+    sim.advance(minutes=10)
+    fan.change_speed('off', 'web')
+    sim.advance(minutes=25)
+
+    timeline = history.timeline('default', start, start + 3600, 600)
+    assert timeline['time'] == [start + 600 * i for i in range(6)]
+    assert timeline['speed'] == ['low', 'low', 'high', 'off', 'off', 'off']
+    assert timeline['source'] == ['web', 'web', 'button', 'web', 'web', 'web']
+    assert timeline['changes'] == [2, 0, 1, 1, 0, 0]
+    # Relay dead times move the virtual clock on a few hundredths of a second
+    occupancy = timeline['occupancy']
+    assert occupancy['off'] == pytest.approx([0.5, 0, 0, 0.5, 1, 1], abs=1e-3)
+    assert occupancy['low'] == pytest.approx([0.5, 1, 0.5, 0, 0, 0], abs=1e-3)
+    assert occupancy['high'] == pytest.approx([0, 0, 0.5, 0.5, 0, 0], abs=1e-3)
+    assert occupancy['med'] == [0.0] * 6
+
+
+def test_timer_updates_are_not_transitions(sim, fan, history):
+    fan.change_speed('med')
+    fan.set_timer(1)
+    sim.advance(hours=2)
+    # Both fans off, then med and off again when the timer ran out; the
+    # countdown ticks in between add nothing
+    assert history.count == 4
+    assert history.timeline('default', step=3600)['changes'][-2:] == [2, 1]
+
+
+def test_time_before_the_first_transition_is_unknown(sim, fan, history):
+    attached = fan_control.clock.now().timestamp()
+    sim.advance(minutes=10)
+    timeline = history.timeline('default', attached - 1200, attached + 600, 600)
+    assert timeline['speed'] == [None, 'off', 'off']
+    assert timeline['occupancy']['off'] == [0.0, 0.0, 1.0]
+    assert history.timeline('garage', attached, attached + 600, 600)['speed'] == [None]
+
+
+def test_full_buffer_overwrites_the_oldest(sim, fan):
+    history = SpeedHistory(size=4)
+    history.attach(sim.registry)  # off for both fans
+    for speed in ('low', 'med', 'high', 'off'):
+        sim.advance(minutes=1)
+        fan.change_speed(speed)
+    info = history.buffer_info()
+    assert info == {**info, 'capacity': 4, 'recorded': 6, 'held': 4}
+    now = fan_control.clock.now().timestamp()
+    assert info['oldest'] == pytest.approx(now - 180, abs=1)  # the change to low
+
+    # Before the oldest transition held, the speed is unknown again
+    timeline = history.timeline('default', now - 270, now + 30, 60)
+    assert timeline['speed'] == [None, 'low', 'med', 'high', 'off']
+
+
+@pytest.mark.parametrize('start, end, step', [(10, 0, None), (0, 10, 0), (0, MAX_BUCKETS + 1, 1)])
+def test_bad_ranges_are_refused(history, start, end, step):
+    with pytest.raises(ValueError):
+        history.timeline('default', start, end, step)
+
+
+def test_history_route(web):
+    web.post('/api/fans/attic/set_speed', json={'speed': 'low'})
+    timeline = web.get('/api/history?fan=attic&step=3600').get_json()
+    assert len(timeline['time']) == 24 and timeline['speed'][-1] == 'low'
+    assert timeline['history']['capacity'] > 0
+    assert web.get('/api/history?step=-1').status_code == 400
+    assert web.get('/api/history?fan=garage').status_code == 404
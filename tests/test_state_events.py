@@ -0,0 +1,59 @@
+"""Versioned state: tags, ETags and long-polling /api/status."""
+
+import threading
+import time
+
+from state_events import StateBroadcaster
+
+
+def test_tags_from_another_boot_are_not_recognised():
+    broadcaster = StateBroadcaster(lambda tag: '{}')
+    restarted = StateBroadcaster(lambda tag: '{}')
+    broadcaster.publish()
+    tag = broadcaster.tag(broadcaster.version)
+    assert broadcaster.parse_tag(tag) == 1
+    assert restarted.parse_tag(tag) is None
+    assert broadcaster.parse_tag('1') is None
+    assert broadcaster.parse_tag(None) is None
+
+
+def test_wait_for_change_wakes_on_publish():
+    broadcaster = StateBroadcaster(lambda tag: '{}')
+    assert not broadcaster.wait_for_change(0, timeout=0.01)
+    threading.Timer(0.05, broadcaster.publish).start()
+    assert broadcaster.wait_for_change(0, timeout=5)
+    assert broadcaster.version == 1
+
+
+def test_etag_is_the_state_version(web):
+    response = web.get('/api/status')
+    tag = response.headers['X-State-Version']
+    assert response.headers['ETag'] == f'"{tag}"'
+    assert response.get_json()['version'] == tag
+    assert web.get('/api/status', headers={'If-None-Match': f'"{tag}"'}).status_code == 304
+
+
+def test_long_poll_returns_on_the_next_change(web):
+    import web_app
+    tag = web.get('/api/status').headers['X-State-Version']
+    threading.Timer(0.1, web_app.default_fan.change_speed, ['high']).start()
+    start = time.monotonic()
+    response = web.get(f'/api/status?wait=10&since={tag}')
+    assert time.monotonic() - start < 5
+    assert response.headers['X-State-Version'] != tag
+    assert response.get_json()['current_state']['speed'] == 'high'
+
+
+def test_long_poll_times_out_with_the_same_version(web):
+    tag = web.get('/api/status').headers['X-State-Version']
+    response = web.get(f'/api/status?wait=0.1&since={tag}')
+    assert response.status_code == 200
+    assert response.headers['X-State-Version'] == tag
+
+
+def test_long_poll_with_a_tag_from_before_a_restart_answers_at_once(web):
+    tag = web.get('/api/status').headers['X-State-Version']
+    start = time.monotonic()
+    response = web.get('/api/status?wait=10&since=0000-1')
+    assert time.monotonic() - start < 5
+    assert response.headers['X-State-Version'] == tag
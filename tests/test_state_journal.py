@@ -0,0 +1,70 @@
+"""State journal: restoring fans after a restart, and compaction."""
+
+import state_journal
+from state_journal import StateJournal
+
+
+def test_restore_brings_back_speed_and_timers(sim, registry, tmp_path):
+    path = str(tmp_path / 'fan_state.journal')
+    journal = StateJournal(path)
+    journal.attach(registry)
+    fan = registry.default
+    fan.change_speed('med')
+    fan.set_timer(4)
+    sim.advance(hours=1)
+    journal.close()
+
+    # A fresh process reading the same journal
+    fan.change_speed('off')
+    fan.cancel_timer()
+    restored = StateJournal(path).restore(registry)
+
+    assert restored == {'default': 'med', 'attic': 'off'}
+    sim.assert_speed('med')
+    assert fan.timer_state['remaining_seconds'] == 3 * 3600
+    sim.advance(hours=3)
+    sim.assert_speed('off')
+
+
+def test_expired_deadline_restores_off(sim, registry, tmp_path):
+    path = str(tmp_path / 'fan_state.journal')
+    journal = StateJournal(path)
+    journal.attach(registry)
+    registry.default.change_speed('high')
+    journal.close()
+
+    sim.clock.set(sim.time + 7 * 3600)  # down for longer than the safety timer
+    assert StateJournal(path).restore(registry)['default'] == 'off'
+    sim.assert_speed('off')
+
+
+def test_compaction_keeps_the_latest_record_per_fan(sim, registry, tmp_path):
+    path = str(tmp_path / 'fan_state.journal')
+    journal = StateJournal(path, compact_after=10)
+    journal.attach(registry)
+    for _ in range(4):
+        for speed in ('low', 'med', 'high'):
+            registry.default.change_speed(speed)
+            journal.flush()
+    journal.close()
+
+    assert journal.stats['compactions'] >= 1
+    with open(path) as f:
+        assert len(f.readlines()) < 10
+    assert state_journal.load(path)['default']['speed'] == 'high'
+
+
+def test_torn_last_line_is_ignored(sim, registry, tmp_path):
+    path = str(tmp_path / 'fan_state.journal')
+    journal = StateJournal(path)
+    journal.attach(registry)
+    registry.default.change_speed('low')
+    journal.close()
+    with open(path, 'a') as f:
+        f.write('{"fan": "default", "speed": "hi')
+
+    assert state_journal.load(path)['default']['speed'] == 'low'
+    # Reopening rewrites the journal without the damaged line
+    StateJournal(path)
+    with open(path) as f:
+        assert all(line.endswith('\n') for line in f)
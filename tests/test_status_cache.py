@@ -0,0 +1,55 @@
+"""Cached /api/status bodies and the countdown ticks that refresh them."""
+
+import gzip
+import threading
+
+
+def test_countdown_tick_runs_on_the_hardware_owner(sim, fan):
+    threads = []
+    sim.registry.add_listener(lambda fan: threads.append(threading.current_thread().name))
+    fan.change_speed('low')
+    threads.clear()
+    sim.advance(minutes=3)
+    assert threads == ['hardware-owner'] * 3
+
+
+def test_status_body_is_built_once_per_state_version(web, monkeypatch):
+    import web_app
+    builds = []
+    build = web_app.state_broadcaster._build_payload
+    monkeypatch.setattr(web_app.state_broadcaster, '_build_payload', lambda tag: builds.append(tag) or build(tag))
+
+    web_app.notify_state_change()
+    first = web.get('/api/status')
+    second = web.get('/api/status', headers={'Accept-Encoding': 'gzip'})
+    assert len(builds) == 1
+    assert first.headers['X-State-Version'] == second.headers['X-State-Version'] == builds[0]
+
+    web.post('/api/set_speed', json={'speed': 'low'})
+    assert web.get('/api/status').get_json()['current_state']['speed'] == 'low'
+    assert len(builds) == 2
+
+
+def test_gzip_body_matches_the_plain_body(web):
+    plain = web.get('/api/status')
+    packed = web.get('/api/status', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in plain.headers
+    assert packed.headers['Content-Encoding'] == 'gzip'
+    assert packed.headers['Vary'] == 'Accept-Encoding'
+    assert gzip.decompress(packed.data) == plain.data
+    assert packed.headers['ETag'] == plain.headers['ETag'][:-1] + '-gzip"'
+
+
+def test_matching_etag_gets_304_until_the_state_changes(web):
+    etag = web.get('/api/status').headers['ETag']
+    unchanged = web.get('/api/status', headers={'If-None-Match': etag})
+    assert unchanged.status_code == 304 and unchanged.data == b''
+
+    gzip_etag = web.get('/api/status', headers={'Accept-Encoding': 'gzip'}).headers['ETag']
+    # The plain tag does not validate the gzip body, nor the other way round
+    assert web.get('/api/status', headers={'If-None-Match': gzip_etag}).status_code == 200
+
+    web.post('/api/set_speed', json={'speed': 'med'})
+    changed = web.get('/api/status', headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
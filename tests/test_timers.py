@@ -0,0 +1,73 @@
+"""Fan timers on the deadline scheduler, in virtual time."""
+
+from simulation import VirtualClock, VirtualScheduler
+
+
+def test_scheduler_runs_calls_in_deadline_order():
+    clock = VirtualClock()
+    scheduler = VirtualScheduler(clock)
+    ran = []
+    scheduler.call_later(30, ran.append, 'b')
+    scheduler.call_later(10, ran.append, 'a')
+    cancelled = scheduler.call_later(20, ran.append, 'cancelled')
+    cancelled.cancel()
+    cancelled.cancel()
+    assert scheduler.pending() == 2
+
+    clock.set(30)
+    assert scheduler.run_due() == 2
+    assert ran == ['a', 'b']
+    assert scheduler.pending() == 0
+
+
+def test_safety_timer_turns_the_fan_off(sim, fan):
+    fan.change_speed('high')
+    sim.advance(hours=5, minutes=59)
+    sim.assert_speed('high')
+    sim.advance(minutes=1)
+    sim.assert_speed('off')
+    sim.assert_speeds(['off', 'high', 'off'])
+
+
+def test_user_timer_counts_down_from_its_deadline(sim, fan):
+    fan.change_speed('med')
+    fan.set_timer(4)
+    sim.advance(hours=1)
+    assert fan.timer_state['remaining_seconds'] == 3 * 3600
+    sim.advance(hours=3)
+    sim.assert_speed('off')
+    sim.assert_speed_at(4 * 3600 - 1, 'med')
+    assert not fan.timer_state['active']
+
+
+def test_stale_timer_expiry_is_ignored(sim, fan):
+    fan.change_speed('low')
+    fan.set_timer(1)
+    stale = fan._timer_generation
+    fan.set_timer(2)
+
+    # The first timer's expiry, delivered after the re-arm
+    fan.timer_expired(stale)
+    sim.assert_speed('low')
+    assert fan.timer_state['active']
+
+    sim.advance(hours=2)
+    sim.assert_speed('off')
+
+
+def test_cancelled_timer_does_not_fire(sim, fan):
+    fan.change_speed('low')
+    fan.set_timer(1)
+    fan.cancel_timer()
+    sim.advance(hours=2)
+    sim.assert_speed('low')
+
+
+def test_timers_of_different_fans_are_independent(sim, registry):
+    attic = registry.get('attic')
+    registry.default.change_speed('high')
+    attic.change_speed('low')
+    attic.set_timer(1)
+    sim.advance(hours=1)
+    sim.assert_speed('off', attic)
+    sim.assert_speed('high')
@@ -0,0 +1,75 @@
+"""Span tracing from a button edge or HTTP request to the relay write."""
+
+import pytest
+
+import fan_control
+import tracing
+from simulation import Simulation
+
+
+@pytest.fixture
+def traces():
+    """Tracing on with an empty buffer; off again afterwards."""
+    tracing.clear()
+    tracing.enable()
+    yield tracing
+    tracing.disable()
+    tracing.clear()
+
+
+@pytest.fixture
+def button_sim(monkeypatch):
+    """A fan with buttons, as the process-wide registry the button callbacks use."""
+    fans = fan_control.FanRegistry()
+    fans.add(fan_control.FanController('default', fan_control.SPEED_PINS,
+                                       speed_button=fan_control.SPEED_BUTTON_GPIO,
+                                       timer_button=fan_control.TIMER_BUTTON_GPIO))
+    monkeypatch.setattr(fan_control, '_registry', fans)
+    monkeypatch.setattr(fan_control, 'speed_change_callback', None)
+    with Simulation(fans) as sim:
+        yield sim
+
+
+def span_names(trace):
+    return [span['name'] for span in trace['spans']]
+
+
+def test_nothing_is_recorded_while_tracing_is_off(web, button_sim):
+    # web first: web_app must bind the process-wide fans before button_sim swaps them
+    tracing.clear()
+    assert not tracing.enabled
+    button_sim.press_speed()
+    button_sim.advance(seconds=1)
+    button_sim.assert_speed('low')
+    web.post('/api/fans/attic/set_speed', json={'speed': 'low'})
+    assert tracing.timeline() == []
+
+
+def test_button_press_is_traced_to_the_relay_write(button_sim, traces):
+    button_sim.press_speed()
+    button_sim.advance(seconds=1)
+    [trace] = tracing.timeline(name='button')
+    assert span_names(trace) == ['button.edge', 'button.queued', 'button.handle',
+                                 'hardware.queued', 'hardware.run', 'relay.make']
+    owner_spans = [span for span in trace['spans'] if span['name'].startswith(('hardware', 'relay'))]
+    assert {span['thread'] for span in owner_spans} == {'hardware-owner'}
+    assert trace['spans'][-1]['fields'] == {'pins': [fan_control.SPEED_PINS['low']]}
+
+
+def test_http_request_is_traced_to_the_relay_write(web):
+    assert web.post('/api/debug/trace', json={'enabled': True, 'clear': True}).get_json() == {'enabled': True}
+    try:
+        web.post('/api/fans/attic/set_speed', json={'speed': 'med'})
+        traces = web.get('/api/debug/trace?name=http').get_json()['traces']
+        [trace] = [t for t in traces if 'relay.make' in span_names(t)]
+        assert span_names(trace) == ['http.request', 'hardware.queued', 'hardware.run', 'relay.make']
+        assert trace['spans'][0]['fields']['route'] == '/api/fans/<fan_id>/set_speed'
+
+        chrome = web.get('/api/debug/trace?format=chrome').get_json()
+        assert {event['name'] for event in chrome['traceEvents']} >= {'http.request', 'relay.make'}
+    finally:
+        assert web.post('/api/debug/trace', json={'enabled': False, 'clear': True}).get_json() == {'enabled': False}
+    # Only the request that switched tracing off, which started while it was on
+    web.get('/api/status')
+    [trace] = web.get('/api/debug/trace').get_json()['traces']
+    assert trace['spans'][0]['fields']['route'] == '/api/debug/trace'
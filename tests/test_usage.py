@@ -0,0 +1,89 @@
+"""Runtime and energy totals: midnight splits and the saved totals file."""
+
+import json
+from datetime import datetime
+
+import pytest
+
+import usage
+from usage import FanUsage, UsageStore
+
+SPEEDS = ('off', 'low', 'med', 'high')
+WATTS = {'off': 0, 'low': 25, 'med': 45, 'high': 70}
+
+
+def test_a_run_across_midnight_is_split_between_the_days():
+    totals = FanUsage(SPEEDS, WATTS)
+    totals.add('high', 3 * 3600, datetime(2024, 3, 2, 1, 0))
+    report = totals.report()
+    assert report['since'] == '2024-03-01'
+    assert report['total']['hours']['high'] == 3
+    assert report['total']['kwh'] == 0.21
+    assert [(day['date'], day['hours']['high'], day['kwh']) for day in report['days']] == [
+        ('2024-03-01', 2, 0.14), ('2024-03-02', 1, 0.07)]
+
+
+def test_a_run_over_several_days_fills_each_day():
+    totals = FanUsage(SPEEDS, WATTS)
+    totals.add('low', 50 * 3600, datetime(2024, 3, 3, 1, 0))
+    assert [day['hours']['low'] for day in totals.report()['days']] == [1, 24, 24, 1]
+    assert [day['date'] for day in totals.report(days=2)['days']] == ['2024-03-02', '2024-03-03']
+    assert totals.report(days=0)['days'] == []
+
+
+def test_only_the_newest_days_are_kept(monkeypatch):
+    monkeypatch.setattr(usage, 'DAYS_KEPT', 3)
+    totals = FanUsage(SPEEDS, WATTS)
+    for day in range(1, 6):
+        totals.add('med', 3600, datetime(2024, 3, day, 12, 0))
+    assert [day['date'] for day in totals.report()['days']] == ['2024-03-03', '2024-03-04', '2024-03-05']
+    assert totals.report()['total']['hours']['med'] == 5
+
+
+def test_fan_totals_follow_its_speeds(sim, fan):
+    sim.advance(hours=23)
+    fan.change_speed('high')
+    sim.advance(hours=2)
+    fan.change_speed('low')
+    sim.advance(hours=1)
+    report = fan.usage_report()
+    assert report['total']['hours']['high'] == pytest.approx(2, abs=1e-3)
+    assert report['total']['hours']['low'] == pytest.approx(1, abs=1e-3)
+    days = {day['date']: day['hours'] for day in report['days']}
+    assert days['2024-01-01']['high'] == pytest.approx(1, abs=1e-3)
+    assert days['2024-01-02']['high'] == pytest.approx(1, abs=1e-3)
+
+
+def test_totals_survive_a_restart(sim, registry, tmp_path):
+    path = str(tmp_path / 'usage.json')
+    store = UsageStore(path, save_interval=3600)
+    store.attach(registry)
+    registry.default.change_speed('med')
+    sim.advance(hours=2)
+    store.close()
+
+    with open(path) as f:
+        saved = json.load(f)
+    assert saved['default']['totals']['seconds']['med'] == pytest.approx(7200, abs=1)
+
+    restarted = FanUsage(SPEEDS, WATTS)
+    restarted.load({**saved['default'], 'totals': {**saved['default']['totals'], 'seconds': {
+        **saved['default']['totals']['seconds'], 'turbo': 60}}})
+    assert restarted.report()['total']['hours']['med'] == pytest.approx(2, abs=1e-3)
+    assert 'turbo' not in restarted.report()['total']['hours']
+
+
+def test_an_unreadable_totals_file_starts_from_zero(registry, tmp_path):
+    path = tmp_path / 'usage.json'
+    path.write_text('{not json')
+    store = UsageStore(str(path), save_interval=3600)
+    store.attach(registry)
+    assert registry.default.usage.report()['total']['kwh'] == 0
+    store.close()
+    assert json.loads(path.read_text())['default']['totals']['wh'] == 0
+
+
+def test_usage_route(web):
+    report = web.get('/api/usage?fan=attic&days=1').get_json()
+    assert report['fan'] == 'attic' and len(report['days']) <= 1
+    assert web.get('/api/usage?fan=garage').status_code == 404
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Span tracing for the button and HTTP paths
+
+A trace follows one button press or one HTTP request across threads: the
+GPIO edge callback, the button event queue, the hardware owner, the web app
+callback and the relay write each record a span (name, start, end, thread,
+fields) under the trace's id. Spans go into a fixed-size ring buffer served
+as a timeline at /api/debug/trace.
+
+The trace id travels with the work: button events and hardware owner
+commands carry it between threads, and current() (a context variable, so it
+also follows asyncio tasks) holds it while the work runs.
+
+Tracing is off unless FAN_TRACE=1 or enable() is called. Every call site
+guards on the module flag, e.g.
+
+    started = tracing.clock() if tracing.enabled else None
+    ...
+    if started is not None:
+        tracing.record('relay.make', started, pins=[26])
+
+so with tracing off the cost is one attribute check and nothing is
+allocated.
+"""
+
+import collections
+import contextvars
+import itertools
+import os
+import threading
+import time
+
+# Spans kept for /api/debug/trace
+TRACE_BUFFER_SIZE = 2000
+
+# Set by enable()/disable(); checked by every call site before doing any work
+enabled = os.environ.get('FAN_TRACE', '') not in ('', '0')
+
+# Span timestamps (seconds, high resolution)
+clock = time.perf_counter
+
+# Converts clock() readings to Unix time for display
+_epoch = time.time() - time.perf_counter()
+
+_spans = collections.deque(maxlen=TRACE_BUFFER_SIZE)
+_ids = itertools.count(1)
+_current = contextvars.ContextVar('fan_trace', default=None)
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def new_trace():
+    """Return a new trace id."""
+    return next(_ids)
+
+
+def current():
+    """The trace id of the work running in this thread or task, or None."""
+    return _current.get()
+
+
+def set_current(trace):
+    """Make trace the current trace. Returns a token for reset_current()."""
+    return _current.set(trace)
+
+
+def reset_current(token):
+    _current.reset(token)
+
+
+def record(name, start, end=None, trace=None, **fields):
+    """Record a span from start to end (default: now) in trace (default: current()).
+
+    Returns end, so consecutive spans can chain: t = record('a', t); record('b', t).
+    """
+    end = clock() if end is None else end
+    _spans.append((trace if trace is not None else _current.get(), name, start, end,
+                   threading.current_thread().name, fields))
+    return end
+
+
+def clear():
+    _spans.clear()
+
+
+def timeline(limit=None, name=None):
+    """Traces, newest last, each with its spans relative to the trace start.
+
+    limit keeps the newest traces; name keeps only traces with a span whose
+    name starts with it (e.g. 'button' or 'http').
+    """
+    traces = {}
+    for i, (trace, span_name, start, end, thread, fields) in enumerate(list(_spans)):
+        # A span outside any trace (e.g. a relay write from a timer) stands alone
+        key = trace if trace is not None else ('untraced', i)
+        traces.setdefault(key, []).append((span_name, start, end, thread, fields))
+
+    result = []
+    for key, spans in traces.items():
+        trace = key if not isinstance(key, tuple) else None
+        if name and not any(span[0].startswith(name) for span in spans):
+            continue
+        spans.sort(key=lambda span: span[1])
+        begin = spans[0][1]
+        result.append({
+            'trace': trace,
+            'start': _epoch + begin,
+            'duration_ms': (max(span[2] for span in spans) - begin) * 1000,
+            'spans': [{'name': span_name,
+                       'offset_ms': (start - begin) * 1000,
+                       'duration_ms': (end - start) * 1000,
+                       'thread': thread,
+                       **({'fields': fields} if fields else {})}
+                      for span_name, start, end, thread, fields in spans],
+        })
+    result.sort(key=lambda t: t['start'])
+    return result[-limit:] if limit else result
+
+
+def chrome_trace(limit=None, name=None):
+    """The same timeline as Chrome trace events (open in ui.perfetto.dev)."""
+    events = []
+    for t in timeline(limit, name):
+        for span in t['spans']:
+            events.append({
+                'name': span['name'],
+                'ph': 'X',
+                'ts': (t['start'] * 1000 + span['offset_ms']) * 1000,
+                'dur': span['duration_ms'] * 1000,
+                'pid': t['trace'] or 0,
+                'tid': span['thread'],
+                'args': span.get('fields', {}),
+            })
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Runtime and energy accounting
+
+Each fan keeps running totals of the seconds spent at each speed and the
+energy used (watt-hours, from its configured power per speed), overall and
+per calendar day. FanController.account_speed_time() adds the time since the
+previous call at every speed transition (and when totals are read or saved),
+so an update is a few additions, split at midnight when a run crosses it;
+reports read the totals and never replay the speed history.
+
+UsageStore keeps the totals of every fan in one JSON file, rewritten
+atomically every SAVE_INTERVAL and on shutdown, and loads them back on
+startup. A crash loses at most SAVE_INTERVAL of accounting.
+"""
+
+import json
+import os
+import threading
+from datetime import datetime, time as time_of_day, timedelta
+
+from event_log import get_logger
+from state_journal import fsync_dir
+
+log = get_logger('fans')
+
+# Totals file (keep it on persistent storage, not a tmpfs)
+USAGE_PATH = os.environ.get(
+    'FAN_USAGE_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fan_usage.json'))
+
+# Seconds between saves of the totals file
+SAVE_INTERVAL = 300
+
+# Daily buckets kept per fan (the oldest are dropped)
+DAYS_KEPT = 400
+
+
+class FanUsage:
+    """Seconds and watt-hours per speed for one fan, in total and per day."""
+
+    def __init__(self, speeds, power_watts):
+        self.speeds = list(speeds)
+        self.power_watts = {speed: float(power_watts.get(speed, 0)) for speed in self.speeds}
+        self.totals = _empty(self.speeds)
+        self.days = {}  # 'YYYY-MM-DD' -> totals for that day, oldest first
+        self.since = None  # date of the first accounted second
+        self._lock = threading.Lock()
+
+    def add(self, speed, seconds, end):
+        """Account seconds at speed ending at end (a datetime)."""
+        if seconds <= 0:
+            return
+        watts = self.power_watts.get(speed, 0.0)
+        start = end - timedelta(seconds=seconds)
+        with self._lock:
+            if self.since is None:
+                self.since = start.date().isoformat()
+            # Split at each midnight the run crossed (usually none)
+            while start.date() < end.date():
+                midnight = datetime.combine(start.date() + timedelta(days=1), time_of_day())
+                self._add_to_day(start.date(), speed, (midnight - start).total_seconds(), watts)
+                start = midnight
+            self._add_to_day(end.date(), speed, (end - start).total_seconds(), watts)
+
+    def _add_to_day(self, date, speed, seconds, watts):
+        key = date.isoformat()
+        day = self.days.get(key)
+        if day is None:
+            day = self.days[key] = _empty(self.speeds)
+            if len(self.days) > DAYS_KEPT:
+                del self.days[min(self.days)]
+        wh = seconds * watts / 3600
+        for totals in (self.totals, day):
+            totals['seconds'][speed] += seconds
+            totals['wh'] += wh
+
+    def report(self, days=None):
+        """Hours per speed and kWh, in total and for the newest days (all if None)."""
+        with self._lock:
+            keys = sorted(self.days)
+            if days is not None:
+                keys = keys[-days:] if days > 0 else []
+            return {
+                'power_watts': dict(self.power_watts),
+                'since': self.since,
+                'total': _report(self.totals),
+                'days': [{'date': key, **_report(self.days[key])} for key in keys],
+            }
+
+    def to_dict(self):
+        with self._lock:
+            return {'since': self.since, 'totals': _copy(self.totals),
+                    'days': {key: _copy(day) for key, day in self.days.items()}}
+
+    def load(self, data):
+        """Continue from totals saved by to_dict()."""
+        with self._lock:
+            self.since = data.get('since')
+            self.totals = _merge(self.speeds, data.get('totals'))
+            self.days = {key: _merge(self.speeds, day) for key, day in sorted(data.get('days', {}).items())}
+
+
+class UsageStore:
+    """Loads and periodically saves the usage totals of every fan in a registry."""
+
+    def __init__(self, path=None, save_interval=SAVE_INTERVAL):
+        self.path = path or USAGE_PATH
+        self.save_interval = save_interval
+        self.registry = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def attach(self, registry):
+        """Load the saved totals into registry's fans and start saving them."""
+        self.registry = registry
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            saved = {}
+        except (OSError, ValueError) as e:
+            log.warning("Usage totals %s unreadable, starting from zero: %s", self.path, e)
+            saved = {}
+        for fan in registry:
+            if fan.fan_id in saved:
+                fan.usage.load(saved[fan.fan_id])
+        self._thread = threading.Thread(target=self._run, name='usage-store', daemon=True)
+        self._thread.start()
+
+    def save(self):
+        """Account every fan up to now and write the totals file atomically."""
+        data = {}
+        for fan in self.registry:
+            fan.account_speed_time()
+            data[fan.fan_id] = fan.usage.to_dict()
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f, separators=(',', ':'))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        fsync_dir(self.path)
+
+    def close(self):
+        """Stop the periodic saves and save one last time."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+        if self.registry is not None:
+            self.save()
+
+    def _run(self):
+        while not self._stop.wait(self.save_interval):
+            try:
+                self.save()
+            except OSError as e:
+                log.error("Usage totals write failed: %s", e)
+
+
+def _empty(speeds):
+    return {'seconds': {speed: 0.0 for speed in speeds}, 'wh': 0.0}
+
+
+def _copy(totals):
+    return {'seconds': dict(totals['seconds']), 'wh': totals['wh']}
+
+
+def _merge(speeds, saved):
+    # Saved totals onto a fresh set, ignoring speeds that no longer exist
+    totals = _empty(speeds)
+    if saved:
+        for speed, seconds in saved.get('seconds', {}).items():
+            if speed in totals['seconds']:
+                totals['seconds'][speed] = float(seconds)
+        totals['wh'] = float(saved.get('wh', 0.0))
+    return totals
+
+
+def _report(totals):
+    return {'hours': {speed: round(seconds / 3600, 4) for speed, seconds in totals['seconds'].items()},
+            'kwh': round(totals['wh'] / 1000, 4)}
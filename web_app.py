@@ -6,7 +6,7 @@ A simple Flask web application to control the fan speeds via a web interface.
 Compatible with both Raspberry Pi (real GPIO) and macOS (mock GPIO) environments.
 """
 
-from flask import Flask, render_template, request, jsonify, redirect, url_for
+from flask import Flask, Response, abort, g, render_template, request, jsonify, redirect, url_for
 import json
 from datetime import datetime, timedelta
 import threading
@@ -14,36 +14,136 @@ import time
 
 # Import our fan control module
 import fan_control
+import metrics
+import tracing
+from control_daemon import ControlServer
+from hardware_owner import HardwareTimeout, hardware_owner
+from event_log import get_logger, ring_buffer
+from schedules import ScheduleBook
+from sensors import SensorHub
+from speed_history import SpeedHistory
+from state_events import StateBroadcaster
+from state_journal import StateJournal
+from usage import UsageStore
 
 app = Flask(__name__)
 
-# Current fan state
-current_state = {
-    'speed': 'off',
-    'last_changed': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-    'mock_mode': fan_control.MOCK_MODE
-}
-
-# Timer state
-timer_state = {
-    'active': False,
-    'duration_hours': 0,
-    'start_time': None,
-    'end_time': None,
-    'remaining_seconds': 0
-}
-
-# Safety timer state (6 hours max runtime)
-safety_timer_state = {
-    'active': False,
-    'start_time': None,
-    'max_hours': 6,
-    'remaining_seconds': 0
-}
-
-# Timer thread references
-timer_thread = None
-safety_timer_thread = None
+log = get_logger('web')
+
+# Every fan driven by this process. The single-fan routes and helpers
+# below act on the default fan.
+fan_registry = fan_control.registry
+default_fan = fan_control.default_fan
+
+# One scheduler thread runs the user and safety timers of every fan
+timer_scheduler = fan_registry.scheduler
+
+# Seconds between keep-alive comments on idle event streams
+EVENT_STREAM_KEEPALIVE = 15
+
+# Longest a ?wait= long-poll on /api/status may block
+MAX_LONG_POLL_WAIT = 60
+
+# Event streams and long-polls allowed to wait at once. Each holds a worker
+# thread while it waits, so serve.py sets this below its thread count to keep
+# workers free for other requests; past it, /api/events answers 503 (the
+# page falls back to polling) and a long-poll answers at once. None: no
+# limit (the dev server starts a thread per request).
+max_waiting_requests = None
+_waiting_requests = 0
+_waiting_lock = threading.Lock()
+
+# Unix-socket control server, state journal and usage totals, started by start_hardware()
+control_server = None
+state_journal = None
+usage_store = None
+
+# Daily buckets in a /api/usage response unless ?days= says otherwise
+USAGE_DEFAULT_DAYS = 7
+
+
+def build_status(version=None):
+    """Build the status dict shared by /api/status and /api/events."""
+    status = default_fan.status()
+    status['version'] = version
+    return status
+
+
+# Versioned state: pushes changes to /api/events subscribers and backs the
+# ETag and long-poll support on /api/status
+state_broadcaster = StateBroadcaster(lambda version: app.json.dumps(build_status(version)))
+
+
+def acquire_wait_slot():
+    """Take one of the max_waiting_requests slots. Returns False if they are all in use."""
+    global _waiting_requests
+    with _waiting_lock:
+        if max_waiting_requests is not None and _waiting_requests >= max_waiting_requests:
+            return False
+        _waiting_requests += 1
+        return True
+
+
+def release_wait_slot():
+    global _waiting_requests
+    with _waiting_lock:
+        _waiting_requests -= 1
+
+
+def notify_state_change(fan=None):
+    """Bump the state version and wake event-stream and long-poll clients."""
+    state_broadcaster.publish()
+
+
+# Every fan reports its state changes here
+fan_registry.add_listener(notify_state_change)
+
+# Every speed transition, for /api/history
+speed_history = SpeedHistory()
+speed_history.attach(fan_registry)
+
+
+def get_fan_or_404(fan_id):
+    """Look up a fan by id, aborting the request with 404 if it is unknown."""
+    fan = fan_registry.get(fan_id)
+    if fan is None:
+        abort(404, description=f"Unknown fan: {fan_id}")
+    return fan
+
+
+@app.errorhandler(HardwareTimeout)
+def hardware_timeout(error):
+    """The hardware owner did not complete a command in time."""
+    return jsonify({'error': str(error)}), 503
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    if tracing.enabled:
+        # Hardware commands submitted by this request join its trace
+        g.trace_token = tracing.set_current(tracing.new_trace())
+
+
+@app.after_request
+def record_request_time(response):
+    """Observe the request in its route's latency histogram (see /metrics)."""
+    started = g.get('request_started')
+    if started is not None:
+        series = metrics.http_request_seconds.get(request.endpoint) or metrics.http_request_seconds[None]
+        series.observe(time.perf_counter() - started)
+        if g.get('trace_token') is not None:
+            tracing.record('http.request', started, method=request.method,
+                           route=request.url_rule.rule if request.url_rule else request.path,
+                           status=response.status_code)
+    return response
+
+
+@app.teardown_request
+def end_request_trace(error=None):
+    token = g.pop('trace_token', None)
+    if token is not None:
+        tracing.reset_current(token)
 
 
 # === BUTTON INTEGRATION ===
@@ -53,12 +153,12 @@ safety_timer_thread = None
 @app.route('/')
 def index():
     """Main control interface."""
-    update_timer_remaining()
-    update_safety_timer_remaining()
+    status = default_fan.status()
     return render_template('index.html',
-                         current_state=current_state,
-                         timer_state=timer_state,
-                         safety_timer_state=safety_timer_state,
+                         current_state=status['current_state'],
+                         timer_state=status['timer_state'],
+                         safety_timer_state=status['safety_timer_state'],
+                         server_time=fan_control.clock.now().timestamp(),
                          mock_mode=fan_control.MOCK_MODE)
 
 
@@ -90,7 +190,7 @@ def api_set_speed():
         return jsonify({
             'success': True,
             'message': message,
-            'current_state': current_state
+            'current_state': default_fan.state
         })
     else:
         return jsonify({'error': message}), 400
@@ -98,14 +198,74 @@ def api_set_speed():
 
 @app.route('/api/status')
 def api_status():
-    """API endpoint for getting current fan status."""
-    update_timer_remaining()
-    update_safety_timer_remaining()
-    return jsonify({
-        'current_state': current_state,
-        'timer_state': timer_state,
-        'safety_timer_state': safety_timer_state
+    """API endpoint for getting current fan status.
+
+    The body is serialized (and gzipped, for clients that accept it) once
+    per state version and served from cache. The response carries an ETag
+    of the state version tag, and a matching If-None-Match gets a 304. With
+    ?wait=<seconds>&since=<tag> the request blocks until the version moves
+    on from since (or the wait runs out) before answering; a tag from before
+    a restart answers at once.
+
+    remaining_seconds in the timer states is tick-granular: it is as of the
+    last state change or countdown tick, up to COUNTDOWN_TICK_SECONDS old.
+    The timers' deadline fields are exact.
+    """
+    wait = request.args.get('wait', type=float)
+    since = state_broadcaster.parse_tag(request.args.get('since'))
+    if wait and since is not None and acquire_wait_slot():
+        try:
+            state_broadcaster.wait_for_change(since, min(wait, MAX_LONG_POLL_WAIT))
+        finally:
+            release_wait_slot()
+
+    gzipped = request.accept_encodings['gzip'] > 0
+    version, body = state_broadcaster.body(gzipped)
+    tag = state_broadcaster.tag(version)
+    etag = f'{tag}-gzip' if gzipped else tag
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype='application/json')
+        if gzipped:
+            response.headers['Content-Encoding'] = 'gzip'
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['X-State-Version'] = tag
+    return response
+
+
+@app.route('/api/events')
+def api_events():
+    """Server-Sent Events stream that pushes the status on every change.
+
+    Answers 503 when max_waiting_requests streams and long-polls are open.
+    """
+    if not acquire_wait_slot():
+        return jsonify({'error': 'Too many open event streams; poll /api/status instead'}), 503
+
+    # Set by waitress when serve.py enables channel_request_lookahead
+    client_disconnected = request.environ.get('waitress.client_disconnected')
+
+    def stream():
+        sent_version = None
+        while client_disconnected is None or not client_disconnected():
+            version, payload = state_broadcaster.payload()
+            if version != sent_version:
+                sent_version = version
+                yield f"id: {state_broadcaster.tag(version)}\ndata: {payload}\n\n"
+            if not state_broadcaster.wait_for_change(sent_version, EVENT_STREAM_KEEPALIVE):
+                # Comment line keeps proxies from closing an idle stream
+                yield ": keep-alive\n\n"
+
+    response = Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
     })
+    # The server closes the response when the client goes away
+    response.call_on_close(release_wait_slot)
+    return response
 
 
 @app.route('/set_timer/<int:hours>')
@@ -123,37 +283,22 @@ def cancel_timer_route():
 @app.route('/api/set_timer', methods=['POST'])
 def api_set_timer():
     """API endpoint for setting timer."""
-    data = request.get_json()
+    return set_timer_response(default_fan, request.get_json())
+
+
+def set_timer_response(fan, data):
+    """Apply a {"hours": N} timer request to a fan and build the JSON response."""
     hours = data.get('hours') if data else None
 
     if hours is None:
         return jsonify({'error': 'Hours parameter required'}), 400
 
-    if hours == 0:
-        cancel_timer()
-        # Reset safety timer since this is user interaction
-        if current_state['speed'] != 'off':
-            start_safety_timer()
-        return jsonify({
-            'success': True,
-            'message': 'Timer cancelled',
-            'timer_state': timer_state
-        })
-
-    if hours not in [1, 2, 4]:
-        return jsonify({'error': 'Invalid timer duration. Must be 1, 2, or 4 hours'}), 400
-
-    success, message = set_timer(hours)
-
-    # Reset safety timer since this is user interaction
-    if current_state['speed'] != 'off':
-        start_safety_timer()
-
+    success, message = fan.apply_timer(hours)
     if success:
         return jsonify({
             'success': True,
             'message': message,
-            'timer_state': timer_state
+            'timer_state': fan.timer_state
         })
     else:
         return jsonify({'error': message}), 400
@@ -161,283 +306,344 @@ def api_set_timer():
 
 def handle_timer_change(hours):
     """Handle timer change and redirect back to main page."""
-    if hours == 0:
-        cancel_timer()
-    else:
-        set_timer(hours)
+    default_fan.apply_timer(hours)
     return redirect(url_for('index'))
 
 
 @app.route('/cycle_speed')
 def cycle_speed_route():
     """Cycle to the next speed setting."""
-    # Access the cycling variables from fan_control
-    fan_control.current_speed_index = (fan_control.current_speed_index + 1) % len(fan_control.speed_states)
-    new_speed = fan_control.speed_states[fan_control.current_speed_index]
-
-    # Set the new speed
-    fan_control.set_speed(new_speed)
-    current_state['speed'] = new_speed
-
-    # Handle safety timer
-    if new_speed == 'off':
-        cancel_safety_timer()
-    else:
-        start_safety_timer()
-
+    default_fan.cycle_speed('web')
     return redirect(url_for('index'))
 
 
 @app.route('/cycle_timer')
 def cycle_timer_route():
     """Cycle to the next timer setting."""
-    # Access the cycling variables from fan_control
-    fan_control.current_timer_index = (fan_control.current_timer_index + 1) % len(fan_control.timer_states)
-    new_timer = fan_control.timer_states[fan_control.current_timer_index]
-
-    # Handle timer setting
-    if new_timer == 'off':
-        cancel_timer()
-    else:
-        # Convert timer state to hours (e.g., '1hr' -> 1)
-        hours = int(new_timer.replace('hr', ''))
-        set_timer(hours)
-
-    # Reset safety timer since this is user interaction
-    if current_state['speed'] != 'off':
-        start_safety_timer()
-
+    default_fan.cycle_timer()
     return redirect(url_for('index'))
 
 
 @app.route('/api/cycle_speed', methods=['POST'])
 def api_cycle_speed():
     """API endpoint for cycling speed."""
-    fan_control.current_speed_index = (fan_control.current_speed_index + 1) % len(fan_control.speed_states)
-    new_speed = fan_control.speed_states[fan_control.current_speed_index]
+    return cycle_speed_response(default_fan)
 
-    fan_control.set_speed(new_speed)
-    current_state['speed'] = new_speed
 
-    # Handle safety timer
-    if new_speed == 'off':
-        cancel_safety_timer()
-    else:
-        start_safety_timer()
+def cycle_speed_response(fan):
+    """Cycle a fan's speed and build the JSON response."""
+    success, message, new_speed = fan.cycle_speed('web')
+    if not success:
+        return jsonify({'error': message}), 400
 
     return jsonify({
         'success': True,
         'message': f'Speed cycled to {new_speed}',
         'speed': new_speed,
-        'current_state': current_state
+        'current_state': fan.state
     })
 
 
 @app.route('/api/cycle_timer', methods=['POST'])
 def api_cycle_timer():
     """API endpoint for cycling timer."""
-    fan_control.current_timer_index = (fan_control.current_timer_index + 1) % len(fan_control.timer_states)
-    new_timer = fan_control.timer_states[fan_control.current_timer_index]
+    return cycle_timer_response(default_fan)
 
-    if new_timer == 'off':
-        cancel_timer()
-        message = 'Timer cycled to off'
-    else:
-        hours = int(new_timer.replace('hr', ''))
-        success, message = set_timer(hours)
-        if not success:
-            return jsonify({'error': message}), 400
-        message = f'Timer cycled to {new_timer}'
 
-    # Reset safety timer since this is user interaction
-    if current_state['speed'] != 'off':
-        start_safety_timer()
+def cycle_timer_response(fan):
+    """Cycle a fan's timer and build the JSON response."""
+    success, message, new_timer = fan.cycle_timer()
+    if not success:
+        return jsonify({'error': message}), 400
 
     return jsonify({
         'success': True,
         'message': message,
-        'timer_state': timer_state
+        'timer_state': fan.timer_state
     })
 
 
-def handle_speed_change(speed):
-    """Handle speed change and redirect back to main page."""
+# === MULTI-FAN API ===
+
+@app.route('/api/fans')
+def api_fans_status():
+    """Bulk status of every fan, keyed by fan id."""
+    etag = state_broadcaster.tag(state_broadcaster.version)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify({'version': etag, 'fans': fan_registry.status()})
+    response.set_etag(etag)
+    return response
+
+
+@app.route('/api/fans/set_speed', methods=['POST'])
+def api_fans_set_speed():
+    """Bulk speed command, applied to every affected fan in one hardware pass.
+
+    Body is either {"speed": "low", "fans": ["a", "b"]} (omit "fans" for all
+    fans) or {"commands": {"a": "low", "b": "off"}}.
+    """
+    commands, error = fan_registry.bulk_commands(request.get_json())
+    if error:
+        return jsonify({'error': error}), 400
+
+    results = fan_registry.apply_speeds(commands, 'web')
+    success = all(ok for ok, _ in results.values())
+
+    return jsonify({
+        'success': success,
+        'results': {fan_id: {'success': ok, 'message': message}
+                    for fan_id, (ok, message) in results.items()},
+        'fans': {fan_id: fan_registry.get(fan_id).state
+                 for fan_id in results if fan_registry.get(fan_id)}
+    }), 200 if success else 400
+
+
+@app.route('/api/fans/<fan_id>/status')
+def api_fan_status(fan_id):
+    """Status of a single fan."""
+    return jsonify(get_fan_or_404(fan_id).status())
+
+
+@app.route('/api/fans/<fan_id>/set_speed', methods=['POST'])
+def api_fan_set_speed(fan_id):
+    """Set the speed of a single fan."""
+    fan = get_fan_or_404(fan_id)
+    data = request.get_json()
+    speed = data.get('speed') if data else None
+
     if not speed:
-        return redirect(url_for('index'))
+        return jsonify({'error': 'Speed parameter required'}), 400
 
-    success, message = change_fan_speed(speed)
-    return redirect(url_for('index'))
+    success, message = fan.change_speed(speed, 'web')
+
+    if success:
+        return jsonify({
+            'success': True,
+            'message': message,
+            'current_state': fan.state
+        })
+    else:
+        return jsonify({'error': message}), 400
 
 
-def change_fan_speed(speed):
-    """Change the fan speed and update current state."""
-    speed = speed.lower()
+@app.route('/api/fans/<fan_id>/set_timer', methods=['POST'])
+def api_fan_set_timer(fan_id):
+    """Set or cancel the timer of a single fan."""
+    return set_timer_response(get_fan_or_404(fan_id), request.get_json())
+
+
+@app.route('/api/fans/<fan_id>/cycle_speed', methods=['POST'])
+def api_fan_cycle_speed(fan_id):
+    """Cycle the speed of a single fan."""
+    return cycle_speed_response(get_fan_or_404(fan_id))
+
+
+@app.route('/api/fans/<fan_id>/cycle_timer', methods=['POST'])
+def api_fan_cycle_timer(fan_id):
+    """Cycle the timer of a single fan."""
+    return cycle_timer_response(get_fan_or_404(fan_id))
 
-    # Validate speed
-    valid_speeds = ['off', 'low', 'med', 'high']
-    if speed not in valid_speeds:
-        return False, f"Invalid speed: {speed}. Must be one of {valid_speeds}"
 
+@app.route('/api/history')
+def api_history():
+    """A fan's speed over time, downsampled into fixed-width buckets.
+
+    Query: from and to (Unix times; default the last 24 hours), step
+    (bucket width in seconds) and fan (default fan if omitted).
+    """
+    fan = get_fan_or_404(request.args['fan']) if 'fan' in request.args else default_fan
     try:
-        # Set the fan speed
-        if speed == 'off':
-            fan_control.all_off()
-            # Cancel timers when manually turning off
-            cancel_timer()
-            cancel_safety_timer()
-        else:
-            fan_control.set_speed(speed)
-            # Start or reset safety timer when fan is turned on
-            start_safety_timer()
-
-        # Update current state
-        current_state['speed'] = speed
-        current_state['last_changed'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
-        message = f"Fan speed set to: {speed.upper()}"
-        if fan_control.MOCK_MODE:
-            message += " (MOCK MODE)"
-
-        return True, message
-
-    except Exception as e:
-        error_message = f"Error setting fan speed: {str(e)}"
-        return False, error_message
-
-
-def update_timer_remaining():
-    """Update the remaining time for an active timer."""
-    if timer_state['active'] and timer_state['end_time']:
-        now = datetime.now()
-        remaining = timer_state['end_time'] - now
-        if remaining.total_seconds() > 0:
-            remaining_seconds = remaining.total_seconds()
-            # Round up to next full minute for better display (shows 2:00 instead of 1:59)
-            timer_state['remaining_seconds'] = int(remaining_seconds) + (60 - int(remaining_seconds) % 60) if int(remaining_seconds) % 60 > 0 else int(remaining_seconds)
-        else:
-            timer_state['remaining_seconds'] = 0
-            if timer_state['active']:
-                # Timer expired, turn off fan
-                timer_expired()
+        timeline = speed_history.timeline(fan.fan_id,
+                                          start=request.args.get('from', type=float),
+                                          end=request.args.get('to', type=float),
+                                          step=request.args.get('step', type=float))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    timeline['history'] = speed_history.buffer_info()
+    return jsonify(timeline)
+
+
+@app.route('/api/usage')
+def api_usage():
+    """Hours at each speed and energy used, in total and per day.
+
+    Query: days (newest daily buckets, default 7) and fan (default fan if
+    omitted).
+    """
+    fan = get_fan_or_404(request.args['fan']) if 'fan' in request.args else default_fan
+    days = request.args.get('days', USAGE_DEFAULT_DAYS, type=int)
+    return jsonify(fan.usage_report(days))
+
+
+# === SCHEDULES ===
+
+@app.route('/api/schedules', methods=['GET', 'POST'])
+def api_schedules():
+    """List the recurring schedules, or create one.
+
+    POST body: {"speed": "low", "time": "22:00", "days": "weekdays"}, plus
+    optional "fan", "name" and "enabled". days is a list of weekday names
+    (mon..sun) or daily, weekdays or weekends.
+    """
+    if request.method == 'GET':
+        return jsonify({'schedules': schedule_book.list()})
+    try:
+        schedule = schedule_book.create(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'success': True, 'schedule': schedule}), 201
+
+
+@app.route('/api/schedules/<int:schedule_id>', methods=['GET', 'PUT', 'PATCH', 'DELETE'])
+def api_schedule(schedule_id):
+    """Read, change (only the fields given) or delete one schedule."""
+    if request.method == 'DELETE':
+        if not schedule_book.delete(schedule_id):
+            abort(404, description=f"Unknown schedule: {schedule_id}")
+        return jsonify({'success': True})
+    if request.method == 'GET':
+        schedule = schedule_book.get(schedule_id)
+    else:
+        try:
+            schedule = schedule_book.update(schedule_id, request.get_json(silent=True))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    if schedule is None:
+        abort(404, description=f"Unknown schedule: {schedule_id}")
+    return jsonify({'success': True, 'schedule': schedule})
 
 
-def set_timer(hours):
-    """Set a timer for the specified number of hours."""
-    global timer_thread
+# === SENSORS ===
 
-    # Cancel existing timer
-    cancel_timer()
+@app.route('/api/sensors')
+def api_sensors():
+    """Latest reading of every sensor and the state of each auto mode fan."""
+    return jsonify(sensor_hub.status())
 
-    # Set new timer
-    timer_state['active'] = True
-    timer_state['duration_hours'] = hours
-    timer_state['start_time'] = datetime.now()
-    timer_state['end_time'] = timer_state['start_time'] + timedelta(hours=hours)
-    timer_state['remaining_seconds'] = hours * 3600
 
-    # Start timer thread
-    timer_thread = threading.Thread(target=timer_worker)
-    timer_thread.daemon = True
-    timer_thread.start()
+@app.route('/api/sensors/auto', methods=['POST'])
+def api_sensors_auto():
+    """Switch auto mode on or off: {"enabled": true|false, "fan": id (default fan if omitted)}."""
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data.get('enabled'), bool):
+        return jsonify({'error': 'enabled must be true or false'}), 400
+    fan_id = data.get('fan') or default_fan.fan_id
+    if not sensor_hub.set_auto(fan_id, data['enabled']):
+        return jsonify({'error': f"No auto mode configured for fan: {fan_id}"}), 404
+    return jsonify({'success': True, 'auto': sensor_hub.status()['auto'][fan_id]})
 
-    return True, f"Timer set for {hours} hour{'s' if hours != 1 else ''}"
 
+# === DEBUG ===
 
-def cancel_timer():
-    """Cancel the active timer."""
-    timer_state['active'] = False
-    timer_state['duration_hours'] = 0
-    timer_state['start_time'] = None
-    timer_state['end_time'] = None
-    timer_state['remaining_seconds'] = 0
+@app.route('/api/debug/log')
+def api_debug_log():
+    """Recent log records from the in-memory ring buffer.
 
+    Query: limit, level (minimum level name), logger (name prefix, e.g.
+    fan_control.buttons) and since (only records after this seq).
+    """
+    try:
+        records = ring_buffer.recent(limit=request.args.get('limit', type=int),
+                                     level=request.args.get('level'),
+                                     logger=request.args.get('logger'),
+                                     since=request.args.get('since', 0, type=int))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'records': records, 'capacity': ring_buffer.records.maxlen})
+
+
+@app.route('/api/debug/trace', methods=['GET', 'POST'])
+def api_debug_trace():
+    """Recent traces (button presses, HTTP requests) as a span timeline.
+
+    GET query: limit (newest traces), name (span name prefix, e.g. button)
+    and format=chrome for Chrome trace events (open in ui.perfetto.dev).
+    POST {"enabled": true|false, "clear": true} switches tracing on or off
+    and empties the buffer.
+    """
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        if data.get('enabled') is True:
+            tracing.enable()
+        elif data.get('enabled') is False:
+            tracing.disable()
+        if data.get('clear'):
+            tracing.clear()
+        return jsonify({'enabled': tracing.enabled})
+
+    limit = request.args.get('limit', type=int)
+    name = request.args.get('name')
+    if request.args.get('format') == 'chrome':
+        return jsonify(tracing.chrome_trace(limit, name))
+    return jsonify({'enabled': tracing.enabled, 'capacity': tracing.TRACE_BUFFER_SIZE,
+                    'traces': tracing.timeline(limit, name)})
+
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Counters and histograms in the Prometheus text format."""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
 
-def timer_expired():
-    """Handle timer expiration by turning off the fan."""
-    change_fan_speed('off')
 
+def handle_speed_change(speed):
+    """Handle speed change and redirect back to main page."""
+    if not speed:
+        return redirect(url_for('index'))
 
-def start_safety_timer():
-    """Start or reset the 6-hour safety timer."""
-    global safety_timer_thread
+    success, message = change_fan_speed(speed)
+    return redirect(url_for('index'))
 
-    # Cancel existing safety timer
-    cancel_safety_timer()
 
-    # Only start safety timer if fan is not off
-    if current_state['speed'] == 'off':
-        return
+def change_fan_speed(speed, fan_id=None, source='web'):
+    """Change the fan speed and update current state."""
+    fan = fan_registry.get(fan_id) if fan_id else default_fan
+    if fan is None:
+        return False, f"Unknown fan: {fan_id}"
+    return fan.change_speed(speed, source)
 
-    # Set new safety timer
-    safety_timer_state['active'] = True
-    safety_timer_state['start_time'] = datetime.now()
-    safety_timer_state['remaining_seconds'] = safety_timer_state['max_hours'] * 3600
 
-    # Start safety timer thread
-    safety_timer_thread = threading.Thread(target=safety_timer_worker)
-    safety_timer_thread.daemon = True
-    safety_timer_thread.start()
+def run_schedule(schedule):
+    """Schedule action: the same speed change as a web request, safety timer included."""
+    return change_fan_speed(schedule.speed, schedule.fan, source='schedule')
 
-    print(f"Safety timer started: Fan will auto-stop after {safety_timer_state['max_hours']} hours of continuous operation")
 
+# Recurring schedules, loaded and armed by start_hardware()
+schedule_book = ScheduleBook(fan_registry, run_schedule)
 
-def cancel_safety_timer():
-    """Cancel the safety timer."""
-    safety_timer_state['active'] = False
-    safety_timer_state['start_time'] = None
-    safety_timer_state['remaining_seconds'] = 0
+# Sensors and auto mode, configured and started by start_hardware()
+sensor_hub = SensorHub(fan_registry)
+
+
+def set_timer(hours):
+    """Set a timer for the specified number of hours."""
+    return default_fan.set_timer(hours)
 
 
-def safety_timer_worker():
-    """Background thread for safety timer countdown."""
-    while safety_timer_state['active'] and safety_timer_state['remaining_seconds'] > 0:
-        time.sleep(1)
-        if safety_timer_state['active']:
-            safety_timer_state['remaining_seconds'] -= 1
+def cancel_timer():
+    """Cancel the active timer."""
+    default_fan.cancel_timer()
 
-    # Safety timer expired
-    if safety_timer_state['active'] and safety_timer_state['remaining_seconds'] <= 0:
-        print("SAFETY TIMER EXPIRED: Fan has been running for 6+ hours. Automatically turning off for safety.")
-        safety_timer_expired()
+
+def start_safety_timer():
+    """Start or reset the 6-hour safety timer."""
+    default_fan.start_safety_timer()
+
+
+def cancel_safety_timer():
+    """Cancel the safety timer."""
+    default_fan.cancel_safety_timer()
 
 
 def safety_timer_expired():
     """Handle safety timer expiration by forcing fan off."""
-    safety_timer_state['active'] = False
-    # Force fan off for safety
-    fan_control.all_off()
-    current_state['speed'] = 'off'
-    current_state['last_changed'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-    # Also cancel regular timer if active
-    cancel_timer()
-
-
-def update_safety_timer_remaining():
-    """Update safety timer remaining time."""
-    if safety_timer_state['active'] and safety_timer_state['start_time']:
-        elapsed = datetime.now() - safety_timer_state['start_time']
-        total_seconds = safety_timer_state['max_hours'] * 3600
-        remaining = max(0, total_seconds - int(elapsed.total_seconds()))
-        safety_timer_state['remaining_seconds'] = remaining
-    else:
-        safety_timer_state['remaining_seconds'] = 0
+    default_fan.safety_timer_expired()
 
 
 def timer_expired():
     """Handle timer expiration."""
-    timer_state['active'] = False
-    change_fan_speed('off')
-    print("Timer expired - Fan turned off automatically")
-
-
-def timer_worker():
-    """Background worker thread to monitor timer expiration."""
-    while timer_state['active']:
-        update_timer_remaining()
-        if timer_state['remaining_seconds'] <= 0 and timer_state['active']:
-            timer_expired()
-            break
-        time.sleep(1)  # Check every second
+    default_fan.timer_expired()
 
 
 # === BUTTON INTEGRATION CALLBACKS ===
@@ -445,97 +651,139 @@ def timer_worker():
 def handle_button_speed_change(new_speed):
     """Callback function for hardware button speed changes"""
     try:
-        print(f"Hardware button changed speed to: {new_speed}")
+        log.info("Hardware button changed speed to: %s", new_speed)
 
         # Use the same change_fan_speed function that the web interface uses
-        success, message = change_fan_speed(new_speed)
+        success, message = change_fan_speed(new_speed, source='button')
         if success:
-            print(f"Speed changed via button: {message}")
+            log.info("Speed changed via button: %s", message)
         else:
-            print(f"Error changing speed via button: {message}")
-    except Exception as e:
-        print(f"Exception in button speed callback: {e}")
-        import traceback
-        traceback.print_exc()
+            log.error("Error changing speed via button: %s", message)
+    except Exception:
+        log.exception("Exception in button speed callback")
 def handle_button_timer_change(new_timer):
     """Callback function for hardware button timer changes"""
     try:
-        print(f"Hardware button changed timer to: {new_timer}")
+        log.info("Hardware button changed timer to: %s", new_timer)
 
         if new_timer == 'off':
             cancel_timer()
-            print("Timer cancelled via button")
+            log.info("Timer cancelled via button")
         else:
             # Convert timer state to hours
             timer_hours = {'1hr': 1, '2hr': 2, '4hr': 4}.get(new_timer, 0)
             if timer_hours > 0:
                 success, message = set_timer(timer_hours)
                 if success:
-                    print(f"Timer set via button: {message}")
+                    log.info("Timer set via button: %s", message)
                 else:
-                    print(f"Error setting timer via button: {message}")
-    except Exception as e:
-        print(f"Exception in button timer callback: {e}")
-        import traceback
-        traceback.print_exc()
+                    log.error("Error setting timer via button: %s", message)
+    except Exception:
+        log.exception("Exception in button timer callback")
 # Register the callback functions with fan_control
 try:
-    print("Registering hardware button callbacks...")
+    log.debug("Registering hardware button callbacks...")
 
     # Check if the registration functions exist
     if hasattr(fan_control, 'register_speed_change_callback'):
         fan_control.register_speed_change_callback(handle_button_speed_change)
-        print("  ✓ Speed button callback registered")
+        log.debug("  ✓ Speed button callback registered")
     else:
-        print("  ⚠️  register_speed_change_callback function not found")
+        log.warning("  ⚠️  register_speed_change_callback function not found")
 
     if hasattr(fan_control, 'register_timer_change_callback'):
         fan_control.register_timer_change_callback(handle_button_timer_change)
-        print("  ✓ Timer button callback registered")
+        log.debug("  ✓ Timer button callback registered")
     else:
-        print("  ⚠️  register_timer_change_callback function not found")
+        log.warning("  ⚠️  register_timer_change_callback function not found")
 
-    print("✓ Hardware button callbacks registered successfully")
-except Exception as e:
-    print(f"⚠️  Error registering button callbacks: {e}")
-    print("Buttons may not work, but web interface will still function")
-    import traceback
-    traceback.print_exc()
+    log.debug("✓ Hardware button callbacks registered successfully")
+except Exception:
+    log.exception("⚠️  Error registering button callbacks - buttons may not work, "
+                  "but web interface will still function")
 
 
 def cleanup_gpio():
     """Clean up GPIO on shutdown"""
+    if control_server is not None:
+        control_server.stop()
+    schedule_book.stop()
+    sensor_hub.stop()
+    if state_journal is not None:
+        state_journal.close()
+    if usage_store is not None:
+        usage_store.close()
+    timer_scheduler.stop()
+    hardware_owner.stop()
+
     # Stop button polling if it's running
     try:
         if hasattr(fan_control, 'stop_button_polling'):
             fan_control.stop_button_polling()
+        fan_control.button_events.stop()
     except:
         pass
 
     if not fan_control.MOCK_MODE:
         try:
             fan_control.GPIO.cleanup()
-            print("GPIO cleaned up")
+            log.info("GPIO cleaned up")
         except:
             pass  # Ignore cleanup errors
 
 
-if __name__ == '__main__':
+def start_hardware():
+    """Claim the GPIO for this process and put every fan in its startup state.
+
+    Call once, in the process that serves requests (see serve.py).
+    """
     import atexit
+
+    global control_server, state_journal, usage_store
+
+    fan_control.acquire_gpio_lock()
+    fan_control.init()
     atexit.register(cleanup_gpio)
 
+    # Runtime and energy totals carry on from the last run
+    usage_store = UsageStore()
+    usage_store.attach(fan_registry)
+
+    # Bring back each fan's last speed and timers (off if it has none), then
+    # journal every change from here on
+    state_journal = StateJournal()
+    state_journal.restore(fan_registry)
+    state_journal.attach(fan_registry)
+
+    # Recurring schedules and sensor-driven auto mode run from here on
+    schedule_book.start()
+    sensor_hub.start()
+
+    # Serve the CLI and scripts from this process, so they share its state
+    control_server = ControlServer(fan_registry)
+    control_server.start()
+
+
+# One latency series per route, plus one for requests that matched none
+for rule in app.url_map.iter_rules():
+    metrics.http_request_seconds.add(rule.endpoint, route=rule.rule)
+metrics.http_request_seconds.add(None, route='unmatched')
+
+
+if __name__ == '__main__':
     print("Starting Fan Control Web Interface...")
     print(f"Mock Mode: {fan_control.MOCK_MODE}")
     print("Access the interface at: http://localhost:5002")
+    print("(Development server - use ./serve.py for production)")
 
-    # Initialize to off state
-    change_fan_speed('off')
+    start_hardware()
 
     try:
         # Run the Flask app
-        # Disable debug mode on Raspberry Pi to avoid GPIO conflicts from app restart
-        debug_mode = fan_control.MOCK_MODE  # Only enable debug in mock mode
-        app.run(host='0.0.0.0', port=5002, debug=debug_mode)
+        # Debug mode only in mock mode. The reloader stays off in every mode:
+        # it runs the app in a second process, which would initialize GPIO twice.
+        debug_mode = fan_control.MOCK_MODE
+        app.run(host='0.0.0.0', port=5002, debug=debug_mode, use_reloader=False)
     except KeyboardInterrupt:
         print("\nShutting down...")
         cleanup_gpio()
\ No newline at end of file